@@ -1,6 +1,20 @@
-from flask import Flask, request, render_template, jsonify
-from belief_graph import similar_to, all_queries
-from conspiracy_generator import load_dataset, filter_docs, build_context, generate_conspiracy
+import hmac
+import json
+import os
+import re
+import time
+from flask import Flask, Response, abort, g, request, render_template, jsonify, send_file, stream_with_context
+from artifacts import get_engine, get_reloader, install_signal_handler, set_current
+from conspiracy_generator import (generate_story, stream_story, get_story_cache, get_scheduler, QueueFull,
+                                  STORY_DEADLINE, STORY_MODEL, PROMPT_VERSION, deadline_stats)
+from ollama_client import OllamaError, get_client
+from image_service import get_image_service, ImageQueueFull, IMAGE_STEPS, DONE, ERROR
+from speculation import get_speculator
+import assets
+import metrics
+from profiler import ADMIN_TOKEN, ProfilingMiddleware, get_profiler
+from warmup import get_query_log, get_warmup
+from evidence_image import SD_MODEL_ID
 
 
 
@@ -9,32 +23,337 @@ app = Flask(
     __name__,
     static_url_path='/static'                               # <― mount them at /static
 )
-dataset = load_dataset("raw_data/final_data/all_spacy_concepts_final.json")
+# graph model and corpus of the current artifact version; hot-reloadable, see artifacts.py
+get_engine()
+# compile the page template now rather than on the first request
+app.jinja_env.get_template('template2.html')
+# hashed, precompressed static files when `python assets.py` has been run;
+# a stale build is rebuilt under the development server and fails startup otherwise
+assets.init_app(app, rebuild=__name__ == '__main__' or os.getenv("FLASK_DEBUG") == "1")
+# profiles sampled requests once switched on via /admin/profile
+app.wsgi_app = ProfilingMiddleware(app.wsgi_app, get_profiler())
 
 
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+    # picks up newly published artifact versions (background reload)
+    get_reloader().check()
+
+@app.after_request
+def _record_request(response):
+    # for streamed responses this is the time until the stream starts
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.histogram("request_seconds", route=route, method=request.method).observe(time.perf_counter() - start)
+        metrics.inc("responses", route=route, status=str(response.status_code))
+    return response
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     query = ''
     results = []
-    dataset = 'all_spacy_concepts_final.json' 
+    graph = get_engine().graph
 
     if request.method == 'POST':
         query = request.form.get('query', '')
-        results = similar_to(query)
+        results = graph.similar_to(query)
+        get_query_log().record_query(query)
+    elif request.args.get('query'):
+        # URLs pushed by graph.js (/?query=...) work on reload and when shared
+        query = request.args['query']
+        results = graph.similar_to(query)
+        get_query_log().record_query(query)
         
-    return render_template('template2.html', results=results, query=query, all_queries = all_queries)
+    with metrics.span("render_template"):
+        return render_template('template2.html', results=results, query=query, all_queries = graph.all_queries)
+
+@app.route('/api/neighbors')
+def api_neighbors():
+    """Neighbors of one node as JSON, for in-place graph navigation."""
+    query = request.args.get('query', '').strip()
+    if not query:
+        return jsonify({ "error": "missing query" }), 400
+    results = get_engine().graph.similar_to(query)
+    get_query_log().record_query(query)
+    return jsonify({ "query": query, "results": results })
+
+def _busy(e: QueueFull):
+    """429 for a saturated generation queue: shed load instead of piling more work onto Ollama."""
+    resp = jsonify({ "error": "busy", "retry_after": e.retry_after })
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
+def _story_request(payload):
+    """(clicked, session) of a story request, or None unless clicked is a list of strings."""
+    if not isinstance(payload, dict):
+        return None
+    clicked, session = payload.get('clicked', []), payload.get('session')
+    if not isinstance(clicked, list) or not all(isinstance(c, str) for c in clicked):
+        return None
+    if session is not None and not isinstance(session, str):
+        return None
+    return clicked, session
+
+_BAD_STORY_REQUEST = { "error": "clicked must be a list of strings and session a string" }
 
 @app.route('/process_clicks', methods=['GET', 'POST'])
 def process_clicks():
-    payload = request.get_json() or {}
-    clicked = payload.get('clicked', [])
+    parsed = _story_request(request.get_json() or {})
+    if parsed is None:
+        return jsonify(_BAD_STORY_REQUEST), 400
+    clicked, session = parsed
+    get_query_log().record_clicks(clicked)
+    # past the deadline a degraded story is returned instead of waiting on Ollama
+    deadline = time.monotonic() + STORY_DEADLINE if STORY_DEADLINE > 0 else None
 
-    docs    = filter_docs(dataset, clicked)
-    context = build_context(clicked, docs)
-    story   = generate_conspiracy(context)
+    remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+    story = get_speculator().claim(session, clicked, timeout=remaining)
+    if story is not None:
+        return jsonify({ "story": story, "cached": True, "speculative": True })
+    try:
+        story, info = generate_story(get_engine().dataset, clicked, deadline=deadline)
+    except QueueFull as e:
+        return _busy(e)
+    except Exception as e:
+        # generation failures fall back inside generate_story; anything else is still JSON
+        app.logger.exception("story generation failed")
+        return jsonify({ "error": "unavailable", "detail": f"{type(e).__name__}: {e}" }), 503
 
     # return plain JSON, not a template
-    return jsonify({ "story": story })
+    return jsonify({ "story": story, **info })
+
+def _sse(data: dict, event: str = None) -> str:
+    """Format one server-sent event; payloads are JSON so newlines survive."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.route('/process_clicks/stream', methods=['POST'])
+def process_clicks_stream():
+    """Streaming variant of /process_clicks: forwards story tokens as server-sent events."""
+    parsed = _story_request(request.get_json() or {})
+    if parsed is None:
+        return jsonify(_BAD_STORY_REQUEST), 400
+    clicked, session = parsed
+    get_query_log().record_clicks(clicked)
+
+    # the same deadline as /process_clicks, measured to the first token
+    deadline = time.monotonic() + STORY_DEADLINE if STORY_DEADLINE > 0 else None
+
+    docs = get_engine().dataset
+    tokens = get_speculator().stream(session, docs, clicked, deadline=deadline)
+    if tokens is not None:
+        info = { "cached": False, "speculative": True }
+    else:
+        try:
+            info, tokens = stream_story(docs, clicked, deadline=deadline)
+        except QueueFull as e:
+            return _busy(e)
+
+    def events():
+        # first frame goes out before Ollama is contacted so the client can show progress
+        yield _sse(info, event="start")
+        try:
+            for token in tokens:
+                yield _sse({"token": token})
+        except OllamaError as e:
+            yield _sse({"error": str(e)}, event="error")
+            return
+        yield _sse({}, event="done")
+
+    # if the browser goes away, werkzeug closes the generator; the generation itself
+    # keeps its scheduler slot until it finishes, and its story is cached
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/speculate', methods=['POST'])
+def speculate():
+    """Opt-in click-path reports from graph.js; may start a background story."""
+    parsed = _story_request(request.get_json(force=True, silent=True) or {})
+    if parsed is None:
+        return jsonify(_BAD_STORY_REQUEST), 400
+    clicked, session = parsed
+    get_speculator().observe(session, get_engine().dataset, clicked)
+    return ('', 204)
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+def _job_json(job: dict) -> dict:
+    out = { "job_id": job["job_id"], "status": job["status"] }
+    if job["status"] == DONE:
+        out["url"] = f"/evidence_image/{job['job_id']}/image"
+    if job.get("error"):
+        out["error"] = job["error"]
+    return out
+
+def _get_job(job_id: str) -> dict:
+    job = get_image_service().status(job_id) if _JOB_ID.match(job_id) else None
+    if job is None:
+        abort(404)
+    return job
+
+@app.route('/evidence_image', methods=['POST'])
+def evidence_image():
+    """Submit an evidence-image job for a story; returns immediately with a job id."""
+    payload = request.get_json() or {}
+    summary = payload.get('summary', '')
+    if not summary:
+        return jsonify({ "error": "summary is required" }), 400
+    try:
+        steps = int(payload.get('steps', IMAGE_STEPS))
+        seed = None if payload.get('seed') is None else int(payload['seed'])
+    except (TypeError, ValueError):
+        return jsonify({ "error": "steps and seed must be integers" }), 400
+    try:
+        job = get_image_service().submit(summary, payload.get('clicked', []), seed=seed, steps=steps)
+    except ImageQueueFull:
+        return jsonify({ "error": "busy" }), 429, { "Retry-After": "30" }
+    return jsonify(_job_json(job)), (200 if job["status"] == DONE else 202)
+
+@app.route('/evidence_image/<job_id>')
+def evidence_image_status(job_id):
+    return jsonify(_job_json(_get_job(job_id)))
+
+@app.route('/evidence_image/<job_id>/events')
+def evidence_image_events(job_id):
+    """Server-sent status updates until the job finishes."""
+    job = _get_job(job_id)
+
+    def events():
+        last = None
+        while True:
+            current = get_image_service().status(job_id) or job
+            if current["status"] != last:
+                last = current["status"]
+                yield _sse(_job_json(current), event=last)
+            if last in (DONE, ERROR):
+                return
+            time.sleep(0.5)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/evidence_image/<job_id>/image')
+def evidence_image_file(job_id):
+    job = _get_job(job_id)
+    if job["status"] != DONE:
+        abort(404)
+    # content-addressed, so the file behind a job id never changes
+    return send_file(os.path.abspath(job["path"]), mimetype='image/png', max_age=31536000)
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and answering requests."""
+    return jsonify({ "status": "ok" })
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 503 until this worker has finished warming up (see warmup.py)."""
+    warmup = get_warmup()
+    if not warmup.ready and warmup.runs == 0:
+        # servers that do not start the warm-up themselves (gunicorn.conf.py does)
+        warmup.start()
+    status = warmup.status()
+    return jsonify(status), (200 if status["ready"] else 503)
+
+@app.route('/stats')
+def stats():
+    return jsonify({ "story_cache": get_story_cache().stats(), "scheduler": get_scheduler().stats(),
+                     "images": get_image_service().stats(), "speculation": get_speculator().stats(),
+                     "ollama": get_client().stats(), "deadline": deadline_stats(),
+                     "artifacts": get_reloader().status(), "warmup": get_warmup().status() })
+
+def _require_admin():
+    """404 unless ADMIN_TOKEN is set and sent as a bearer token (or X-Admin-Token)."""
+    sent = request.headers.get('Authorization', '')
+    sent = sent[7:] if sent.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(sent.encode(), ADMIN_TOKEN.encode()):
+        abort(404)
+
+@app.route('/admin/reload', methods=['GET', 'POST'])
+def admin_reload():
+    """Hot reload in the background (POST, optionally {"version": ...} to switch CURRENT first)."""
+    _require_admin()
+    reloader = get_reloader()
+    if request.method == 'GET':
+        return jsonify(reloader.status())
+    payload = request.get_json(silent=True) or {}
+    if payload.get('version'):
+        # other workers follow within ARTIFACT_POLL seconds
+        try:
+            set_current(str(payload['version']))
+        except ValueError as e:
+            return jsonify({ "error": str(e) }), 400
+    started = reloader.reload_async(force=not payload.get('version'))
+    return jsonify({ "started": started, **reloader.status() }), 202
+
+@app.route('/admin/warmup', methods=['POST'])
+def admin_warmup():
+    """Run the warm-up again in the background (the worker stays ready meanwhile)."""
+    _require_admin()
+    started = get_warmup().start()
+    return jsonify({ "started": started, **get_warmup().status() }), 202
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """Switch request profiling on (POST {rate, duration, mode, paths}) or off (DELETE)."""
+    _require_admin()
+    profiler = get_profiler()
+    if request.method == 'POST':
+        payload = request.get_json() or {}
+        try:
+            profiler.configure(float(payload.get('rate', 0.1)), float(payload.get('duration', 60)),
+                               payload.get('mode', 'sample'), payload.get('paths'))
+        except (TypeError, ValueError) as e:
+            return jsonify({ "error": str(e) }), 400
+    elif request.method == 'DELETE':
+        profiler.disable()
+    return jsonify(profiler.status())
+
+def _metric_samples():
+    cache, sched = get_story_cache().stats(), get_scheduler().stats()
+    images, spec = get_image_service().stats(), get_speculator().stats()
+    ollama, deadline = get_client().stats(), deadline_stats()
+    engine, reloader = get_engine(), get_reloader()
+    yield ("model_info", "gauge", "Models and prompt version in use.",
+           {"story_model": STORY_MODEL, "prompt_version": PROMPT_VERSION,
+            "artifact_version": engine.version, "graph_nodes": str(len(engine.graph.all_queries)),
+            "image_model": SD_MODEL_ID}, 1)
+    yield ("artifact_reloads_total", "counter", "Artifact versions swapped in.", {}, reloader.reloads)
+    yield ("artifact_reload_failures_total", "counter", "Artifact versions that failed to load.", {},
+           reloader.failures)
+    yield ("story_cache_hits_total", "counter", "Story cache hits.", {}, cache["hits"])
+    yield ("story_cache_misses_total", "counter", "Story cache misses.", {}, cache["misses"])
+    yield ("story_cache_hit_ratio", "gauge", "Story cache hit ratio since start.", {}, cache["hit_rate"])
+    yield ("story_cache_entries", "gauge", "Stories held in memory.", {}, cache["size"])
+    yield ("story_queue_depth", "gauge", "Story jobs waiting for a worker.", {}, sched["queue_depth"])
+    yield ("story_running", "gauge", "Story jobs running.", {}, sched["running"])
+    yield ("story_rejected_total", "counter", "Story jobs shed with 429.", {}, sched["rejected"])
+    yield ("story_coalesced_total", "counter", "Story requests that joined an identical job.", {}, sched["coalesced"])
+    yield ("story_deadline_hits_total", "counter", "Stories answered with a fallback after the deadline.", {},
+           deadline["deadline_hits"])
+    yield ("story_error_hits_total", "counter", "Stories answered with a fallback after a failed generation.", {},
+           deadline["error_hits"])
+    for fallback in ("overlap", "partial", "template"):
+        yield ("story_fallback_total", "counter", "Degraded answers by fallback.", {"fallback": fallback},
+               deadline[fallback])
+    yield ("speculation_hit_ratio", "gauge", "Speculative stories claimed.", {}, spec["hit_rate"])
+    yield ("ollama_prompt_eval_seconds_total", "counter", "Prompt evaluation time reported by Ollama.", {},
+           ollama["prompt_eval_seconds"])
+    yield ("ollama_prompt_eval_tokens_total", "counter", "Prompt tokens evaluated by Ollama.", {},
+           ollama["prompt_eval_count"])
+    yield ("image_jobs_pending", "gauge", "Evidence image jobs queued or running.", {}, images["pending"])
+    yield ("image_cache_hits_total", "counter", "Evidence images served from disk.", {}, images["cache_hits"])
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latency histograms, cache and queue gauges in Prometheus text format."""
+    return Response(metrics.render(_metric_samples()), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=False)
+    # development server only; production runs `gunicorn -c gunicorn.conf.py wsgi:app`
+    install_signal_handler()
+    get_warmup().start()
+    app.run(host='0.0.0.0', port=5001, debug=os.getenv("FLASK_DEBUG", "1") == "1", use_reloader=False)
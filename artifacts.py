@@ -0,0 +1,314 @@
+"""
+artifacts.py
+
+Versioned serving artifacts and hot reload of the graph model, corpus and
+concept index without restarting the server.
+
+ARTIFACT_DIR/<version>/ holds one complete set, belief_node2vec.model and
+corpus.seg (see corpus.py), and ARTIFACT_DIR/CURRENT names the version to
+serve. Publishing fills a new version directory and then replaces CURRENT
+atomically; rolling back is pointing CURRENT at an older version. Without
+CURRENT the files in the repo are served (belief_node2vec.model and the
+dataset under raw_data/final_data) as version "base-<mtime>".
+
+An Engine is one loaded version. Requests call get_engine() once and use
+that engine to the end, so in-flight requests (and SSE streams) finish on
+the version they started with. A reload builds the new Engine in a
+background thread while the old one keeps serving, runs the `prepare`
+callbacks on it (warmup.py fills its neighbor cache), then swaps it in with
+a single assignment; if loading fails the old engine stays and the error is
+reported in /stats. Caches follow the version: story cache keys include it
+and the neighbor cache belongs to the engine's graph.
+
+A reload is triggered by
+- the served version no longer being current (CURRENT replaced, or the base
+  files changed); each worker checks at most every ARTIFACT_POLL seconds,
+  on requests, so one publish reaches every gunicorn worker
+- SIGUSR2 sent to a worker (or to `python app.py`)
+- POST /admin/reload, optionally with {"version": ...} to switch CURRENT
+
+Usage:
+    python artifacts.py publish --model belief_node2vec.model \\
+        --dataset raw_data/final_data/all_spacy_concepts_final.json [--version 2025-05-01]
+    python artifacts.py use 2025-05-01      # switch (or roll back) CURRENT
+    python artifacts.py list
+
+Configuration (environment):
+- ARTIFACT_DIR   versioned artifact directory (default "artifacts")
+- ARTIFACT_POLL  seconds between checks for a new version, 0 = only on
+                 signal or admin request (default 5)
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import signal
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+from corpus import Corpus, segment_path
+from metrics import observe
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+ARTIFACT_POLL = float(os.getenv("ARTIFACT_POLL", "5"))
+
+BASE_MODEL = "belief_node2vec.model"
+BASE_DATASET = "raw_data/final_data/all_spacy_concepts_final.json"
+MODEL_FILE = "belief_node2vec.model"
+CORPUS_FILE = "corpus.seg"
+_CURRENT_FILE = "CURRENT"
+_VERSION = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+class ArtifactSet(NamedTuple):
+    version: str
+    model: str      # node2vec model path
+    dataset: str    # corpus segment (or dataset JSON) path, see conspiracy_generator.load_dataset
+
+
+def current(directory: str = ARTIFACT_DIR) -> ArtifactSet:
+    """The artifact set that should be served right now."""
+    try:
+        with open(os.path.join(directory, _CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        version = ""
+    if version:
+        path = os.path.join(directory, version)
+        return ArtifactSet(version, os.path.join(path, MODEL_FILE), os.path.join(path, CORPUS_FILE))
+    mtimes = [os.path.getmtime(p) for p in (BASE_MODEL, BASE_DATASET, segment_path(BASE_DATASET))
+              if os.path.exists(p)]
+    return ArtifactSet(f"base-{int(max(mtimes, default=0)):x}", BASE_MODEL, BASE_DATASET)
+
+
+def versions(directory: str = ARTIFACT_DIR) -> List[str]:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names if _VERSION.match(n) and os.path.isdir(os.path.join(directory, n)))
+
+
+def set_current(version: str, directory: str = ARTIFACT_DIR):
+    """Atomically point CURRENT at an already published version."""
+    if not _VERSION.match(version) or not os.path.isdir(os.path.join(directory, version)):
+        raise ValueError(f"unknown artifact version: {version!r}")
+    tmp = os.path.join(directory, f"{_CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp, os.path.join(directory, _CURRENT_FILE))
+
+
+def publish(model_path: str, dataset_path: str, version: Optional[str] = None,
+            directory: str = ARTIFACT_DIR, activate: bool = True) -> str:
+    """
+    Copy a trained model and build the corpus segment for a dataset JSON into
+    a new version directory, check that both load, then make it CURRENT.
+    """
+    from gensim.models import Word2Vec
+
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    if not _VERSION.match(version):
+        raise ValueError(f"bad version name: {version!r}")
+    final = os.path.join(directory, version)
+    if os.path.exists(final):
+        raise ValueError(f"version {version} already exists")
+    tmp = os.path.join(directory, f".{version}.{os.getpid()}.tmp")
+    os.makedirs(tmp)
+    try:
+        # gensim may store large arrays next to the model as <model>.<suffix>
+        model_dir, model_name = os.path.split(model_path)
+        for name in os.listdir(model_dir or "."):
+            if name == model_name or name.startswith(model_name + "."):
+                shutil.copy2(os.path.join(model_dir, name), os.path.join(tmp, MODEL_FILE + name[len(model_name):]))
+        with open(dataset_path, encoding="utf-8") as f:
+            Corpus.from_records(json.load(f)).write_segment(os.path.join(tmp, CORPUS_FILE))
+        Word2Vec.load(os.path.join(tmp, MODEL_FILE))
+        Corpus.open_segment(os.path.join(tmp, CORPUS_FILE))
+        os.rename(tmp, final)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    if activate:
+        set_current(version, directory)
+    return version
+
+
+class Engine:
+    """One loaded artifact version: graph model (with its neighbor cache) and corpus."""
+
+    def __init__(self, artifacts: ArtifactSet, graph, dataset: Corpus):
+        self.version = artifacts.version
+        self.artifacts = artifacts
+        self.graph = graph
+        self.dataset = dataset
+        self.loaded_at = time.time()
+
+
+def load_engine(artifacts: ArtifactSet) -> Engine:
+    from belief_graph import BeliefGraph
+    from conspiracy_generator import load_dataset
+
+    graph = BeliefGraph.load(artifacts.model, artifacts.version)
+    return Engine(artifacts, graph, load_dataset(artifacts.dataset, artifacts.version))
+
+
+class Reloader:
+    """Holds the serving Engine and replaces it when a new version is published."""
+
+    def __init__(self, directory: str = ARTIFACT_DIR, poll: float = ARTIFACT_POLL):
+        self.directory = directory
+        self.poll = poll
+        self._engine: Optional[Engine] = None
+        self._lock = threading.Lock()
+        self._loading: Optional[threading.Thread] = None
+        self._failed_version: Optional[str] = None
+        self._next_check = 0.0
+        self.reloads = self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_reload_seconds: Optional[float] = None
+        # called with a freshly loaded Engine before it starts serving
+        self.prepare: List[Callable[[Engine], None]] = []
+
+    def engine(self) -> Engine:
+        engine = self._engine
+        if engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = self._initial()
+                engine = self._engine
+        return engine
+
+    def _initial(self) -> Engine:
+        # the model belief_graph loaded at import, so it is not loaded twice
+        import belief_graph
+        from conspiracy_generator import load_dataset
+
+        artifacts = belief_graph.ARTIFACTS
+        return Engine(artifacts, belief_graph.get_graph(), load_dataset(artifacts.dataset, artifacts.version))
+
+    def check(self):
+        """Start a background reload if a new version is current (at most every `poll` seconds)."""
+        if self.poll <= 0:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.poll
+        version = current(self.directory).version
+        # a version that failed to load is retried only when it changes again (or on request)
+        if version != self.engine().version and version != self._failed_version:
+            self.reload_async()
+
+    def reload_async(self, force: bool = False) -> bool:
+        """Reload in a background thread; False if a reload is already running."""
+        with self._lock:
+            if self._loading is not None and self._loading.is_alive():
+                return False
+            self._loading = threading.Thread(target=self.reload, kwargs={"force": force},
+                                             name="artifact-reload", daemon=True)
+            self._loading.start()
+            return True
+
+    def reload(self, force: bool = False) -> Engine:
+        """Load the current version and swap it in; the old engine stays if loading fails."""
+        old = self.engine()
+        artifacts = current(self.directory)
+        if artifacts.version == old.version and not force:
+            return old
+        start = time.monotonic()
+        try:
+            engine = load_engine(artifacts)
+        except Exception as e:
+            self.failures += 1
+            self._failed_version = artifacts.version
+            self.last_error = f"{artifacts.version}: {type(e).__name__}: {e}"
+            print(f"Reload of artifact version {artifacts.version} failed, still serving {old.version}: {e}")
+            return old
+        for prepare in self.prepare:
+            try:
+                prepare(engine)
+            except Exception as e:
+                print(f"Preparing artifact version {artifacts.version} failed, serving it cold: {e}")
+        import belief_graph
+
+        with self._lock:
+            self._engine = engine
+        belief_graph.set_graph(engine.graph)
+        self.reloads += 1
+        self._failed_version = self.last_error = None
+        self.last_reload_seconds = time.monotonic() - start
+        observe("artifact_reload", self.last_reload_seconds)
+        print(f"Serving artifact version {engine.version} (was {old.version}, "
+              f"loaded in {self.last_reload_seconds:.2f}s)")
+        return engine
+
+    def status(self) -> dict:
+        engine = self.engine()
+        return {
+            "version": engine.version,
+            "loaded_at": engine.loaded_at,
+            "current": current(self.directory).version,
+            "available": versions(self.directory),
+            "loading": self._loading is not None and self._loading.is_alive(),
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_reload_seconds": self.last_reload_seconds,
+            "neighbors": engine.graph.stats(),
+        }
+
+
+_RELOADER: Optional[Reloader] = None
+
+
+def get_reloader() -> Reloader:
+    global _RELOADER
+    if _RELOADER is None:
+        _RELOADER = Reloader()
+    return _RELOADER
+
+
+def get_engine() -> Engine:
+    return get_reloader().engine()
+
+
+def install_signal_handler(signum: int = signal.SIGUSR2):
+    """Reload on `signum`; must be called from the main thread."""
+    def handle(signum, frame):
+        # the handler may interrupt code holding the reloader's lock, so do the work elsewhere
+        threading.Thread(target=get_reloader().reload_async, kwargs={"force": True}, daemon=True).start()
+
+    signal.signal(signum, handle)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    pub = sub.add_parser("publish", help="publish a model and dataset as a new version and make it current")
+    pub.add_argument("--model", default=BASE_MODEL)
+    pub.add_argument("--dataset", default=BASE_DATASET)
+    pub.add_argument("--version", default=None, help="version name (default: timestamp)")
+    pub.add_argument("--no-activate", action="store_true", help="publish without switching CURRENT")
+    use = sub.add_parser("use", help="switch CURRENT to a published version")
+    use.add_argument("version")
+    sub.add_parser("list", help="list published versions")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        version = publish(args.model, args.dataset, args.version, activate=not args.no_activate)
+        print(f"published {version} in {ARTIFACT_DIR}" + ("" if args.no_activate else " (current)"))
+    elif args.command == "use":
+        set_current(args.version)
+        print(f"current version: {args.version}")
+    else:
+        active = current().version
+        for version in versions():
+            print(("* " if version == active else "  ") + version)
+
+
+if __name__ == "__main__":
+    main()
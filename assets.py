@@ -0,0 +1,269 @@
+"""
+assets.py
+
+Build step and serving for fingerprinted static assets.
+
+`python assets.py` copies the files under static/ into static/build/ with a
+content hash in their names (style.css -> build/style.1a2b3c4d.css),
+converts OTF/TTF fonts to WOFF2, rewrites url(...) references in CSS to
+the hashed names, and writes .gz and .br siblings for compressible files.
+static/build/manifest.json maps each original name to its built name, and
+static/build/sources.json records the hash of every source it was built from.
+
+init_app(app) makes url_for('static', filename='style.css') resolve to the
+built name and serves built files with `Cache-Control: immutable` and the
+precompressed variant the client accepts. Without a build (no manifest)
+static files are served exactly as before. A build older than the files in
+static/ is never served: init_app rebuilds it when asked to (the
+development server does) and otherwise raises, so a deploy that forgot
+`python assets.py` fails at startup instead of serving old CSS/JS.
+
+Usage:
+    python assets.py            # rebuild static/build/
+    python assets.py --clean    # remove static/build/
+
+Needs fonttools and brotli for the build only; a font or .br file is skipped
+with a warning if they are missing.
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+from fnmatch import fnmatch
+from typing import Dict, List, Optional
+
+from flask import request, send_from_directory
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+BUILD_SUBDIR = "build"
+MANIFEST = "manifest.json"
+SOURCES = "sources.json"
+# font preview images and the font's readme are not used by the pages
+EXCLUDE = ("build/*", "milker/*.jpg", "milker/*.txt")
+COMPRESSIBLE = (".css", ".js", ".json", ".svg", ".txt", ".html", ".otf", ".ttf")
+HASH_CHARS = 8
+ASSET_MAX_AGE = 31536000
+
+mimetypes.add_type("font/woff2", ".woff2")
+
+_CSS_URL = re.compile(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)")
+
+
+def _hashed_name(rel: str, data: bytes) -> str:
+    root, ext = os.path.splitext(rel)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:HASH_CHARS]}{ext}"
+
+
+def _to_woff2(path: str) -> Optional[bytes]:
+    try:
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        print(f"warning: fonttools not installed, {path} not converted to WOFF2")
+        return None
+    font = TTFont(path)
+    font.flavor = "woff2"
+    out = io.BytesIO()
+    try:
+        font.save(out)
+    except ImportError:        # woff2 also needs brotli
+        print(f"warning: brotli not installed, {path} not converted to WOFF2")
+        return None
+    return out.getvalue()
+
+
+def _rewrite_css(css: str, css_rel: str, manifest: Dict[str, str]) -> str:
+    """Point url(...) references at built names; fonts get a WOFF2 source first."""
+    base = os.path.dirname(css_rel)
+
+    def built_url(target: str) -> Optional[str]:
+        rel = os.path.normpath(os.path.join(base, target)).replace(os.sep, "/")
+        built = manifest.get(rel)
+        if built is None:
+            return None
+        # CSS urls are relative to the built CSS file
+        return os.path.relpath(built, os.path.dirname(manifest[css_rel])).replace(os.sep, "/")
+
+    def replace(match):
+        target = match.group(2)
+        if re.match(r"^(?:[a-z]+:|/|#)", target):
+            return match.group(0)
+        url = built_url(target)
+        if url is None:
+            return match.group(0)
+        woff2 = built_url(os.path.splitext(target)[0] + ".woff2")
+        if woff2 and target.lower().endswith((".otf", ".ttf")):
+            fmt = "opentype" if target.lower().endswith(".otf") else "truetype"
+            return f'url({woff2}) format("woff2"), url({url}) format("{fmt}")'
+        return f"url({url})"
+
+    return _CSS_URL.sub(replace, css)
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _compress(path: str, data: bytes) -> Dict[str, int]:
+    sizes = {}
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        _write(path + ".gz", gz)
+        sizes["gz"] = len(gz)
+    try:
+        import brotli
+    except ImportError:
+        return sizes
+    br = brotli.compress(data, quality=11)
+    if len(br) < len(data):
+        _write(path + ".br", br)
+        sizes["br"] = len(br)
+    return sizes
+
+
+def _sources(static_dir: str) -> List[str]:
+    sources = []
+    for root, _, files in os.walk(static_dir):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, "/")
+            if not any(fnmatch(rel, pattern) for pattern in EXCLUDE):
+                sources.append(rel)
+    # CSS last so every file it references already has a built name
+    sources.sort(key=lambda rel: (rel.endswith(".css"), rel))
+    return sources
+
+
+def _source_hashes(static_dir: str) -> Dict[str, str]:
+    hashes = {}
+    for rel in _sources(static_dir):
+        with open(os.path.join(static_dir, rel), "rb") as f:
+            hashes[rel] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+
+def stale_sources(static_dir: str = STATIC_DIR) -> List[str]:
+    """Sources added, removed or changed since the last build ([] if up to date or never built)."""
+    build_dir = os.path.join(static_dir, BUILD_SUBDIR)
+    if not os.path.exists(os.path.join(build_dir, MANIFEST)):
+        return []
+    try:
+        with open(os.path.join(build_dir, SOURCES)) as f:
+            built = json.load(f)
+    except (FileNotFoundError, ValueError):
+        built = {}
+    current = _source_hashes(static_dir)
+    return sorted(rel for rel in built.keys() | current.keys() if built.get(rel) != current.get(rel))
+
+
+def build(static_dir: str = STATIC_DIR) -> Dict[str, str]:
+    """Rebuild static/build/ and return the manifest."""
+    build_dir = os.path.join(static_dir, BUILD_SUBDIR)
+    shutil.rmtree(build_dir, ignore_errors=True)
+    sources = _sources(static_dir)
+    hashes = {}
+
+    manifest: Dict[str, str] = {}
+    for rel in sources:
+        src = os.path.join(static_dir, rel)
+        with open(src, "rb") as f:
+            data = f.read()
+        hashes[rel] = hashlib.sha256(data).hexdigest()
+        outputs = [(rel, data)]
+        if rel.lower().endswith((".otf", ".ttf")):
+            woff2 = _to_woff2(src)
+            if woff2 is not None:
+                outputs.append((os.path.splitext(rel)[0] + ".woff2", woff2))
+        if rel.endswith(".css"):
+            manifest[rel] = f"{BUILD_SUBDIR}/{_hashed_name(rel, data)}"   # provisional, for relative urls
+            data = _rewrite_css(data.decode("utf-8"), rel, manifest).encode("utf-8")
+            outputs = [(rel, data)]
+        for out_rel, out_data in outputs:
+            built = f"{BUILD_SUBDIR}/{_hashed_name(out_rel, out_data)}"
+            manifest[out_rel] = built
+            out_path = os.path.join(static_dir, built)
+            _write(out_path, out_data)
+            sizes = _compress(out_path, out_data) if out_rel.lower().endswith(COMPRESSIBLE) else {}
+            extra = "".join(f"  {k} {v}" for k, v in sizes.items())
+            print(f"{out_rel} -> {built}  {len(out_data)}{extra}")
+
+    with open(os.path.join(build_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    with open(os.path.join(build_dir, SOURCES), "w") as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir: str = STATIC_DIR) -> Dict[str, str]:
+    try:
+        with open(os.path.join(static_dir, BUILD_SUBDIR, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_app(app, static_dir: Optional[str] = None, rebuild: bool = False):
+    """
+    Resolve url_for('static', ...) to built names and serve them with long-lived caching.
+    A stale build is rebuilt if `rebuild` is set; otherwise RuntimeError is raised.
+    """
+    static_dir = static_dir or app.static_folder
+    stale = stale_sources(static_dir)
+    if stale:
+        if not rebuild:
+            raise RuntimeError(f"{os.path.join(static_dir, BUILD_SUBDIR)} is out of date "
+                               f"({', '.join(stale[:5])}{', ...' if len(stale) > 5 else ''}); "
+                               f"run `python assets.py`")
+        print(f"Rebuilding static assets, changed since the last build: {', '.join(stale)}")
+        build(static_dir)
+    manifest = load_manifest(static_dir)
+    built_prefix = BUILD_SUBDIR + "/"
+
+    @app.url_defaults
+    def _fingerprint(endpoint, values):
+        if endpoint == "static" and values.get("filename") in manifest:
+            values["filename"] = manifest[values["filename"]]
+
+    default_static = app.view_functions["static"]
+
+    def static(filename):
+        if not filename.startswith(built_prefix) or filename.endswith((".gz", ".br")):
+            return default_static(filename=filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+        accepted = request.headers.get("Accept-Encoding", "")
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding in accepted and os.path.exists(os.path.join(static_dir, filename + suffix)):
+                resp = send_from_directory(static_dir, filename + suffix, mimetype=mimetype,
+                                           max_age=ASSET_MAX_AGE)
+                resp.headers["Content-Encoding"] = encoding
+                break
+        else:
+            resp = send_from_directory(static_dir, filename, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+        resp.headers["Vary"] = "Accept-Encoding"
+        # the name changes whenever the content does
+        resp.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+        return resp
+
+    app.view_functions["static"] = static
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clean", action="store_true", help="remove the build directory")
+    args = parser.parse_args()
+    if args.clean:
+        shutil.rmtree(os.path.join(STATIC_DIR, BUILD_SUBDIR), ignore_errors=True)
+        return
+    manifest = build()
+    print(f"{len(manifest)} assets in {os.path.join(STATIC_DIR, BUILD_SUBDIR)}")
+
+
+if __name__ == "__main__":
+    main()
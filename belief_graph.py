@@ -1,13 +1,17 @@
 import json
-from collections import Counter
+import os
+import threading
+from collections import Counter, OrderedDict
 import networkx as nx
 from node2vec import Node2Vec
 from gensim.models import Word2Vec
 from pathlib import Path
+from typing import List, Tuple
+import artifacts
+from metrics import span
 
-# load the model
-
-model = Word2Vec.load("belief_node2vec.model")
+# candidate + neighbor lookups kept per model (see BeliefGraph.neighbors)
+NEIGHBOR_CACHE_SIZE = int(os.getenv("NEIGHBOR_CACHE_SIZE", "4096"))
 
 from difflib import SequenceMatcher
 
@@ -41,7 +45,7 @@ from difflib import SequenceMatcher
 # changing above code to find best 5 matches instead
 
 
-def _find_best_nodes(query: str, topk: int = 5) -> list[str]:
+def _find_best_nodes(query: str, topk: int = 5, model=None) -> list[str]:
     """
     Return up to `topk` nodes whose names best match `query`:
       1) Any node containing the raw query (or its singular form) as a substring,
@@ -50,7 +54,7 @@ def _find_best_nodes(query: str, topk: int = 5) -> list[str]:
          sorted by descending similarity.
     """
     q = query.lower()
-    nodes = model.wv.index_to_key
+    nodes = (model or _GRAPH.model).wv.index_to_key
     singular = q.rstrip('s')
 
     # 1) substring matches
@@ -94,9 +98,63 @@ _seen_queries = set()
 
 # … keep your imports, global `_seen_queries`, and _find_best_nodes as before …
 
-def similar_to(query: str, topn: int = 5) -> list[str]:
-    # 1) find up to five matching central candidates
-    candidates = _find_best_nodes(query, topk=5)
+class BeliefGraph:
+    """
+    One loaded node2vec model (an artifact version, see artifacts.py) with an
+    LRU cache of its candidate/neighbor lookups. A reload builds a new
+    BeliefGraph, so the cache can never serve neighbors from another model.
+    """
+
+    def __init__(self, model: Word2Vec, version: str, cache_size: int = NEIGHBOR_CACHE_SIZE):
+        self.model = model
+        self.version = version
+        self.all_queries = [str(k) for k in model.wv.key_to_index.keys()]
+        self.cache_size = cache_size
+        self._neighbors: "OrderedDict[str, Tuple[List[str], List[Tuple[str, float]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @classmethod
+    def load(cls, path: str, version: str) -> "BeliefGraph":
+        return cls(Word2Vec.load(path), version)
+
+    def neighbors(self, query: str) -> Tuple[List[str], List[Tuple[str, float]]]:
+        """
+        (up to five candidate nodes for `query`, their top-10 neighbors with
+        scores); independent of the seen-queries filter, so safe to cache.
+        """
+        with self._lock:
+            cached = self._neighbors.get(query)
+            if cached is not None:
+                self._neighbors.move_to_end(query)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        with span("find_best_nodes"):
+            candidates = _find_best_nodes(query, topk=5, model=self.model)
+        raw: List[Tuple[str, float]] = []
+        with span("most_similar"):
+            for cand in candidates:
+                raw.extend(self.model.wv.most_similar(cand, topn=10))
+        result = (candidates, raw)
+        with self._lock:
+            self._neighbors[query] = result
+            while len(self._neighbors) > self.cache_size:
+                self._neighbors.popitem(last=False)
+        return result
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"version": self.version, "nodes": len(self.all_queries), "cached": len(self._neighbors),
+                "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def similar_to(self, query: str, topn: int = 5) -> list[str]:
+        return similar_to(query, topn, graph=self)
+
+
+def similar_to(query: str, topn: int = 5, graph: BeliefGraph = None) -> list[str]:
+    # 1) find up to five matching central candidates (and their neighbors)
+    candidates, raw_neighbors = (graph or _GRAPH).neighbors(query)
     if not candidates:
         print(f"✗ No node match for '{query}'.")
         return []
@@ -110,11 +168,9 @@ def similar_to(query: str, topn: int = 5) -> list[str]:
     _seen_queries.add(central)
 
     # 3) for each candidate, pull top‑10 neighbors
-    all_neighbors: list[tuple[str,float]] = []
-    for cand in candidates:
-        for neigh, score in model.wv.most_similar(cand, topn=10):
-            if neigh not in _seen_queries:
-                all_neighbors.append((neigh, score))
+    all_neighbors: list[tuple[str,float]] = [
+        (neigh, score) for neigh, score in raw_neighbors if neigh not in _seen_queries
+    ]
 
     # 4) sort ALL collected neighbors by score desc
     all_neighbors.sort(key=lambda x: x[1], reverse=True)
@@ -162,13 +218,29 @@ def similar_to(query: str, topn: int = 5) -> list[str]:
 
 #     return fresh[:topn]
 
+# load the model of the current artifact version (belief_node2vec.model without one)
+
+ARTIFACTS = artifacts.current()
+_GRAPH = BeliefGraph.load(ARTIFACTS.model, ARTIFACTS.version)
+model = _GRAPH.model
+all_queries = _GRAPH.all_queries
+
+
+def get_graph() -> BeliefGraph:
+    return _GRAPH
+
+
+def set_graph(graph: BeliefGraph):
+    """Serve `graph` from now on (hot reload); calls already running finish on the old one."""
+    global _GRAPH, model, all_queries
+    _GRAPH, model, all_queries = graph, graph.model, graph.all_queries
+
+
 # Examples
 for q in ["trump"]: # ["trump", "the New York City mayor", "vaccines", "moon", "right-wing"]:
     print(f"\nQuery: {q!r}")
     print(" Related:", similar_to(q))
 
-all_queries = [str(k) for k in model.wv.key_to_index.keys()]
-
 
 
 
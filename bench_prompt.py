@@ -0,0 +1,88 @@
+"""
+bench_prompt.py
+
+Measure how much prompt evaluation each STORY_PREFIX_REUSE mode saves.
+Every mode runs in its own subprocess (fresh client, fresh prefix context)
+and generates stories for the same random click sets from the corpus; the
+prompt_eval_count / prompt_eval_duration that Ollama reports for each
+request are averaged.
+
+By default a fake Ollama (fake_ollama.py) is started in-process; pass
+--prefix-cache to let it reuse the prefix a slot shares with its previous
+prompt, as a real Ollama does while the model stays loaded:
+
+    python bench_prompt.py
+    python bench_prompt.py --prefix-cache --stories 20
+    python bench_prompt.py --url http://localhost:11434/api/generate
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+
+DATASET = "raw_data/final_data/all_spacy_concepts_final.json"
+MODES = ("off", "system", "context")
+
+
+def run_child(stories: int, seed: int):
+    """Generate `stories` stories with the mode taken from the environment."""
+    import conspiracy_generator as cg
+    from ollama_client import get_client
+
+    docs = cg.load_dataset(DATASET)
+    concepts = cg.get_concept_index(docs).concepts()
+    rng = random.Random(seed)
+    for _ in range(stories):
+        clicked = rng.sample(concepts, 3)
+        cg.generate_conspiracy(cg.build_context(clicked, cg.filter_docs(docs, clicked)))
+    print(json.dumps(get_client().stats()))
+
+
+def run_mode(mode: str, url: str, args) -> dict:
+    env = dict(os.environ, STORY_PREFIX_REUSE=mode, OLLAMA_API_URL=url)
+    proc = subprocess.run([sys.executable, __file__, "--child", "--stories", str(args.stories),
+                           "--seed", str(args.seed)], env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Ollama /api/generate URL (default: in-process fake)")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--stories", type=int, default=10, help="stories per mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prefix-cache", action="store_true", help="fake server reuses shared prompt prefixes")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.stories, args.seed)
+        return
+
+    url = args.url
+    if url is None:
+        import fake_ollama
+        config = fake_ollama.parse_args(["--quiet", "--ttft-ms", "1", "--tokens-per-s", "1000", "--max-tokens", "8"]
+                                        + (["--prefix-cache"] if args.prefix_cache else []))
+        server = fake_ollama.make_server(config, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/api/generate"
+    print(f"url={url} stories={args.stories}")
+    print(f"{'mode':<8} {'requests':>8} {'prompt tok/req':>15} {'prompt eval ms/req':>19}")
+    for mode in args.modes.split(","):
+        result = run_mode(mode, url, args)
+        if "error" in result:
+            print(f"{mode:<8} error: {result['error']}")
+            continue
+        print(f"{mode:<8} {result['requests']:>8} {result['prompt_eval_tokens_avg']:>15.0f} "
+              f"{result['prompt_eval_seconds_avg'] * 1000:>19.1f}")
+
+
+if __name__ == "__main__":
+    main()
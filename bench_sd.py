@@ -0,0 +1,187 @@
+"""
+bench_sd.py
+
+Benchmark the CPU execution profiles of evidence_image._get_sd_pipe.
+Each configuration runs in its own subprocess (so thread settings and peak
+RSS are measured independently) and reports load time, seconds per image
+and peak resident memory.
+
+By default a tiny randomly-initialized pipeline (built locally, no download)
+stands in for the real weights, which is enough to compare the relative
+effect of each setting:
+
+    python bench_sd.py
+    python bench_sd.py --model gsdf/Counterfeit-V2.5 --size 512 --images 2
+    python bench_sd.py --configs baseline,int8,fast
+
+With --batch-sizes, the chosen configurations are instead run with that
+many prompts per pipeline call (as the image worker's micro-batching does)
+and throughput in images per second is reported:
+
+    python bench_sd.py --configs baseline --batch-sizes 1,2,4 --images 8
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+CONFIGS = {
+    "baseline":      {},
+    "sliced":        {"SD_ATTENTION": "sliced"},
+    "sdpa":          {"SD_ATTENTION": "sdpa"},
+    "channels_last": {"SD_CHANNELS_LAST": "1"},
+    "threads":       {"SD_NUM_THREADS": str(os.cpu_count() or 1)},
+    "bf16":          {"SD_PRECISION": "bf16"},
+    "int8":          {"SD_PRECISION": "int8"},
+    "fast":          {"SD_SCHEDULER": "fast"},
+    "all":           {"SD_ATTENTION": "sdpa", "SD_CHANNELS_LAST": "1", "SD_PRECISION": "int8",
+                      "SD_SCHEDULER": "fast", "SD_NUM_THREADS": str(os.cpu_count() or 1)},
+}
+
+PROMPT = "Classified satellite image, unidentified object, space agency confidential photo, no text"
+
+
+def _byte_chars() -> list:
+    """The 256 printable stand-ins for raw bytes used by CLIP's byte-level BPE."""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) \
+        + list(range(ord("®"), ord("ÿ") + 1))
+    chars, extra = [], 0
+    for b in range(256):
+        if b in printable:
+            chars.append(chr(b))
+        else:
+            chars.append(chr(256 + extra))
+            extra += 1
+    return chars
+
+
+def build_tiny_pipeline(path: str):
+    """Save a tiny randomly-initialized Stable Diffusion pipeline to `path`."""
+    import torch
+    from diffusers import AutoencoderKL, EulerDiscreteScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+    torch.manual_seed(0)
+    os.makedirs(path, exist_ok=True)
+    # byte-level vocab without merges: every character is its own token
+    chars = _byte_chars()
+    vocab = {tok: i for i, tok in enumerate(chars + [c + "</w>" for c in chars]
+                                            + ["<|startoftext|>", "<|endoftext|>"])}
+    with open(os.path.join(path, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(path, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(os.path.join(path, "vocab.json"), os.path.join(path, "merges.txt"),
+                              model_max_length=77)
+
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        vocab_size=len(vocab), hidden_size=32, intermediate_size=37, num_attention_heads=4,
+        num_hidden_layers=5, bos_token_id=vocab["<|startoftext|>"], eos_token_id=vocab["<|endoftext|>"],
+        pad_token_id=vocab["<|endoftext|>"]))
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64), layers_per_block=2, sample_size=32, in_channels=4, out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"), cross_attention_dim=32)
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64], in_channels=3, out_channels=3, latent_channels=4,
+        down_block_types=["DownEncoderBlock2D"] * 2, up_block_types=["UpDecoderBlock2D"] * 2)
+    scheduler = EulerDiscreteScheduler(beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear",
+                                       steps_offset=1)
+    pipe = StableDiffusionPipeline(vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, unet=unet,
+                                   scheduler=scheduler, safety_checker=None, feature_extractor=None,
+                                   requires_safety_checker=False)
+    pipe.save_pretrained(path)
+    return path
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_child(images: int, batch: int):
+    """Measure one configuration (taken from the SD_* environment)."""
+    import evidence_image
+
+    start = time.perf_counter()
+    evidence_image._get_sd_pipe()
+    load_s = time.perf_counter() - start
+
+    out_dir = tempfile.mkdtemp(prefix="bench_sd_")
+    items = [(PROMPT, os.path.join(out_dir, f"{i}.png"), i + 1) for i in range(images)]
+    # warm-up call at the measured batch size: first call pays for allocator / kernel selection
+    evidence_image.render_images(items[:batch])
+    start = time.perf_counter()
+    for i in range(0, images, batch):
+        evidence_image.render_images(items[i:i + batch])
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        "load_s": load_s,
+        "sec_per_image": elapsed / images,
+        "images_per_s": images / elapsed,
+        "peak_rss_mb": _peak_rss_mb(),
+    }))
+
+
+def run_config(name: str, overrides: dict, args, batch: int = 1) -> dict:
+    env = dict(os.environ)
+    env.update({"SD_MODEL_ID": args.model, "SD_WIDTH": str(args.size), "SD_HEIGHT": str(args.size)})
+    if args.steps:
+        env["SD_STEPS"] = str(args.steps)
+    env.update(overrides)
+    proc = subprocess.run([sys.executable, __file__, "--child", "--images", str(args.images),
+                           "--batch", str(batch)],
+                          env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="model id or path (default: tiny random pipeline)")
+    parser.add_argument("--size", type=int, default=64, help="width/height in pixels")
+    parser.add_argument("--steps", type=int, default=0, help="override SD_STEPS")
+    parser.add_argument("--images", type=int, default=3, help="timed images per configuration")
+    parser.add_argument("--configs", default=",".join(CONFIGS), help="comma-separated subset")
+    parser.add_argument("--batch-sizes", default="", help="e.g. 1,2,4: report throughput per batch size")
+    parser.add_argument("--batch", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.images, args.batch)
+        return
+
+    if args.model is None:
+        args.model = build_tiny_pipeline(os.path.join(tempfile.gettempdir(), "bench_sd_tiny"))
+    print(f"model={args.model} size={args.size} images={args.images}")
+    if args.batch_sizes:
+        print(f"{'config':<14} {'batch':>5} {'images/s':>9} {'s/image':>9} {'peak RSS MB':>12}")
+        for name in args.configs.split(","):
+            for batch in (int(b) for b in args.batch_sizes.split(",")):
+                result = run_config(name, CONFIGS[name], args, batch)
+                if "error" in result:
+                    print(f"{name:<14} {batch:>5} error: {result['error']}")
+                    continue
+                print(f"{name:<14} {batch:>5} {result['images_per_s']:>9.2f} "
+                      f"{result['sec_per_image']:>9.3f} {result['peak_rss_mb']:>12.0f}")
+        return
+    print(f"{'config':<14} {'load s':>8} {'s/image':>9} {'peak RSS MB':>12}")
+    for name in args.configs.split(","):
+        result = run_config(name, CONFIGS[name], args)
+        if "error" in result:
+            print(f"{name:<14} error: {result['error']}")
+            continue
+        print(f"{name:<14} {result['load_s']:>8.2f} {result['sec_per_image']:>9.3f} {result['peak_rss_mb']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,12 @@ Expected JSON schema per document:
 - summary OR concept: str    # textual description
 - concepts_spacy: List[str]  # spaCy-extracted concepts for filtering
 
+load_dataset serves a compact corpus.Corpus (titles, 200-character
+snippets, interned concept ids, postings, SimHash signatures); the full text
+is not kept. When the pipeline has published a segment (<dataset>.seg, see
+corpus.py) that is at least as new as the JSON, it is mmapped instead of
+parsing the JSON.
+
 Requirements:
 - Python 3.8+
 - requests
@@ -19,6 +25,7 @@ Requirements:
       ollama serve
   serving at http://localhost:11434/api/generate
 - diffusers, transformers, torch for Stable Diffusion image generation
+  (only imported by evidence_image when the first image is generated)
 
 Usage:
     from conspiracy_generator import (
@@ -31,63 +38,296 @@ Usage:
     docs = filter_docs(dataset, clicked)
     context = build_context(clicked, docs)
     summary = generate_conspiracy(context)
-    image_path = generate_evidence_image(summary)
+    image_path = generate_evidence_image(summary, clicked)
+
+    # or the whole click -> story pipeline behind the story cache
+    story, info = generate_story(dataset, clicked)
 """
 
 import os
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
+import hashlib
+import itertools
 import json
-import requests
-from typing import List
-import torch
-from diffusers import StableDiffusionPipeline, EulerDiscreteScheduler
+import math
+import queue
+import re
+import threading
+import time
+import weakref
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from corpus import Corpus, Doc, SEGMENT_SUFFIX, normalize_concept, segment_path
+from dedup import MAX_THRESHOLD, NearDuplicateFilter
+from evidence_image import detect_theme, build_visual_prompt, generate_evidence_image
+from metrics import observe, span, timed
+from ollama_client import OLLAMA_API_URL, OllamaError, get_client
+from story_cache import StoryCache
+
+
+def load_dataset(path: str, version: Optional[str] = None) -> Corpus:
+    """
+    Load the dataset as a compact Corpus and build its concept index:
+    mmap the published segment if it is current, else parse the JSON file.
+    `path` may also name a segment directly. `version` (see artifacts.py)
+    becomes part of the story cache keys for this corpus.
+    """
+    seg = segment_path(path)
+    try:
+        current = path.endswith(SEGMENT_SUFFIX) or os.path.getmtime(seg) >= os.path.getmtime(path)
+    except OSError:
+        current = False
+    docs = None
+    if current:
+        try:
+            docs = Corpus.open_segment(seg)
+        except ValueError as e:
+            # written by an older corpus.py; fall back to the JSON next to it
+            if path.endswith(SEGMENT_SUFFIX):
+                raise
+            print(f"Ignoring segment: {e}")
+    if docs is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            docs = Corpus.from_records(json.load(f))
+        print(f"No current segment for {path}; parsed JSON (publish one with `python corpus.py {path}`)")
+    docs.version = version
+    get_concept_index(docs)
+    return docs
+
+
+class ConceptIndex:
+    """
+    Inverted index from normalized concept to a sorted array of doc ids
+    (row ids in the corpus), so request-time filtering only touches the
+    posting lists of the clicked concepts. The posting lists are corpus
+    columns (shared through the segment mapping when there is one).
+    """
+
+    def __init__(self, docs: Corpus):
+        self.num_docs = len(docs)
+        self.corpus = docs
+
+    def concepts(self) -> List[str]:
+        """All indexed (normalized) concepts, sorted."""
+        return list(self.corpus.concept_keys)
+
+    def lookup(self, concept: str):
+        """Posting list (sorted doc ids) for one concept; empty if unknown."""
+        cid = self.corpus.concept_id(normalize_concept(concept))
+        return self.corpus.postings(cid) if cid >= 0 else _EMPTY_POSTINGS
+
+    def doc_freq(self, concept: str) -> int:
+        return len(self.lookup(concept))
+
+    def match(self, concepts: List[str], mode: str = 'any', min_match: int = 1) -> List[int]:
+        """
+        Sorted doc ids matching the given concepts.
+        mode='any': union of posting lists (at least `min_match` distinct concepts).
+        mode='all': intersection, every concept must be present.
+        """
+        keys = {normalize_concept(c) for c in concepts}
+        lists = [plist for plist in map(self.lookup, keys) if len(plist)]
+        if mode == 'all':
+            if len(lists) < len(keys) or not lists:
+                return []
+            lists.sort(key=len)
+            ids = set(lists[0])
+            for plist in lists[1:]:
+                ids.intersection_update(plist)
+                if not ids:
+                    break
+            return sorted(ids)
+        if mode != 'any':
+            raise ValueError(f"unknown match mode: {mode!r}")
+        if min_match <= 1:
+            return sorted(set().union(*lists))
+        counts = Counter()
+        for plist in lists:
+            counts.update(plist)
+        return sorted(doc_id for doc_id, n in counts.items() if n >= min_match)
+
+
+_EMPTY_POSTINGS = array('I')
+
+# One index per corpus, so requests still running on a corpus that was
+# swapped out by a reload keep using that corpus' own index.
+_CONCEPT_INDEXES: "weakref.WeakKeyDictionary[Corpus, ConceptIndex]" = weakref.WeakKeyDictionary()
+_INDEX_LOCK = threading.Lock()
+
+
+def get_concept_index(docs: Corpus) -> ConceptIndex:
+    """Return the concept index for `docs`, building it on first use."""
+    index = _CONCEPT_INDEXES.get(docs)
+    if index is not None:
+        return index
+    with _INDEX_LOCK:
+        index = _CONCEPT_INDEXES.get(docs)
+        if index is None:
+            index = _CONCEPT_INDEXES[docs] = ConceptIndex(docs)
+        return index
+
+
+@timed("filter_docs")
+def filter_docs(docs: Corpus, clicked_nodes: List[str],
+                mode: str = 'any', min_match: int = 1) -> List[Doc]:
+    """
+    Docs whose 'concepts_spacy' intersects with clicked_nodes, in dataset order.
+    With mode='all' every clicked concept must be present; with mode='any'
+    a doc needs at least `min_match` of them.
+    """
+    index = get_concept_index(docs)
+    return [docs[i] for i in index.match(clicked_nodes, mode=mode, min_match=min_match)]
 
-# Ollama serve endpoint (default)
-OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
 
+# Prompt budget for the "Related information" section. Roughly 4 characters
+# per token for English text with the LLaMA tokenizer.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+# docs whose SimHash differs in at most this many bits count as near-duplicates (0-3)
+CONTEXT_DEDUP_BITS = int(os.getenv("CONTEXT_DEDUP_BITS", "3"))
+# the filter is built per request, so a bad value must fail at startup instead
+if not 0 <= CONTEXT_DEDUP_BITS <= MAX_THRESHOLD:
+    raise ValueError(f"CONTEXT_DEDUP_BITS must be between 0 and {MAX_THRESHOLD}, got {CONTEXT_DEDUP_BITS}")
+_CHARS_PER_TOKEN = 4
 
-def load_dataset(path: str) -> List[dict]:
-    """Load the dataset from a JSON file."""
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
 
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; good enough for budgeting without loading a tokenizer."""
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
 
-def filter_docs(docs: List[dict], clicked_nodes: List[str]) -> List[dict]:
-    """Filter docs whose 'concepts_spacy' intersects with clicked_nodes."""
-    lowered = {c.lower() for c in clicked_nodes}
-    return [doc for doc in docs if any(c.lower() in lowered for c in doc.get('concepts_spacy', []))]
 
+def rank_docs(clicked_nodes: List[str], docs: List[Doc],
+              index: Optional[ConceptIndex] = None) -> List[Doc]:
+    """
+    Docs ordered by the summed IDF of the clicked concepts they contain,
+    ties broken by match count, then dataset order.
+    """
+    if index is None and docs:
+        index = get_concept_index(docs[0].corpus)
+    clicked_keys = {normalize_concept(c) for c in clicked_nodes}
+    if index is not None:
+        num_docs = index.num_docs
+        df = {k: index.doc_freq(k) for k in clicked_keys}
+    else:
+        num_docs = len(docs)
+        df = Counter(k for doc in docs for k in doc.concepts if k in clicked_keys)
+    idf = {k: math.log((num_docs + 1) / (df.get(k, 0) + 1)) + 1.0 for k in clicked_keys}
+
+    ranked = []
+    for pos, doc in enumerate(docs):
+        matched = clicked_keys.intersection(doc.concepts)
+        score = sum(idf[k] for k in matched)
+        ranked.append((-score, -len(matched), pos, doc))
+    ranked.sort(key=lambda r: r[:3])
+    return [r[3] for r in ranked]
+
+
+def _dedup_key(title: str, snippet: str) -> str:
+    # reposts keep the snippet but change the title, or append to the text
+    # (SimHash of the whole line can be far apart for both)
+    words = [w for w in re.split(r'\W+', snippet.lower()) if w]
+    return ' '.join(words[:20]) or title.lower()
+
+
+@timed("build_context")
+def assemble_context(clicked_nodes: List[str], docs: List[Doc],
+                     max_tokens: Optional[int] = None,
+                     index: Optional[ConceptIndex] = None) -> Tuple[str, dict]:
+    """
+    Build the model context from the most relevant docs and report its size.
+
+    Docs are taken in rank_docs order, near-duplicate docs (SimHash within
+    CONTEXT_DEDUP_BITS bits of an already used doc, or the same opening
+    snippet words) are skipped, and lines are added until `max_tokens` is reached.
+    Returns (context, stats) where stats['tokens'] is the estimated token count.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if max_tokens is None else max_tokens
 
-def build_context(clicked_nodes: List[str], docs: List[dict]) -> str:
-    """Build text context summary for the model."""
     lines = [f"Key concepts: {', '.join(clicked_nodes)}.", "", "Related information:"]
-    for doc in docs:
-        title = doc.get('title', '')
-        text = doc.get('summary') or doc.get('concept', '')
-        if isinstance(text, list): # account for if reddit (list of comments)
-            text = " ".join(text)  
-        snippet = text.replace('\n', ' ')[:200] 
-        lines.append(f"- {title}: {snippet}...")
-    return '\n'.join(lines)
+    tokens = estimate_tokens('\n'.join(lines))
+    seen = NearDuplicateFilter(CONTEXT_DEDUP_BITS)
+    seen_keys = set()
+    used = duplicates = 0
+    truncated = False
+    for doc in rank_docs(clicked_nodes, docs, index):
+        title = doc.title
+        snippet = doc.snippet
+        sig = doc.signature
+        key = _dedup_key(title, snippet)
+        if key in seen_keys or seen.find(sig) >= 0:
+            duplicates += 1
+            continue
+        line = f"- {title}: {snippet}..."
+        line_tokens = estimate_tokens(line) + 1  # + newline
+        if tokens + line_tokens > budget:
+            truncated = True
+            break
+        seen.add(sig)
+        seen_keys.add(key)
+        lines.append(line)
+        tokens += line_tokens
+        used += 1
+
+    stats = {
+        "tokens": tokens,
+        "docs_matched": len(docs),
+        "docs_used": used,
+        "duplicates_dropped": duplicates,
+        "truncated": truncated,
+    }
+    return '\n'.join(lines), stats
+
+
+def build_context(clicked_nodes: List[str], docs: List[Doc], max_tokens: Optional[int] = None) -> str:
+    """Build text context summary for the model (see assemble_context)."""
+    return assemble_context(clicked_nodes, docs, max_tokens=max_tokens)[0]
 
 
 def call_ollama(model: str, prompt: str, temperature: float=0.8, max_tokens: int=250) -> str:
-    """Invoke local Ollama and return full generated text."""
-    payload = {"model": model, "prompt": prompt, "temperature": temperature, "max_tokens": max_tokens}
-    resp = requests.post(OLLAMA_API_URL, json=payload)
-    resp.raise_for_status()
-    parts = []
-    for line in resp.text.splitlines():
-        try:
-            data = json.loads(line)
-            if 'response' in data:
-                parts.append(data['response'])
-            if data.get('done'):
-                break
-        except json.JSONDecodeError:
-            continue
-    return ''.join(parts).strip()
+    """Invoke local Ollama (pooled, streaming client) and return full generated text."""
+    return get_client().generate(model, prompt, temperature=temperature, max_tokens=max_tokens)
+
+
+STORY_MODEL = os.getenv("STORY_MODEL", "llama2")
+STORY_TEMPERATURE = float(os.getenv("STORY_TEMPERATURE", "0.8"))
+# how the fixed instruction is reused across requests:
+#   system  - sent as the `system` prompt, so every request starts with the same
+#             tokens and Ollama reuses the cached prefix while the model stays loaded
+#   context - evaluated once in raw mode; its `context` tokens are passed back
+#   off     - one plain prompt per request
+STORY_PREFIX_REUSE = os.getenv("STORY_PREFIX_REUSE", "system")
+# bump whenever build_story_prompt changes so cached stories are not reused;
+# the reuse mode changes how the model sees the instruction, so it is part of it
+PROMPT_VERSION = "2:" + STORY_PREFIX_REUSE
+
+STORY_INSTRUCTION = (
+    "You are a world-renowned investigative journalist known for uncovering shocking truths."
+    " After reading the context below, craft an attention-grabbing headline followed by a juicy, persuasive summary."
+    " The headline should be sensational but believable, using words like 'Revealed', 'Shocking', 'Exposed', or 'Undeniable Proof'."
+    " The summary should be 3-4 sentences, dramatic, confident, and designed to captivate readers."
+    " Use powerful language, imply urgency, and avoid any qualifiers like 'might' or 'allegedly'."
+)
+
+
+def build_story_prompt(context: str) -> str:
+    """Wrap the context in the fixed investigative-journalist instruction."""
+    return STORY_INSTRUCTION + story_prompt_suffix(context)
+
+
+def story_prompt_suffix(context: str) -> str:
+    """The per-request part of the story prompt."""
+    return f"\n\nContext:\n{context}\n\nHeadline and Summary:"
+
+
+def _story_request(context: str) -> Tuple[str, dict]:
+    """(prompt, extra Ollama fields) for the configured STORY_PREFIX_REUSE mode."""
+    if STORY_PREFIX_REUSE == "system":
+        return story_prompt_suffix(context).lstrip(), {"system": STORY_INSTRUCTION}
+    if STORY_PREFIX_REUSE == "context":
+        tokens = get_client().prefix_context(STORY_MODEL, STORY_INSTRUCTION)
+        if tokens:
+            return story_prompt_suffix(context), {"context": tokens, "raw": True}
+    return build_story_prompt(context), {}
 
 
 def generate_conspiracy(context: str) -> str:
@@ -95,137 +335,442 @@ def generate_conspiracy(context: str) -> str:
     Generate a concise 3-4 sentence persuasive summary with no headers.
     Use definitive language and avoid qualifiers like 'if true'.
     """
-    prompt = (
-        "You are a world-renowned investigative journalist known for uncovering shocking truths."
-        " After reading the context below, craft an attention-grabbing headline followed by a juicy, persuasive summary."
-        " The headline should be sensational but believable, using words like 'Revealed', 'Shocking', 'Exposed', or 'Undeniable Proof'."
-        " The summary should be 3-4 sentences, dramatic, confident, and designed to captivate readers."
-        " Use powerful language, imply urgency, and avoid any qualifiers like 'might' or 'allegedly'."
-        f"\n\nContext:\n{context}\n\nHeadline and Summary:"
-    )
-    return call_ollama('llama2', prompt)
-
-# IMAGE GENERATION BELOW
-
-# Pull a model checkpoint fine-tuned for:
-#     •    "Document generation" or "diagram generation".
-#     •    Example: Look for models on civitai.com or HuggingFace like:
-#     ◦    sd-paperspace-docgen
-#                 ==> gated model 
-#     ◦    sci-fi-blueprints-v1
-#                 ==> also not publicly hosted
-#     ◦    Or realistic photo generators.
-
-
- # pipe = StableDiffusionPipeline.from_pretrained(
-        #     model_id,
-        #     torch_dtype=torch.float32,
-        #     safety_checker=None
-        # )
-
-        # pipe = StableDiffusionPipeline.from_pretrained(
-        # "sd-paperspace-docgen",
-        # use_auth_token=HF_TOKEN,
-        # torch_dtype=torch.float16,
-        # safety_checker=None,
-        # )
-
-# Setup Stable Diffusion pipeline with optimizations
-_SD_PIPE = None
-
-HF_TOKEN = os.environ.get("HUGGING_FACE_API")
-
-def _get_sd_pipe(model_id: str="runwayml/stable-diffusion-v1-5"):
-    global _SD_PIPE
-    if _SD_PIPE is None:
-        # device = 'cpu'  # or 'cuda' if you have a GPU
-        # pipe = StableDiffusionPipeline.from_pretrained(
-        #         "gsdf/Counterfeit-V2.5", torch_dtype=torch.float16, safety_checker=None)
-        
-        # pick GPU if available, otherwise CPU
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        # on GPU use float16 for speed & memory; on CPU stick with float32
-        sd_kwargs = {"safety_checker": None}
-        if device == 'cuda':
-            sd_kwargs["torch_dtype"] = torch.float16
-        pipe = StableDiffusionPipeline.from_pretrained("gsdf/Counterfeit-V2.5", **sd_kwargs)
-        pipe.scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config)
-        _SD_PIPE = pipe.to(device)
-    return _SD_PIPE
-
-
-
-def detect_theme(clicked_nodes: list, summary: str) -> str:
-    # Seed keywords per category
-    THEMES = {
-        'political': ['government', 'election', 'mayor', 'law', 'congress', 'senate', 'campaign', 'justice', 'president'],
-        'scientific': ['lab', 'experiment', 'research', 'scientist', 'virus', '5g', 'climate', 'dna', 'biology', 'physics'],
-        'tech': ['data', 'server', 'ai', 'algorithm', 'cctv', 'surveillance', 'hack', 'blockchain', 'software', 'chip'],
-        'space': ['ufo', 'nasa', 'satellite', 'space', 'alien', 'cosmos', 'orbit', 'astronaut', 'extraterrestrial']
-    }
+    with span("ollama"):
+        prompt, extra = _story_request(context)
+        return get_client().generate(STORY_MODEL, prompt, temperature=STORY_TEMPERATURE, **extra)
 
-    text_blob = ' '.join(clicked_nodes).lower() + ' ' + summary.lower()
-
-    for theme, keywords in THEMES.items():
-        for word in keywords:
-            if word in text_blob:
-                return theme
-    return 'generic'
-
-def build_visual_prompt(theme: str, summary_short: str) -> str:
-    PROMPTS = {
-        'political': f"Leaked confidential government file, hidden seals, courtroom sketch style, {summary_short}, no text",
-        'scientific': f"Fake laboratory photo, mysterious device, forged research diagram, {summary_short}, no text",
-        'tech': f"Blurry CCTV screenshot, hacked data servers, digital breach aesthetics, {summary_short}, no text",
-        'space': f"Classified satellite image, unidentified object, space agency confidential photo, {summary_short}, no text",
-        'generic': f"Mysterious photographic evidence linked to conspiracy, dark atmosphere, {summary_short}, no text"
-    }
-    return PROMPTS.get(theme, PROMPTS['generic'])
 
-def generate_evidence_image(summary: str, output_dir: str="images", steps: int=20, scale: float=8.0) -> str:
+def warm_story_model():
     """
-    Generate a single "fake evidence" image (no words) representing the conspiracy.
-    Uses a very short prompt to avoid CLIP token limits and a single call to reduce multiprocessing overhead.
+    One-token generation with the story instruction: makes Ollama load
+    STORY_MODEL (kept for OLLAMA_KEEP_ALIVE) and caches the shared prefix.
     """
-    # Truncate summary to 15 words for brevity
-    words = summary.split()
-    summary_short = " ".join(words[:20]) + ("..." if len(words) > 20 else "")
+    with span("ollama_warmup"):
+        prompt, extra = _story_request("")
+        get_client().generate(STORY_MODEL, prompt, temperature=STORY_TEMPERATURE, max_tokens=1, **extra)
+
+
+def stream_conspiracy(context: str) -> Iterator[str]:
+    """Same as generate_conspiracy, but yield text fragments as Ollama produces them."""
+    start = time.perf_counter()
+    first = True
+    try:
+        prompt, extra = _story_request(context)
+        for token in get_client().stream(STORY_MODEL, prompt, temperature=STORY_TEMPERATURE, **extra):
+            if first:
+                observe("ollama_first_token", time.perf_counter() - start)
+                first = False
+            yield token
+    finally:
+        # whole stream, including time the consumer spends between tokens
+        observe("ollama", time.perf_counter() - start)
+
+
+# STORY CACHE
+
+def story_cache_key(clicked_nodes: List[str], model: str = STORY_MODEL,
+                    temperature: float = STORY_TEMPERATURE,
+                    prompt_version: str = PROMPT_VERSION,
+                    data_version: Optional[str] = None) -> str:
+    """
+    Cache key: normalized, deduplicated click set plus generation parameters
+    and the version of the corpus the context comes from.
+    """
+    clicks = sorted({normalize_concept(c) for c in clicked_nodes})
+    raw = json.dumps([clicks, model, prompt_version, temperature, data_version], ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+_STORY_CACHE: Optional[StoryCache] = None
+
+
+def get_story_cache() -> StoryCache:
+    global _STORY_CACHE
+    if _STORY_CACHE is None:
+        _STORY_CACHE = StoryCache()
+    return _STORY_CACHE
 
-    theme = detect_theme(clicked, summary)
-    prompt = build_visual_prompt(theme, summary_short)
 
-    pipe = _get_sd_pipe()
-    os.makedirs(output_dir, exist_ok=True)
-    with torch.inference_mode():
-        image = pipe(prompt, num_inference_steps=steps, guidance_scale=scale).images[0]
-    path = os.path.join(output_dir, "evidence2.png")
-    image.save(path)
-    return path
+# GENERATION SCHEDULER
 
-# from PIL import Image, ImageDraw, ImageFont
+# How many stories the local Ollama can generate in parallel (OLLAMA_NUM_PARALLEL)
+STORY_WORKERS = int(os.getenv("STORY_WORKERS", "2"))
+# Requests allowed to wait for a worker before new ones are shed with a 429
+STORY_QUEUE_DEPTH = int(os.getenv("STORY_QUEUE_DEPTH", "16"))
+# lower value runs first
+PRIORITY_USER, PRIORITY_BACKGROUND = 0, 10
 
-# def add_fake_evidence_overlay(image_path: str) -> str:
-#     img = Image.open(image_path).convert("RGBA")
-#     draw = ImageDraw.Draw(img)
 
-#     # Example: Add black "redacted" bars
-#     width, height = img.size
-#     bar_height = height // 20
-#     for i in range(3):  # Add 3 bars
-#         y = (i + 2) * bar_height
-#         draw.rectangle([20, y, width - 20, y + bar_height], fill="black")
+class QueueFull(Exception):
+    """Raised by GenerationScheduler.submit when the queue is at max depth."""
 
-#     # Example: Add "CONFIDENTIAL" stamp
-#     try:
-#         font = ImageFont.truetype("arial.ttf", size=bar_height)
-#     except:
-#         font = ImageFont.load_default()
-#     draw.text((width // 4, height // 10), "CONFIDENTIAL", fill=(255,0,0,128), font=font)
+    def __init__(self, retry_after: int):
+        super().__init__(f"generation queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class GenerationScheduler:
+    """
+    Bounded worker pool for LLM calls.
+
+    Jobs run FIFO on `workers` threads (within a priority level; background
+    jobs such as speculative generations only run when no user job is waiting);
+    at most `max_queue` jobs may wait.
+    Jobs submitted with a key that is already queued or running share that
+    job's Future instead of triggering another generation; a queued job is
+    moved up to the priority of the most urgent submission sharing it. A job
+    whose Future is cancelled while it waits leaves the queue count and no
+    longer absorbs new submissions for its key.
+    Worker threads are started lazily (and restarted after fork).
+    """
+
+    def __init__(self, workers: int = STORY_WORKERS, max_queue: int = STORY_QUEUE_DEPTH):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._inflight: Dict[str, Future] = {}
+        # futures queued and not yet picked up -> their current queue entry
+        self._waiting: Dict[Future, tuple] = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self.running = 0
+        self.completed = self.failed = self.coalesced = self.rejected = self.cancelled = self.promoted = 0
+        self.wait_total = self.service_total = 0.0
+        self.wait_max = self.service_max = 0.0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"story-worker-{i}", daemon=True).start()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def submit(self, key: str, fn: Callable, *args, priority: int = PRIORITY_USER) -> Future:
+        """Queue fn(*args) unless an identical job (same key) is already in flight."""
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None and not fut.done():
+                self.coalesced += 1
+                entry = self._waiting.get(fut)
+                if entry is not None and priority < entry[0]:
+                    # e.g. a user request for a queued speculative story: queue it again
+                    # at the user's priority; the old entry is skipped when it comes up
+                    entry = (priority, next(self._seq)) + entry[2:]
+                    self._waiting[fut] = entry
+                    self._queue.put(entry)
+                    self.promoted += 1
+                return fut
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull(self.retry_after())
+            fut = Future()
+            entry = (priority, next(self._seq), time.monotonic(), key, fn, args, fut)
+            self._inflight[key] = fut
+            self._waiting[fut] = entry
+            self._ensure_started()
+        fut.add_done_callback(lambda f: self._on_cancel(key, f) if f.cancelled() else None)
+        self._queue.put(entry)
+        return fut
+
+    def _on_cancel(self, key: str, fut: Future):
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+            if self._waiting.pop(fut, None) is not None:
+                self.cancelled += 1
+
+    def has_idle_worker(self) -> bool:
+        return self.queued == 0 and self.running < self.workers
+
+    def _worker(self):
+        while True:
+            entry = self._queue.get()
+            _, _, enqueued, key, fn, args, fut = entry
+            start = time.monotonic()
+            with self._lock:
+                if self._waiting.get(fut) is not entry:
+                    continue            # cancelled while queued, or re-queued at a higher priority
+                del self._waiting[fut]
+                self.running += 1
+                self.wait_total += start - enqueued
+                self.wait_max = max(self.wait_max, start - enqueued)
+            try:
+                if fut.set_running_or_notify_cancel():
+                    try:
+                        fut.set_result(fn(*args))
+                    except BaseException as e:
+                        fut.set_exception(e)
+            finally:
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    if self._inflight.get(key) is fut:
+                        del self._inflight[key]
+                    self.running -= 1
+                    self.service_total += elapsed
+                    self.service_max = max(self.service_max, elapsed)
+                    if fut.cancelled() or fut.exception() is not None:
+                        self.failed += 1
+                    else:
+                        self.completed += 1
+
+    def _avg_service(self) -> float:
+        done = self.completed + self.failed
+        return self.service_total / done if done else 5.0
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up."""
+        return max(1, math.ceil((self.queued + 1) / self.workers * self._avg_service()))
+
+    def stats(self) -> dict:
+        done = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queued,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "promoted": self.promoted,
+            "cancelled": self.cancelled,
+            "queue_wait_avg": self.wait_total / done if done else 0.0,
+            "queue_wait_max": self.wait_max,
+            "service_time_avg": self.service_total / done if done else 0.0,
+            "service_time_max": self.service_max,
+        }
+
+
+_SCHEDULER: Optional[GenerationScheduler] = None
+
+
+def get_scheduler() -> GenerationScheduler:
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = GenerationScheduler()
+    return _SCHEDULER
+
+
+# DEADLINES AND DEGRADED FALLBACKS
+
+# seconds /process_clicks may wait for a story (and the stream for its first token)
+# before answering with a fallback (0 = no limit)
+STORY_DEADLINE = float(os.getenv("STORY_DEADLINE", "20"))
+# a cached story is reused for a different click set if their Jaccard overlap is at least this
+STORY_OVERLAP_MIN = float(os.getenv("STORY_OVERLAP_MIN", "0.5"))
+# partially streamed text shorter than this is not worth returning
+STORY_PARTIAL_MIN_CHARS = 80
+_SENTENCE_END = re.compile(r'[.!?]["\'”’)]*(?=\s|$)')
+
+# cache key -> text streamed so far, for generations still running
+_PARTIAL: Dict[str, List[str]] = {}
+# click set -> cache key of recently generated stories, newest last
+_RECENT_CLICKS: "OrderedDict[frozenset, str]" = OrderedDict()
+_DEADLINE_LOCK = threading.Lock()
+# notified when a generation streams a token or finishes, for stream_story readers
+_PARTIAL_UPDATED = threading.Condition(_DEADLINE_LOCK)
+_DEADLINE_STATS = Counter()
+
+
+def _remember_clicks(clicked_nodes: List[str], key: str):
+    clicks = frozenset(normalize_concept(c) for c in clicked_nodes)
+    with _DEADLINE_LOCK:
+        _RECENT_CLICKS.pop(clicks, None)
+        _RECENT_CLICKS[clicks] = key
+        while len(_RECENT_CLICKS) > get_story_cache().max_size:
+            _RECENT_CLICKS.popitem(last=False)
+
+
+def overlapping_story(clicked_nodes: List[str], min_overlap: float = STORY_OVERLAP_MIN) -> Optional[str]:
+    """Cached story whose click set overlaps clicked_nodes the most (Jaccard >= min_overlap)."""
+    clicks = frozenset(normalize_concept(c) for c in clicked_nodes)
+    if not clicks:
+        return None
+    with _DEADLINE_LOCK:
+        candidates = [(len(clicks & other) / len(clicks | other), key)
+                      for other, key in _RECENT_CLICKS.items() if clicks & other]
+    cache = get_story_cache()
+    for overlap, key in sorted(candidates, reverse=True):
+        if overlap < min_overlap:
+            break
+        story = cache.get(key, record=False)
+        if story is not None:
+            return story
+    return None
+
+
+def partial_story(key: str, min_chars: int = STORY_PARTIAL_MIN_CHARS) -> Optional[str]:
+    """Text streamed so far for an in-flight generation, cut at the last full sentence."""
+    with _DEADLINE_LOCK:
+        text = ''.join(_PARTIAL.get(key, ())).strip()
+    ends = [m.end() for m in _SENTENCE_END.finditer(text)]
+    text = text[:ends[-1]] if ends else ''
+    return text if len(text) >= min_chars else None
+
+
+def template_story(docs: Corpus, clicked_nodes: List[str], max_docs: int = 3) -> str:
+    """Instant story stitched together from the titles of the top-ranked docs."""
+    concepts = [c for c in clicked_nodes if c][:3] or ["the official story"]
+    headline = f"Revealed: The Hidden Link Between {' and '.join(concepts)}"
+    top = [d for d in rank_docs(clicked_nodes, filter_docs(docs, clicked_nodes)) if d.title][:max_docs]
+    if not top:
+        return f"{headline}\n\nThe connections are there for anyone willing to look."
+    lines = [f"It starts with \"{top[0].title.strip()}\"."]
+    for doc in top[1:]:
+        lines.append(f"Then came \"{doc.title.strip()}\".")
+    lines.append("Coincidence? Insiders say the pattern is undeniable.")
+    return f"{headline}\n\n{' '.join(lines)}"
+
+
+def degraded_story(docs: Corpus, clicked_nodes: List[str], key: str,
+                   reason: str = "deadline") -> Tuple[str, dict]:
+    """
+    Best story available without waiting any longer, plus info naming the
+    fallback used; `reason` is "deadline" or "error" (generation failed).
+    """
+    story, fallback = overlapping_story(clicked_nodes), "overlap"
+    if story is None:
+        story, fallback = partial_story(key), "partial"
+    if story is None:
+        story, fallback = template_story(docs, clicked_nodes), "template"
+    with _DEADLINE_LOCK:
+        _DEADLINE_STATS[f"{reason}_hits"] += 1
+        _DEADLINE_STATS[fallback] += 1
+    return story, {"cached": False, "degraded": True, "fallback": fallback}
+
+
+def deadline_stats() -> dict:
+    with _DEADLINE_LOCK:
+        counts = dict(_DEADLINE_STATS)
+    return {"deadline": STORY_DEADLINE, "deadline_hits": counts.get("deadline_hits", 0),
+            "error_hits": counts.get("error_hits", 0),
+            **{name: counts.get(name, 0) for name in ("overlap", "partial", "template")}}
+
+
+def _generate_uncached(docs: Corpus, clicked_nodes: List[str], key: str) -> Tuple[str, dict]:
+    cache = get_story_cache()
+    # an identical request may have finished while this one was queued
+    story = cache.get(key, record=False)
+    if story is not None:
+        return story, {"cached": True}
+    matched = filter_docs(docs, clicked_nodes)
+    context, stats = assemble_context(clicked_nodes, matched)
+    # streamed so a request that hits its deadline can use what exists so far
+    parts: List[str] = []
+    with _DEADLINE_LOCK:
+        _PARTIAL[key] = parts
+    try:
+        for token in stream_conspiracy(context):
+            with _PARTIAL_UPDATED:
+                parts.append(token)
+                _PARTIAL_UPDATED.notify_all()
+    finally:
+        with _DEADLINE_LOCK:
+            _PARTIAL.pop(key, None)
+    story = ''.join(parts).strip()
+    cache.put(key, story)
+    _remember_clicks(clicked_nodes, key)
+    return story, {"cached": False, "context_tokens": stats["tokens"]}
+
+
+def generate_story(docs: Corpus, clicked_nodes: List[str],
+                   deadline: Optional[float] = None) -> Tuple[str, dict]:
+    """
+    Full click -> story pipeline behind the story cache and the scheduler.
+    Returns (story, info) where info has 'cached' and, on a miss, 'context_tokens'.
+    `deadline` is a time.monotonic() value (default: now + STORY_DEADLINE); when it
+    passes, the best fallback from degraded_story is returned with info['degraded']
+    set, and the generation keeps running so its result is cached for next time.
+    The same fallback is used when the generation fails (Ollama unreachable) or
+    was cancelled.
+    Raises QueueFull when the generation queue is saturated.
+    """
+    key = story_cache_key(clicked_nodes, data_version=docs.version)
+    story = get_story_cache().get(key)
+    if story is not None:
+        return story, {"cached": True}
+    if deadline is None and STORY_DEADLINE > 0:
+        deadline = time.monotonic() + STORY_DEADLINE
+    fut = get_scheduler().submit(key, _generate_uncached, docs, clicked_nodes, key)
+    try:
+        return fut.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        return degraded_story(docs, clicked_nodes, key)
+    except (OllamaError, CancelledError):
+        return degraded_story(docs, clicked_nodes, key, reason="error")
+
+
+def stream_story(docs: Corpus, clicked_nodes: List[str],
+                 deadline: Optional[float] = None) -> Tuple[dict, Iterator[str]]:
+    """
+    Streaming counterpart of generate_story. Returns (info, tokens); a cache
+    hit yields the whole story at once. The generation is a scheduler job like
+    any other, shared with concurrent requests for the same story, and the
+    tokens are read from what it has streamed so far. If none has arrived by
+    the deadline, or the generation fails before the first one, the
+    degraded_story text is yielded instead; a failure after that raises
+    OllamaError. Raises QueueFull when the generation queue is saturated.
+    """
+    key = story_cache_key(clicked_nodes, data_version=docs.version)
+    story = get_story_cache().get(key)
+    if story is not None:
+        return {"cached": True}, iter([story])
+    if deadline is None and STORY_DEADLINE > 0:
+        deadline = time.monotonic() + STORY_DEADLINE
+    fut = get_scheduler().submit(key, _generate_uncached, docs, clicked_nodes, key)
+    return {"cached": False}, follow_story(fut, docs, clicked_nodes, key, deadline)
+
+
+def follow_story(fut: Future, docs: Corpus, clicked_nodes: List[str], key: str,
+                 deadline: Optional[float] = None) -> Iterator[str]:
+    """
+    Tokens of the generation job `fut` for cache key `key`, read from what it
+    has streamed so far; the fallbacks are those of stream_story.
+    """
+    def wake(_):
+        with _PARTIAL_UPDATED:
+            _PARTIAL_UPDATED.notify_all()
+
+    fut.add_done_callback(wake)
+    parts: Optional[List[str]] = None
+    sent = 0
+    while True:
+        with _PARTIAL_UPDATED:
+            # checked before reading parts: a finished job has appended all of them
+            done = fut.done()
+            if parts is None:
+                parts = _PARTIAL.get(key)
+            if not done and (parts is None or len(parts) == sent):
+                timeout = deadline - time.monotonic() if deadline is not None and not sent else None
+                if timeout is not None and timeout <= 0:
+                    break
+                _PARTIAL_UPDATED.wait(timeout)
+                continue
+            new = parts[sent:] if parts is not None else []
+        # yielded outside the lock; a slow client must not stall the generation
+        sent += len(new)
+        yield from new
+        if done:
+            break
+    if not done:
+        # nothing streamed by the deadline; the job keeps running and is cached
+        yield degraded_story(docs, clicked_nodes, key)[0]
+        return
+    try:
+        story, _ = fut.result()
+    except (OllamaError, CancelledError):
+        if sent:
+            raise
+        story, _ = degraded_story(docs, clicked_nodes, key, reason="error")
+    if not sent:
+        # cached by the time the job ran, or finished before it was followed
+        yield story
 
-#     # Save new image
-#     output_path = image_path.replace(".png", "_overlay.png")
-#     img.save(output_path)
-#     return output_path
 
 if __name__ == "__main__":
     print("Starting generation")
@@ -235,5 +780,5 @@ if __name__ == "__main__":
     context = build_context(clicked, docs)
     summary = generate_conspiracy(context)
     print("Summary:\n", summary)
-    image_path = generate_evidence_image(summary)
+    image_path = generate_evidence_image(summary, clicked)
     print("Generated evidence image at", image_path)
@@ -0,0 +1,326 @@
+"""
+corpus.py
+
+Compact, read-only serving corpus. The raw dataset JSON keeps every record's
+full text (Reddit records carry whole comment lists in `summary`), but story
+generation only needs a title, a short cleaned snippet and the concepts. The
+records are projected once into columns:
+
+- titles and snippets: one UTF-8 string arena each, addressed by an offsets
+  array
+- concepts: normalized concept strings interned into ids (sorted, so a key
+  is found by binary search); each doc's ids live in one flat array('I')
+  addressed by an offsets array
+- postings: the inverse, sorted doc ids per concept id, same layout
+- one SimHash signature per doc (array('Q')) of its title and snippet, the
+  text that goes into the prompt
+
+Docs are exposed as small `Doc` views (__slots__: corpus + row id) with
+`title`, `snippet`, `concept_ids`, `concepts` and `signature`.
+
+The columns can be written to an immutable binary segment (<dataset>.seg
+next to the JSON). Opening a segment mmaps the file and reads every column
+in place through memoryviews, so there is no JSON parse at startup and all
+gunicorn workers share one physical copy through the page cache. Segments
+are published by writing a temporary file and renaming it over the old one:
+readers see either the old or the new segment, never a partial one, and
+processes that already mapped the old file keep using it until they reopen.
+
+Usage:
+    python corpus.py raw_data/final_data/all_spacy_concepts_final.json   # publish the .seg
+
+    from corpus import Corpus
+
+    corpus = Corpus.open_segment("raw_data/final_data/all_spacy_concepts_final.seg")
+    corpus = Corpus.from_records(json.load(f))      # without a segment
+    doc = corpus[0]
+    doc.title, doc.snippet, doc.concepts
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from dedup import simhash
+
+SNIPPET_CHARS = 200
+SEGMENT_SUFFIX = ".seg"
+SEGMENT_MAGIC = b"BSCORP02"
+_SEGMENT_ALIGN = 8
+# section name -> array typecode; string arenas are stored as <name>.text + <name>.offsets
+_SECTIONS = {
+    "titles.text": "B", "titles.offsets": "I",
+    "snippets.text": "B", "snippets.offsets": "I",
+    "concepts.text": "B", "concepts.offsets": "I",
+    "concept_offsets": "I", "concept_data": "I",
+    "posting_offsets": "I", "posting_data": "I",
+    "signatures": "Q",
+}
+
+
+def normalize_concept(concept: str) -> str:
+    """Canonical form used for concept matching (case- and whitespace-insensitive)."""
+    return ' '.join(concept.lower().split())
+
+
+def clean_snippet(record: dict, limit: int = SNIPPET_CHARS) -> str:
+    """Single-line text snippet for a raw record (reddit summaries are lists of comments)."""
+    text = record.get('summary') or record.get('concept', '')
+    if isinstance(text, list):
+        text = " ".join(text)
+    return text.replace('\n', ' ')[:limit]
+
+
+class StringArena:
+    """Many strings stored as one UTF-8 buffer plus an array of byte offsets."""
+
+    __slots__ = ("text", "offsets")
+
+    def __init__(self, text, offsets):
+        self.text = text            # bytes, or a memoryview into a segment
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, strings: Iterable[str]) -> "StringArena":
+        parts: List[bytes] = []
+        offsets = array('I', [0])
+        for s in strings:
+            b = s.encode('utf-8')
+            parts.append(b)
+            offsets.append(offsets[-1] + len(b))
+        return cls(b''.join(parts), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.text[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+
+class Doc:
+    """View of one corpus row."""
+
+    __slots__ = ("corpus", "id")
+
+    def __init__(self, corpus: "Corpus", doc_id: int):
+        self.corpus = corpus
+        self.id = doc_id
+
+    @property
+    def title(self) -> str:
+        return self.corpus.titles[self.id]
+
+    @property
+    def snippet(self) -> str:
+        return self.corpus.snippets[self.id]
+
+    @property
+    def concept_ids(self):
+        c = self.corpus
+        return c.concept_data[c.concept_offsets[self.id]:c.concept_offsets[self.id + 1]]
+
+    @property
+    def concepts(self) -> List[str]:
+        """Normalized concepts of this doc."""
+        keys = self.corpus.concept_keys
+        return [keys[i] for i in self.concept_ids]
+
+    @property
+    def signature(self) -> int:
+        return self.corpus.signatures[self.id]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Doc) and other.corpus is self.corpus and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash((id(self.corpus), self.id))
+
+    def __repr__(self) -> str:
+        return f"Doc({self.id}, {self.title[:40]!r})"
+
+
+def _invert(concept_offsets, concept_data, num_concepts: int):
+    """Posting lists (sorted doc ids per concept id) in offsets + flat data form."""
+    lists = [array('I') for _ in range(num_concepts)]
+    for doc_id in range(len(concept_offsets) - 1):
+        for cid in concept_data[concept_offsets[doc_id]:concept_offsets[doc_id + 1]]:
+            lists[cid].append(doc_id)
+    posting_offsets = array('I', [0])
+    posting_data = array('I')
+    for plist in lists:
+        posting_data.extend(plist)
+        posting_offsets.append(len(posting_data))
+    return posting_offsets, posting_data
+
+
+class Corpus:
+    """Columnar store of the serving corpus; index with corpus[i] or iterate."""
+
+    def __init__(self, titles: StringArena, snippets: StringArena, concept_keys: StringArena,
+                 concept_offsets, concept_data, posting_offsets, posting_data, signatures,
+                 source: Optional[str] = None):
+        self.titles = titles
+        self.snippets = snippets
+        self.concept_keys = concept_keys            # sorted
+        self.concept_offsets = concept_offsets
+        self.concept_data = concept_data
+        self.posting_offsets = posting_offsets
+        self.posting_data = posting_data
+        self.signatures = signatures
+        self.source = source                        # segment path when mmapped
+        self.version: Optional[str] = None          # artifact version, see artifacts.py
+        self._mmap = None
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict], snippet_chars: int = SNIPPET_CHARS) -> "Corpus":
+        titles, snippets, doc_keys = [], [], []
+        signatures = array('Q')
+        for record in records:
+            title, snippet = record.get('title', ''), clean_snippet(record, snippet_chars)
+            titles.append(title)
+            snippets.append(snippet)
+            signatures.append(simhash(f"{title} {snippet}"))
+            doc_keys.append(dict.fromkeys(normalize_concept(c) for c in record.get('concepts_spacy', [])))
+        keys = sorted(set().union(*doc_keys))
+        ids: Dict[str, int] = {k: i for i, k in enumerate(keys)}
+        concept_offsets = array('I', [0])
+        concept_data = array('I')
+        for doc in doc_keys:
+            concept_data.extend(ids[k] for k in doc)
+            concept_offsets.append(len(concept_data))
+        posting_offsets, posting_data = _invert(concept_offsets, concept_data, len(keys))
+        return cls(StringArena.build(titles), StringArena.build(snippets), StringArena.build(keys),
+                   concept_offsets, concept_data, posting_offsets, posting_data, signatures)
+
+    # SEGMENTS
+
+    def _columns(self) -> Dict[str, object]:
+        columns = {}
+        for name in ("titles", "snippets", "concepts"):
+            arena = self.concept_keys if name == "concepts" else getattr(self, name)
+            columns[f"{name}.text"] = arena.text
+            columns[f"{name}.offsets"] = arena.offsets
+        for name in ("concept_offsets", "concept_data", "posting_offsets", "posting_data", "signatures"):
+            columns[name] = getattr(self, name)
+        return columns
+
+    def write_segment(self, path: str):
+        """Write the corpus to `path` as a segment, atomically replacing any existing file."""
+        columns = {name: memoryview(col).cast('B') for name, col in self._columns().items()}
+        sections, offset = {}, 0
+        for name, typecode in _SECTIONS.items():
+            offset = -(-offset // _SEGMENT_ALIGN) * _SEGMENT_ALIGN
+            nbytes = columns[name].nbytes
+            sections[name] = [typecode, offset, nbytes // array(typecode).itemsize]
+            offset += nbytes
+        toc = json.dumps({"byteorder": sys.byteorder, "docs": len(self), "created": time.time(),
+                          "itemsize": {t: array(t).itemsize for t in set(_SECTIONS.values())},
+                          "sections": sections}).encode('utf-8')
+        header = SEGMENT_MAGIC + struct.pack('<I', len(toc)) + toc
+        base = -(-len(header) // _SEGMENT_ALIGN) * _SEGMENT_ALIGN
+
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(header.ljust(base, b'\0'))
+                for name in _SECTIONS:
+                    f.seek(base + sections[name][1])
+                    f.write(columns[name])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @classmethod
+    def open_segment(cls, path: str) -> "Corpus":
+        """Map a segment read-only; columns are zero-copy views into the mapping."""
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a corpus segment of this format")
+        (toc_len,) = struct.unpack_from('<I', mm, len(SEGMENT_MAGIC))
+        toc_start = len(SEGMENT_MAGIC) + 4
+        toc = json.loads(mm[toc_start:toc_start + toc_len])
+        itemsize = {t: array(t).itemsize for t in set(_SECTIONS.values())}
+        if toc["byteorder"] != sys.byteorder or toc["itemsize"] != itemsize:
+            raise ValueError(f"{path} was written on an incompatible platform")
+        if hasattr(mmap, "MADV_WILLNEED"):
+            mm.madvise(mmap.MADV_WILLNEED)
+
+        base = -(-(toc_start + toc_len) // _SEGMENT_ALIGN) * _SEGMENT_ALIGN
+        buf = memoryview(mm)
+
+        def column(name: str):
+            typecode, start, count = toc["sections"][name]
+            view = buf[base + start:base + start + count * itemsize[typecode]]
+            return view if typecode == 'B' else view.cast(typecode)
+
+        def arena(name: str) -> StringArena:
+            return StringArena(column(f"{name}.text"), column(f"{name}.offsets"))
+
+        corpus = cls(arena("titles"), arena("snippets"), arena("concepts"),
+                     column("concept_offsets"), column("concept_data"),
+                     column("posting_offsets"), column("posting_data"), column("signatures"),
+                     source=path)
+        corpus._mmap = mm
+        return corpus
+
+    # LOOKUPS
+
+    def concept_id(self, key: str) -> int:
+        """Id of a normalized concept key, or -1 if no doc has it."""
+        i = bisect_left(self.concept_keys, key)
+        return i if i < len(self.concept_keys) and self.concept_keys[i] == key else -1
+
+    def postings(self, concept_id: int):
+        """Sorted doc ids of one concept id."""
+        return self.posting_data[self.posting_offsets[concept_id]:self.posting_offsets[concept_id + 1]]
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def __getitem__(self, i: int) -> Doc:
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return Doc(self, i % len(self))
+
+    def __iter__(self) -> Iterator[Doc]:
+        return (Doc(self, i) for i in range(len(self)))
+
+
+def segment_path(dataset_path: str) -> str:
+    """Segment published for a dataset JSON file (same name, .seg suffix)."""
+    return os.path.splitext(dataset_path)[0] + SEGMENT_SUFFIX
+
+
+def publish_segment(records: Iterable[dict], dataset_path: str) -> str:
+    """Build the corpus for `records` and atomically publish it next to `dataset_path`."""
+    path = segment_path(dataset_path)
+    Corpus.from_records(records).write_segment(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", help="dataset JSON (list of records)")
+    args = parser.parse_args()
+    with open(args.dataset, encoding='utf-8') as f:
+        records = json.load(f)
+    path = publish_segment(records, args.dataset)
+    corpus = Corpus.open_segment(path)
+    print(f"{len(corpus)} docs, {len(corpus.concept_keys)} concepts -> {path} "
+          f"({os.path.getsize(path) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+dedup.py
+
+SimHash signatures for near-duplicate detection. Each document gets a 64-bit
+signature built from its word 3-shingles; two documents whose signatures
+differ in at most `threshold` bits are treated as near-duplicates
+(reposted Reddit threads, Guardian and NYT covering the same event, ...).
+
+corpus.Corpus computes one signature per document (of its title and
+snippet) when the dataset is loaded and conspiracy_generator uses
+NearDuplicateFilter in assemble_context so near-identical snippets are not
+spent against the prompt budget. The same code works as a corpus-level
+dedup tool, on the full text:
+
+    python dedup.py raw_data/final_data/all_spacy_concepts_final.json
+    python dedup.py in.json out.json --threshold 3
+"""
+
+import argparse
+import hashlib
+import json
+import re
+from typing import Iterable, List, Tuple
+
+SIMHASH_BITS = 64
+DEFAULT_THRESHOLD = 3
+# 4 bands of 16 bits: signatures within 3 bits of each other always agree
+# exactly on at least one band, so candidates are found by band lookup
+_BANDS = 4
+_BAND_BITS = SIMHASH_BITS // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+MAX_THRESHOLD = _BANDS - 1
+_WORD = re.compile(r"\w+")
+# only the opening of long records (Reddit comment dumps) is fingerprinted;
+# near-duplicates agree there too and load time stays bounded
+MAX_SHINGLES = 512
+
+
+def doc_text(doc: dict) -> str:
+    """Title plus full body text of a corpus record."""
+    text = doc.get('summary') or doc.get('concept', '')
+    if isinstance(text, list):
+        text = " ".join(text)
+    return f"{doc.get('title', '')} {text}"
+
+
+def simhash(text: str, shingle: int = 3, max_shingles: int = MAX_SHINGLES) -> int:
+    """64-bit SimHash of the word shingles of `text`."""
+    words = _WORD.findall(text.lower())[:max_shingles + shingle - 1]
+    if len(words) < shingle:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + shingle]) for i in range(len(words) - shingle + 1)]
+    if not grams:
+        return 0
+    # per-bit majority vote over the shingle hashes; counting '1's per column
+    # of the binary strings keeps the inner loop in C
+    rows = [format(int.from_bytes(hashlib.blake2b(g.encode('utf-8'), digest_size=8).digest(), 'big'), '064b')
+            for g in grams]
+    half = len(rows) / 2
+    sig = 0
+    for column in zip(*rows):
+        sig = (sig << 1) | (column.count('1') > half)
+    return sig
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateFilter:
+    """Incrementally collects signatures and answers "is this a near-duplicate?"."""
+
+    def __init__(self, threshold: int = DEFAULT_THRESHOLD):
+        if not 0 <= threshold <= MAX_THRESHOLD:
+            raise ValueError(f"threshold must be between 0 and {MAX_THRESHOLD} for band lookup, got {threshold}")
+        self.threshold = threshold
+        self._bands = [dict() for _ in range(_BANDS)]
+
+    def find(self, sig: int) -> int:
+        """Index of a previously added near-duplicate of `sig`, or -1."""
+        for band, table in enumerate(self._bands):
+            for idx, other in table.get(sig >> (band * _BAND_BITS) & _BAND_MASK, ()):
+                if hamming(sig, other) <= self.threshold:
+                    return idx
+        return -1
+
+    def add(self, sig: int, idx: int = 0):
+        for band, table in enumerate(self._bands):
+            table.setdefault(sig >> (band * _BAND_BITS) & _BAND_MASK, []).append((idx, sig))
+
+    def check_and_add(self, sig: int, idx: int = 0) -> bool:
+        """True if `sig` duplicates something already added; otherwise add it."""
+        if self.find(sig) >= 0:
+            return True
+        self.add(sig, idx)
+        return False
+
+
+def dedup_records(records: Iterable[dict], threshold: int = DEFAULT_THRESHOLD) -> Tuple[List[dict], List[Tuple[int, int]]]:
+    """Keep the first of each near-duplicate group; returns (kept, [(dropped_idx, kept_idx)])."""
+    seen = NearDuplicateFilter(threshold)
+    kept, dropped = [], []
+    for i, rec in enumerate(records):
+        sig = simhash(doc_text(rec))
+        match = seen.find(sig)
+        if match >= 0:
+            dropped.append((i, match))
+            continue
+        seen.add(sig, i)
+        kept.append(rec)
+    return kept, dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input")
+    parser.add_argument("output", nargs="?", help="write the deduplicated corpus here")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD, help="max differing bits (0-3)")
+    args = parser.parse_args()
+
+    with open(args.input, encoding='utf-8') as f:
+        records = json.load(f)
+    kept, dropped = dedup_records(records, args.threshold)
+    print(f"{len(records)} records, {len(dropped)} near-duplicates, {len(kept)} kept")
+    for i, j in dropped[:10]:
+        print(f"  #{i} {records[i].get('title', '')[:60]!r} ~ #{j} {records[j].get('title', '')[:60]!r}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(kept, f, ensure_ascii=False, indent=2)
+        print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
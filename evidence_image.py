@@ -0,0 +1,321 @@
+"""
+evidence_image.py
+
+Stable Diffusion "fake evidence" image generation, split out of
+conspiracy_generator so the text path never pays for it: torch and diffusers
+are imported the first time an image is actually generated, not when this
+module is imported.
+
+Images are written under a hash of prompt, seed, steps and guidance scale
+(see image_key), so repeated requests reuse the file on disk. The
+asynchronous job API around this lives in image_service.
+
+Thread settings are configuration rather than import side effects:
+- SD_NUM_THREADS        intra-op threads for torch (default: torch's choice)
+- SD_INTEROP_THREADS    inter-op threads for torch (default: torch's choice)
+
+CPU execution profile (ignored on CUDA), see bench_sd.py for measurements:
+- SD_ATTENTION          "default", "sliced" (attention slicing, lower peak
+                        memory) or "sdpa" (torch scaled_dot_product_attention)
+- SD_CHANNELS_LAST      1 = run UNet/VAE in channels_last memory format
+- SD_PRECISION          "fp32" (default), "bf16" (bfloat16 autocast) or
+                        "int8" (dynamic int8 quantization of UNet Linear layers)
+- SD_SCHEDULER          "euler" (default) or "fast" (DPM-Solver++, fewer steps)
+- SD_STEPS              default inference steps (20, or 12 with "fast")
+- SD_WIDTH, SD_HEIGHT   output resolution (default 512x512)
+- SD_EMBED_CACHE        prompts whose CLIP embeddings are kept (default 256)
+
+Usage:
+    from evidence_image import generate_evidence_image
+
+    image_path = generate_evidence_image(summary, clicked)
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+SD_NUM_THREADS = int(os.getenv("SD_NUM_THREADS", "0"))
+SD_INTEROP_THREADS = int(os.getenv("SD_INTEROP_THREADS", "0"))
+SD_MODEL_ID = os.getenv("SD_MODEL_ID", "gsdf/Counterfeit-V2.5")
+SD_ATTENTION = os.getenv("SD_ATTENTION", "default")
+SD_CHANNELS_LAST = os.getenv("SD_CHANNELS_LAST", "0") == "1"
+SD_PRECISION = os.getenv("SD_PRECISION", "fp32")
+SD_SCHEDULER = os.getenv("SD_SCHEDULER", "euler")
+SD_STEPS = int(os.getenv("SD_STEPS", "12" if SD_SCHEDULER == "fast" else "20"))
+SD_WIDTH = int(os.getenv("SD_WIDTH", "512"))
+SD_HEIGHT = int(os.getenv("SD_HEIGHT", "512"))
+SD_EMBED_CACHE = int(os.getenv("SD_EMBED_CACHE", "256"))
+
+_TORCH = None
+
+
+def _import_torch():
+    """Import torch on first use and apply the configured thread counts once."""
+    global _TORCH
+    if _TORCH is None:
+        import torch
+        if SD_NUM_THREADS > 0:
+            torch.set_num_threads(SD_NUM_THREADS)
+        if SD_INTEROP_THREADS > 0:
+            try:
+                torch.set_num_interop_threads(SD_INTEROP_THREADS)
+            except RuntimeError:
+                # can only be set before any inter-op work has started
+                pass
+        _TORCH = torch
+    return _TORCH
+
+
+# Pull a model checkpoint fine-tuned for:
+#     •    "Document generation" or "diagram generation".
+#     •    Example: Look for models on civitai.com or HuggingFace like:
+#     ◦    sd-paperspace-docgen
+#                 ==> gated model 
+#     ◦    sci-fi-blueprints-v1
+#                 ==> also not publicly hosted
+#     ◦    Or realistic photo generators.
+
+
+ # pipe = StableDiffusionPipeline.from_pretrained(
+        #     model_id,
+        #     torch_dtype=torch.float32,
+        #     safety_checker=None
+        # )
+
+        # pipe = StableDiffusionPipeline.from_pretrained(
+        # "sd-paperspace-docgen",
+        # use_auth_token=HF_TOKEN,
+        # torch_dtype=torch.float16,
+        # safety_checker=None,
+        # )
+
+# Setup Stable Diffusion pipeline with optimizations
+_SD_PIPE = None
+
+HF_TOKEN = os.environ.get("HUGGING_FACE_API")
+
+def _get_sd_pipe(model_id: Optional[str] = None):
+    global _SD_PIPE
+    if _SD_PIPE is None:
+        torch = _import_torch()
+        from diffusers import StableDiffusionPipeline, EulerDiscreteScheduler, DPMSolverMultistepScheduler
+
+        # device = 'cpu'  # or 'cuda' if you have a GPU
+        # pipe = StableDiffusionPipeline.from_pretrained(
+        #         "gsdf/Counterfeit-V2.5", torch_dtype=torch.float16, safety_checker=None)
+        
+        # pick GPU if available, otherwise CPU
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # on GPU use float16 for speed & memory; on CPU stick with float32
+        sd_kwargs = {"safety_checker": None}
+        if device == 'cuda':
+            sd_kwargs["torch_dtype"] = torch.float16
+        pipe = StableDiffusionPipeline.from_pretrained(model_id or SD_MODEL_ID, **sd_kwargs)
+        if SD_SCHEDULER == "fast":
+            pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+                pipe.scheduler.config, algorithm_type="dpmsolver++", use_karras_sigmas=True)
+        else:
+            pipe.scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config)
+        pipe = pipe.to(device)
+        if device == 'cpu':
+            _apply_cpu_profile(pipe, torch)
+        pipe.set_progress_bar_config(disable=True)
+        _PROMPT_EMBEDS.clear()
+        _SD_PIPE = pipe
+    return _SD_PIPE
+
+
+def _apply_cpu_profile(pipe, torch):
+    """Apply the SD_* CPU settings to a freshly loaded pipeline."""
+    if SD_ATTENTION == "sliced":
+        pipe.enable_attention_slicing()
+    elif SD_ATTENTION == "sdpa":
+        from diffusers.models.attention_processor import AttnProcessor2_0
+        pipe.unet.set_attn_processor(AttnProcessor2_0())
+        pipe.vae.set_attn_processor(AttnProcessor2_0())
+    if SD_CHANNELS_LAST:
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    if SD_PRECISION == "int8":
+        # weights of the attention/feed-forward projections become int8;
+        # activations are quantized on the fly
+        pipe.unet = torch.ao.quantization.quantize_dynamic(pipe.unet, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _autocast(torch):
+    """bfloat16 autocast context for SD_PRECISION=bf16, otherwise a no-op."""
+    if SD_PRECISION == "bf16":
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+
+def detect_theme(clicked_nodes: list, summary: str) -> str:
+    # Seed keywords per category
+    THEMES = {
+        'political': ['government', 'election', 'mayor', 'law', 'congress', 'senate', 'campaign', 'justice', 'president'],
+        'scientific': ['lab', 'experiment', 'research', 'scientist', 'virus', '5g', 'climate', 'dna', 'biology', 'physics'],
+        'tech': ['data', 'server', 'ai', 'algorithm', 'cctv', 'surveillance', 'hack', 'blockchain', 'software', 'chip'],
+        'space': ['ufo', 'nasa', 'satellite', 'space', 'alien', 'cosmos', 'orbit', 'astronaut', 'extraterrestrial']
+    }
+
+    text_blob = ' '.join(clicked_nodes).lower() + ' ' + summary.lower()
+
+    for theme, keywords in THEMES.items():
+        for word in keywords:
+            if word in text_blob:
+                return theme
+    return 'generic'
+
+def build_visual_prompt(theme: str, summary_short: str) -> str:
+    PROMPTS = {
+        'political': f"Leaked confidential government file, hidden seals, courtroom sketch style, {summary_short}, no text",
+        'scientific': f"Fake laboratory photo, mysterious device, forged research diagram, {summary_short}, no text",
+        'tech': f"Blurry CCTV screenshot, hacked data servers, digital breach aesthetics, {summary_short}, no text",
+        'space': f"Classified satellite image, unidentified object, space agency confidential photo, {summary_short}, no text",
+        'generic': f"Mysterious photographic evidence linked to conspiracy, dark atmosphere, {summary_short}, no text"
+    }
+    return PROMPTS.get(theme, PROMPTS['generic'])
+
+def build_evidence_prompt(summary: str, clicked_nodes: List[str] = ()) -> str:
+    """Themed visual prompt from the story summary and the clicked nodes."""
+    # Truncate summary to 15 words for brevity
+    words = summary.split()
+    summary_short = " ".join(words[:20]) + ("..." if len(words) > 20 else "")
+
+    theme = detect_theme(list(clicked_nodes), summary)
+    return build_visual_prompt(theme, summary_short)
+
+
+def image_key(prompt: str, seed: int, steps: int, scale: float) -> str:
+    """Content address for an image: identical inputs map to the same file."""
+    raw = json.dumps([prompt, seed, steps, scale, SD_MODEL_ID, SD_SCHEDULER, SD_WIDTH, SD_HEIGHT],
+                     ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def default_seed(prompt: str) -> int:
+    """Deterministic seed so repeated prompts are cache hits."""
+    return int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8], 16)
+
+
+# Text-encoder outputs per prompt text (LRU). The negative prompt is always
+# "", so its embedding is computed once and shared by every call.
+_PROMPT_EMBEDS: "OrderedDict[str, object]" = OrderedDict()
+_EMBED_LOCK = threading.Lock()
+_EMBED_STATS = {"hits": 0, "misses": 0}
+NEGATIVE_PROMPT = ""
+
+
+def _encode_prompts(pipe, torch, prompts: List[str]):
+    """CLIP-encode prompts exactly as the pipeline does (padded to max length)."""
+    tokens = pipe.tokenizer(prompts, padding="max_length", max_length=pipe.tokenizer.model_max_length,
+                            truncation=True, return_tensors="pt")
+    with torch.inference_mode():
+        return pipe.text_encoder(tokens.input_ids.to(pipe.text_encoder.device))[0]
+
+
+def prompt_embeddings(pipe, torch, prompts: List[str]):
+    """
+    (prompt_embeds, negative_prompt_embeds) for a batch of prompts, reusing
+    cached encoder outputs and encoding only the prompts not seen recently.
+    """
+    with _EMBED_LOCK:
+        missing = [p for p in dict.fromkeys(prompts + [NEGATIVE_PROMPT]) if p not in _PROMPT_EMBEDS]
+    if missing:
+        encoded = _encode_prompts(pipe, torch, missing)
+    with _EMBED_LOCK:
+        for i, prompt in enumerate(missing):
+            _PROMPT_EMBEDS[prompt] = encoded[i:i + 1]
+        _EMBED_STATS["misses"] += sum(1 for p in prompts if p in missing)
+        _EMBED_STATS["hits"] += sum(1 for p in prompts if p not in missing)
+        for prompt in prompts + [NEGATIVE_PROMPT]:
+            _PROMPT_EMBEDS.move_to_end(prompt)
+        embeds = torch.cat([_PROMPT_EMBEDS[p] for p in prompts])
+        negative = _PROMPT_EMBEDS[NEGATIVE_PROMPT].expand(len(prompts), -1, -1)
+        # the negative embedding is pinned at the MRU end, so it is never evicted
+        while len(_PROMPT_EMBEDS) > max(SD_EMBED_CACHE, 1) + 1:
+            _PROMPT_EMBEDS.popitem(last=False)
+    return embeds, negative
+
+
+def embed_cache_stats() -> dict:
+    lookups = _EMBED_STATS["hits"] + _EMBED_STATS["misses"]
+    return {**_EMBED_STATS, "size": len(_PROMPT_EMBEDS),
+            "hit_rate": _EMBED_STATS["hits"] / lookups if lookups else 0.0}
+
+
+def render_images(items: List[Tuple[str, str, int]], steps: int = SD_STEPS, scale: float = 8.0) -> List[str]:
+    """
+    Render several (prompt, path, seed) items in one batched pipeline call.
+    Each item gets its own generator, so its image depends only on its seed.
+    """
+    pipe = _get_sd_pipe()
+    torch = _import_torch()
+    prompts = [prompt for prompt, _, _ in items]
+    prompt_embeds, negative_embeds = prompt_embeddings(pipe, torch, prompts)
+    generators = [torch.Generator(device='cpu').manual_seed(seed) for _, _, seed in items]
+    with torch.inference_mode(), _autocast(torch):
+        images = pipe(prompt_embeds=prompt_embeds, negative_prompt_embeds=negative_embeds,
+                      num_inference_steps=steps, guidance_scale=scale, generator=generators,
+                      width=SD_WIDTH, height=SD_HEIGHT).images
+    paths = []
+    for image, (_, path, _) in zip(images, items):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # write-then-rename so readers never see a partial file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        image.save(tmp, format='PNG')
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+
+def render_image(prompt: str, path: str, seed: int, steps: int = SD_STEPS, scale: float = 8.0) -> str:
+    """Run the pipeline for one prompt and save the image to `path`."""
+    return render_images([(prompt, path, seed)], steps, scale)[0]
+
+
+def generate_evidence_image(summary: str, clicked_nodes: List[str] = (), output_dir: str="images",
+                            steps: int=SD_STEPS, scale: float=8.0, seed: Optional[int] = None) -> str:
+    """
+    Generate a single "fake evidence" image (no words) representing the conspiracy.
+    Uses a very short prompt to avoid CLIP token limits and a single call to reduce multiprocessing overhead.
+    The file is named by image_key, so an identical request reuses the existing image.
+    """
+    prompt = build_evidence_prompt(summary, clicked_nodes)
+    if seed is None:
+        seed = default_seed(prompt)
+    path = os.path.join(output_dir, f"{image_key(prompt, seed, steps, scale)}.png")
+    if os.path.exists(path):
+        return path
+    return render_image(prompt, path, seed, steps, scale)
+
+# from PIL import Image, ImageDraw, ImageFont
+
+# def add_fake_evidence_overlay(image_path: str) -> str:
+#     img = Image.open(image_path).convert("RGBA")
+#     draw = ImageDraw.Draw(img)
+
+#     # Example: Add black "redacted" bars
+#     width, height = img.size
+#     bar_height = height // 20
+#     for i in range(3):  # Add 3 bars
+#         y = (i + 2) * bar_height
+#         draw.rectangle([20, y, width - 20, y + bar_height], fill="black")
+
+#     # Example: Add "CONFIDENTIAL" stamp
+#     try:
+#         font = ImageFont.truetype("arial.ttf", size=bar_height)
+#     except:
+#         font = ImageFont.load_default()
+#     draw.text((width // 4, height // 10), "CONFIDENTIAL", fill=(255,0,0,128), font=font)
+
+#     # Save new image
+#     output_path = image_path.replace(".png", "_overlay.png")
+#     img.save(output_path)
+#     return output_path
@@ -0,0 +1,200 @@
+"""
+fake_ollama.py
+
+Stand-in for the Ollama /api/generate endpoint, for benchmarking the app
+without a real model. It streams NDJSON tokens the way Ollama does and
+reports the same timing fields (prompt_eval_count, prompt_eval_duration,
+eval_count, eval_duration, total_duration, context), with configurable
+latency and throughput:
+
+- prompt evaluation takes prompt_tokens / --prompt-rate seconds; tokens a
+  client passes back via `context` are already evaluated, and with
+  --prefix-cache each slot also skips the prefix it shares with the previous
+  request on that slot (Ollama's KV cache reuse while the model stays loaded)
+- the first token arrives after an extra lognormal delay (--ttft-ms, --ttft-sigma)
+- generated tokens stream at --tokens-per-s, up to num_predict / --max-tokens
+- at most --parallel requests are served at once (OLLAMA_NUM_PARALLEL);
+  the rest wait, as they would on a real server
+- --error-rate makes that fraction of requests fail with HTTP --error-status
+  (default 500; 429 imitates a server that is shedding load)
+- the bodies of the last requests are kept in the handler's `received`, for tests
+
+    python fake_ollama.py --port 11434 --ttft-ms 300 --tokens-per-s 25 --parallel 2
+    OLLAMA_API_URL=http://localhost:11434/api/generate python app.py
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the shocking truth they do not want you to know about secret documents "
+         "revealed undeniable proof exposed hidden agenda insiders confirm").split()
+
+_CHARS_PER_TOKEN = 4
+
+
+def _tokenize(text: str) -> list:
+    """Stand-in tokenizer: one content-derived id per 4 characters."""
+    return [zlib.crc32(text[i:i + _CHARS_PER_TOKEN].encode()) for i in range(0, len(text), _CHARS_PER_TOKEN)]
+
+
+def _common_prefix(a: list, b: list) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None          # argparse namespace, set by make_server
+    slots = None           # threading.Semaphore(parallel)
+    kv = None              # last evaluated token sequence per slot (--prefix-cache)
+    kv_lock = None
+    received = None        # bodies of the most recent requests, oldest first
+
+    def log_message(self, fmt, *args):
+        if not self.config.quiet:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, obj: dict):
+        line = json.dumps(obj).encode() + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "llama2:latest"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.received.append(body)
+        cfg = self.config
+        if random.random() < cfg.error_rate:
+            self._send_json(cfg.error_status, {"error": "injected failure"})
+            return
+
+        with self.slots:
+            start = time.perf_counter()
+            context = list(body.get("context") or [])
+            # tokens passed back in `context` are already evaluated
+            sequence = context + _tokenize(body.get("system") or "") + _tokenize(body.get("prompt", ""))
+            reused = len(context)
+            if cfg.prefix_cache:
+                with self.kv_lock:
+                    slot = max(range(len(self.kv)), key=lambda i: _common_prefix(self.kv[i], sequence))
+                    reused = max(reused, _common_prefix(self.kv[slot], sequence))
+                    self.kv[slot] = sequence
+            prompt_tokens = max(len(sequence) - reused, 1)
+            prompt_eval_s = prompt_tokens / cfg.prompt_rate
+            ttft_s = random.lognormvariate(math.log(max(cfg.ttft_ms, 1e-3) / 1000), cfg.ttft_sigma)
+            time.sleep(prompt_eval_s + ttft_s)
+
+            options = body.get("options") or {}
+            n_tokens = min(int(options.get("num_predict") or cfg.max_tokens), cfg.max_tokens)
+            stream = body.get("stream", True)
+            eval_start = time.perf_counter()
+            words = [random.choice(WORDS) for _ in range(n_tokens)]
+            generated = [zlib.crc32(w.encode()) for w in words]
+
+            if stream:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for i, word in enumerate(words):
+                        if i:
+                            time.sleep(1 / cfg.tokens_per_s)
+                        self._chunk({"model": body.get("model"), "response": (" " if i else "") + word,
+                                     "done": False})
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+            else:
+                time.sleep(max(n_tokens - 1, 0) / cfg.tokens_per_s)
+
+            now = time.perf_counter()
+            final = {
+                "model": body.get("model"),
+                "response": "" if stream else " ".join(words),
+                "done": True,
+                "context": sequence + generated,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_eval_s * 1e9),
+                "eval_count": n_tokens,
+                "eval_duration": int((now - eval_start) * 1e9),
+                "total_duration": int((now - start) * 1e9),
+            }
+            if stream:
+                try:
+                    self._chunk(final)
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+            else:
+                self._send_json(200, final)
+
+
+def make_server(config, host: str = "127.0.0.1", port: int = 11434) -> ThreadingHTTPServer:
+    """Build (but do not start) a fake Ollama server; port 0 picks a free port."""
+    handler = type("Handler", (FakeOllamaHandler,), {
+        "config": config, "slots": threading.Semaphore(config.parallel),
+        "kv": [[] for _ in range(config.parallel)], "kv_lock": threading.Lock(),
+        "received": deque(maxlen=100)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--ttft-ms", type=float, default=300, help="median extra time to first token")
+    parser.add_argument("--ttft-sigma", type=float, default=0.3, help="lognormal sigma of that delay")
+    parser.add_argument("--tokens-per-s", type=float, default=25)
+    parser.add_argument("--prompt-rate", type=float, default=400, help="prompt tokens evaluated per second")
+    parser.add_argument("--max-tokens", type=int, default=120)
+    parser.add_argument("--parallel", type=int, default=1, help="requests served concurrently")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected failures")
+    parser.add_argument("--prefix-cache", action="store_true", help="reuse the prefix shared with a slot's last prompt")
+    parser.add_argument("--quiet", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main():
+    config = parse_args()
+    server = make_server(config, config.host, config.port)
+    print(f"fake Ollama on http://{config.host}:{server.server_port}/api/generate "
+          f"(ttft {config.ttft_ms} ms, {config.tokens_per_s} tok/s, parallel {config.parallel})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
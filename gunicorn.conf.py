@@ -0,0 +1,80 @@
+"""
+gunicorn.conf.py
+
+Pre-fork production server configuration:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+- preload_app: wsgi.py (model, corpus, indexes) is imported once in the
+  master and shared copy-on-write by the workers
+- gthread workers: most of a request is spent waiting on Ollama or
+  streaming SSE, so each worker serves WEB_THREADS requests concurrently
+- workers are recycled after WEB_MAX_REQUESTS requests (with jitter, so
+  they do not all restart together) and get WEB_GRACEFUL_TIMEOUT seconds
+  to finish in-flight requests; the replacement is forked from the master,
+  so recycling does not reload anything
+- every worker checks after startup that it inherited the heavy objects
+  instead of loading its own copy, and exits otherwise
+- every worker warms up in the background after startup (warmup.py) and
+  reports ready on /readyz only then; point the load balancer's health
+  check at /readyz and liveness probes at /healthz
+- the arbiter starts one Stable Diffusion worker that all web workers
+  submit evidence images to (image_service.py), so WEB_WORKERS does not
+  multiply the pipeline's memory or split its micro-batches
+- workers reload the model and corpus on SIGUSR2 and follow newly
+  published artifact versions by themselves (see artifacts.py); send
+  signals to the workers, since gunicorn's master uses USR2 for upgrades
+
+See "Running in production" in README.md for sizing.
+
+Configuration (environment):
+- PORT                  listen port (default 5001)
+- WEB_WORKERS           worker processes (default 2)
+- WEB_THREADS           threads per worker (default 8)
+- WEB_MAX_REQUESTS      requests before a worker is recycled (default 2000)
+- WEB_TIMEOUT           seconds a request may block a worker (default 120)
+- WEB_GRACEFUL_TIMEOUT  seconds to drain on restart (default 30)
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv("WEB_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "8"))
+preload_app = True
+
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+# SSE story streams can legitimately run for a while
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+accesslog = "-"
+
+
+def when_ready(server):
+    import image_service
+
+    if image_service.start_worker() is None:
+        server.log.info("image worker already running for %s", image_service.IMAGE_DIR)
+
+
+def post_worker_init(worker):
+    import wsgi
+
+    reloaded = wsgi.check_preloaded()
+    if reloaded:
+        worker.log.error("worker %s loaded its own copy of %s; is preload_app off?",
+                         worker.pid, ", ".join(reloaded))
+        raise SystemExit(1)
+    worker.log.info("worker %s sharing preloaded model and corpus", worker.pid)
+    # gunicorn has reset the worker's signal handlers by now
+    import artifacts
+
+    artifacts.install_signal_handler()
+    # warm caches and Ollama in the background; /readyz answers 503 until done
+    import warmup
+
+    warmup.get_warmup().start()
@@ -0,0 +1,377 @@
+"""
+image_service.py
+
+Asynchronous evidence-image jobs. The web processes only build the prompt and
+write the job to IMAGE_DIR/jobs/<job_id>.json; Stable Diffusion runs in one
+image worker process per IMAGE_DIR that loads the pipeline once
+(evidence_image._get_sd_pipe), keeps it warm and renders the queued job
+files of every web process. Jobs that arrive close together are rendered as
+one batched pipeline call (per-item seeds), which gives better throughput per
+image on CPU.
+
+Job ids are the content address of the image (evidence_image.image_key), so
+submitting the same summary/clicks/seed/steps again is answered from disk
+without touching the worker. A finished job is answered by its image file,
+an unfinished or failed one by its job file, so any web process can answer
+for any job.
+
+Only one image worker serves a directory: it holds an exclusive lock on
+IMAGE_DIR/worker.lock, and a second one exits at once. gunicorn.conf.py
+starts it from the arbiter, so all web workers share one pipeline. A web
+process starts it itself when none is running (the development server, or
+after the worker died); queued jobs wait in their files meanwhile, and jobs
+that were being rendered when a worker died are reported as failed (submit
+them again to retry). It can also run as a separate service on the same
+host:
+
+    python image_service.py worker
+
+Configuration (environment):
+- IMAGE_DIR           output directory (default "images")
+- IMAGE_STEPS         default inference steps (default SD_STEPS)
+- IMAGE_MAX_STEPS     upper bound accepted from clients (default 50)
+- IMAGE_QUEUE_DEPTH   max jobs waiting for the worker, over all web
+                      processes (default 32)
+- IMAGE_BATCH_WINDOW  seconds the worker waits for more jobs to batch with
+                      the first one (default 0.25)
+- IMAGE_MAX_BATCH     max prompts per pipeline call (default 4)
+- IMAGE_POLL          seconds between scans for new job files (default 0.2)
+
+Usage:
+    from image_service import get_image_service
+
+    service = get_image_service()
+    job = service.submit(summary, clicked)
+    ...
+    job = service.status(job["job_id"])   # queued / running / done / error
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+from evidence_image import SD_STEPS, build_evidence_prompt, default_seed, image_key
+
+IMAGE_DIR = os.getenv("IMAGE_DIR", "images")
+IMAGE_STEPS = int(os.getenv("IMAGE_STEPS", str(SD_STEPS)))
+IMAGE_MAX_STEPS = int(os.getenv("IMAGE_MAX_STEPS", "50"))
+IMAGE_QUEUE_DEPTH = int(os.getenv("IMAGE_QUEUE_DEPTH", "32"))
+IMAGE_BATCH_WINDOW = float(os.getenv("IMAGE_BATCH_WINDOW", "0.25"))
+IMAGE_MAX_BATCH = int(os.getenv("IMAGE_MAX_BATCH", "4"))
+IMAGE_POLL = float(os.getenv("IMAGE_POLL", "0.2"))
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+
+_JOB_FIELDS = ("job_id", "status", "path", "prompt", "seed", "steps", "scale", "created", "started",
+               "finished", "error")
+
+
+class ImageQueueFull(RuntimeError):
+    """Raised when too many image jobs are already waiting."""
+
+
+def _jobs_dir(output_dir: str) -> str:
+    return os.path.join(output_dir, "jobs")
+
+
+def _job_path(output_dir: str, job_id: str) -> str:
+    return os.path.join(_jobs_dir(output_dir), f"{job_id}.json")
+
+
+def _write_job(output_dir: str, job: dict):
+    """Publish a job's state to every process; a done job has its image instead."""
+    path = _job_path(output_dir, job["job_id"])
+    try:
+        if job["status"] == DONE:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(_jobs_dir(output_dir), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({k: job[k] for k in _JOB_FIELDS if k in job}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _read_job(output_dir: str, job_id: str) -> Optional[dict]:
+    try:
+        with open(_job_path(output_dir, job_id)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _pending_jobs(output_dir: str) -> List[dict]:
+    """Queued and running jobs of all web processes, oldest first."""
+    try:
+        names = os.listdir(_jobs_dir(output_dir))
+    except OSError:
+        return []
+    jobs = []
+    for name in names:
+        if name.endswith(".json"):
+            job = _read_job(output_dir, name[:-len(".json")])
+            if job is not None and job["status"] in (QUEUED, RUNNING):
+                jobs.append(job)
+    jobs.sort(key=lambda j: j["created"])
+    return jobs
+
+
+def _lock_path(output_dir: str) -> str:
+    return os.path.join(output_dir, "worker.lock")
+
+
+def _info_path(output_dir: str) -> str:
+    return os.path.join(output_dir, "worker.json")
+
+
+def worker_running(output_dir: str = IMAGE_DIR) -> bool:
+    """True if an image worker holds the lock of `output_dir`."""
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(_lock_path(output_dir), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+    except OSError:
+        pass
+    return False
+
+
+def start_worker(output_dir: str = IMAGE_DIR) -> Optional[subprocess.Popen]:
+    """Start the image worker for `output_dir` unless one runs; it exits with its parent."""
+    if worker_running(output_dir):
+        return None
+    # a fresh interpreter, not a fork: the worker must not inherit the web process' threads
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", "--dir", output_dir,
+                             "--exit-with-parent"])
+
+
+class ImageWorker:
+    """Renders the queued job files of one IMAGE_DIR in micro-batches."""
+
+    def __init__(self, output_dir: str = IMAGE_DIR, window: float = IMAGE_BATCH_WINDOW,
+                 max_batch: int = IMAGE_MAX_BATCH, poll: float = IMAGE_POLL,
+                 render: Optional[Callable] = None):
+        self.output_dir = output_dir
+        self.window = window
+        self.max_batch = max_batch
+        self.poll = poll
+        # render(items, steps, scale) with (prompt, path, seed) items; Stable Diffusion by default
+        self.render = render
+        self.ready = False
+        self.error = None
+        self.completed = self.failed = 0
+
+    def run(self, stop: Optional[threading.Event] = None, parent: Optional[int] = None) -> bool:
+        """
+        Serve jobs until `stop` is set (or process `parent` exits). Returns
+        False at once if another worker already serves the directory.
+        """
+        stop = stop or threading.Event()
+        os.makedirs(_jobs_dir(self.output_dir), exist_ok=True)
+        lock = open(_lock_path(self.output_dir), "a")
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            self._serve(stop, parent)
+            return True
+        finally:
+            lock.close()
+
+    def _serve(self, stop: threading.Event, parent: Optional[int]):
+        self._publish()
+        self._load()
+        # we hold the lock, so a running job was left behind by a worker that died
+        for job in _pending_jobs(self.output_dir):
+            if job["status"] == RUNNING:
+                self._finish(job, "the image worker exited while rendering this job")
+        self._publish()
+        while not stop.is_set() and (parent is None or os.getppid() == parent):
+            jobs = [j for j in _pending_jobs(self.output_dir) if j["status"] == QUEUED]
+            if not jobs:
+                stop.wait(self.poll)
+                continue
+            if len(jobs) < self.max_batch and self.window > 0:
+                stop.wait(self.window)
+                jobs = [j for j in _pending_jobs(self.output_dir) if j["status"] == QUEUED]
+            self._render_batch(jobs[:self.max_batch])
+            self._publish()
+
+    def _load(self):
+        if self.render is not None:
+            self.ready = True
+            return
+        import evidence_image
+
+        try:
+            evidence_image._get_sd_pipe()
+        except Exception as e:
+            # keep running so every job gets a clear error instead of waiting forever
+            self.error = f"pipeline failed to load: {type(e).__name__}: {e}"
+            return
+        self.render = evidence_image.render_images
+        self.ready = True
+
+    def _render_batch(self, batch: List[dict]):
+        if self.error:
+            for job in batch:
+                self._finish(job, self.error)
+            return
+        for job in [j for j in batch if os.path.exists(j["path"])]:
+            # submitted again while its image was being written
+            batch.remove(job)
+            self._finish(job)
+        # only jobs with the same steps/scale can share a pipeline call
+        groups = {}
+        for job in batch:
+            groups.setdefault((job["steps"], job["scale"]), []).append(job)
+        for (steps, scale), jobs in groups.items():
+            for job in jobs:
+                job["status"], job["started"] = RUNNING, time.time()
+                _write_job(self.output_dir, job)
+            try:
+                self.render([(j["prompt"], j["path"], j["seed"]) for j in jobs], steps, scale)
+            except Exception as e:
+                for job in jobs:
+                    self._finish(job, f"{type(e).__name__}: {e}")
+            else:
+                for job in jobs:
+                    self._finish(job)
+
+    def _finish(self, job: dict, error: Optional[str] = None):
+        job["finished"] = time.time()
+        if error is None:
+            job["status"] = DONE
+            self.completed += 1
+        else:
+            job["status"], job["error"] = ERROR, error
+            self.failed += 1
+        _write_job(self.output_dir, job)
+
+    def _publish(self):
+        """Write the worker's state for ImageService.stats() in the web processes."""
+        info = {"pid": os.getpid(), "ready": self.ready, "error": self.error,
+                "completed": self.completed, "failed": self.failed}
+        path = _info_path(self.output_dir)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(info, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+
+class ImageService:
+    def __init__(self, output_dir: str = IMAGE_DIR, max_queue: int = IMAGE_QUEUE_DEPTH):
+        self.output_dir = output_dir
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._proc = None
+        self.submitted = self.cache_hits = 0
+
+    def _ensure_worker(self):
+        """Start the shared image worker if nobody runs it (development server, or it died)."""
+        if self._proc is not None and self._proc.poll() is None:
+            # started by us and still loading (it takes the lock after its imports)
+            return
+        proc = start_worker(self.output_dir)
+        if proc is not None:
+            self._proc = proc
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.output_dir, f"{job_id}.png")
+
+    def submit(self, summary: str, clicked_nodes: List[str] = (), seed: Optional[int] = None,
+               steps: int = IMAGE_STEPS, scale: float = 8.0) -> dict:
+        """Queue an image for `summary`; returns the job (possibly already done)."""
+        steps = max(1, min(int(steps), IMAGE_MAX_STEPS))
+        prompt = build_evidence_prompt(summary, clicked_nodes)
+        seed = default_seed(prompt) if seed is None else int(seed)
+        job_id = image_key(prompt, seed, steps, scale)
+        path = self._path(job_id)
+        now = time.time()
+        with self._lock:
+            self.submitted += 1
+            if os.path.exists(path):
+                self.cache_hits += 1
+                return {"job_id": job_id, "status": DONE, "path": path, "created": now, "finished": now}
+            job = _read_job(self.output_dir, job_id)
+            if job is None or job["status"] == ERROR:
+                pending = len(_pending_jobs(self.output_dir))
+                if pending >= self.max_queue:
+                    raise ImageQueueFull(f"{pending} image jobs pending")
+                job = {"job_id": job_id, "status": QUEUED, "path": path, "prompt": prompt,
+                       "seed": seed, "steps": steps, "scale": scale, "created": now}
+                _write_job(self.output_dir, job)
+            # else: already queued or being rendered for some web process
+            self._ensure_worker()
+            return job
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """Current job state, whichever web process submitted it."""
+        path = self._path(job_id)
+        if os.path.exists(path):
+            return {"job_id": job_id, "status": DONE, "path": path}
+        job = _read_job(self.output_dir, job_id)
+        if job is not None and job["status"] in (QUEUED, RUNNING):
+            with self._lock:
+                self._ensure_worker()
+        return job
+
+    def stats(self) -> dict:
+        info = {}
+        if worker_running(self.output_dir):
+            try:
+                with open(_info_path(self.output_dir)) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                pass
+        return {
+            "worker_ready": bool(info.get("ready")),
+            "pending": len(_pending_jobs(self.output_dir)),
+            "submitted": self.submitted,
+            "cache_hits": self.cache_hits,
+            "completed": info.get("completed", 0),
+            "failed": info.get("failed", 0),
+        }
+
+
+_SERVICE: Optional[ImageService] = None
+
+
+def get_image_service() -> ImageService:
+    global _SERVICE
+    if _SERVICE is None:
+        _SERVICE = ImageService()
+    return _SERVICE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["worker"])
+    parser.add_argument("--dir", default=IMAGE_DIR, help="IMAGE_DIR to serve")
+    parser.add_argument("--exit-with-parent", action="store_true",
+                        help="exit when the process that started the worker exits")
+    args = parser.parse_args()
+
+    parent = os.getppid() if args.exit_with_parent else None
+    if not ImageWorker(args.dir).run(parent=parent):
+        print(f"an image worker already serves {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
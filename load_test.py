@@ -0,0 +1,188 @@
+"""
+load_test.py
+
+Replay realistic sessions against a running app.py and report throughput,
+latency percentiles per route and error rates. Each virtual user does what
+graph.js does:
+
+    GET /  ->  POST / (search)  ->  N x GET /api/neighbors (click a returned node)
+           ->  POST /process_clicks/stream (make story, read to the end)
+
+The story is reported twice: time to the first token and time until the
+stream is done.
+
+Start the app against the fake model server for offline runs:
+
+    python fake_ollama.py --quiet --parallel 2 &
+    OLLAMA_API_URL=http://localhost:11434/api/generate python app.py &
+    python load_test.py --users 8 --duration 60
+
+Status 429 (load shedding) is reported separately from errors; a stream
+that ends with an SSE error event counts as an error.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+# suffix of the time-to-first-token pseudo-route; not a request of its own
+FIRST_TOKEN = " (first token)"
+
+SEED_QUERIES = ["trump", "vaccines", "moon", "elon musk", "aliens", "5g", "election", "climate"]
+
+_RESULTS = re.compile(r"results:\s*(\[.*?\])\s*,\s*\n")
+_ALL_QUERIES = re.compile(r"all_queries:\s*(\[.*?\])\s*\n")
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route: str, status: int, seconds: float):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def _timed(recorder: Recorder, route: str, fn, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        resp = fn(*args, **kwargs)
+        status = resp.status_code
+    except requests.RequestException:
+        resp, status = None, 0          # connection error / timeout
+    recorder.record(route, status, time.perf_counter() - start)
+    return resp
+
+
+def _results(resp) -> list:
+    if resp is None or resp.status_code != 200:
+        return []
+    match = _RESULTS.search(resp.text)
+    return json.loads(match.group(1)) if match else []
+
+
+def _neighbors(resp) -> list:
+    if resp is None or resp.status_code != 200:
+        return []
+    try:
+        return resp.json().get("results") or []
+    except ValueError:
+        return []
+
+
+def _story(recorder: Recorder, base: str, session: requests.Session, clicked: list, timeout: float):
+    """POST the clicks to the SSE endpoint and read the story to the end."""
+    route = "POST /process_clicks/stream"
+    start = time.perf_counter()
+    try:
+        with session.post(base + "/process_clicks/stream", json={"clicked": clicked},
+                          headers={"Accept": "text/event-stream"}, stream=True, timeout=timeout) as resp:
+            if resp.status_code != 200:
+                recorder.record(route, resp.status_code, time.perf_counter() - start)
+                return
+            status, first = 200, None
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event: error"):
+                    status = 0
+                elif first is None and line.startswith("data:") and '"token"' in line:
+                    first = time.perf_counter() - start
+                    recorder.record(route + FIRST_TOKEN, 200, first)
+    except requests.RequestException:
+        status = 0                      # connection error / timeout
+    recorder.record(route, status, time.perf_counter() - start)
+
+
+def run_session(base: str, session: requests.Session, recorder: Recorder, queries: list,
+                clicks: int, think: float, timeout: float):
+    _timed(recorder, "GET /", session.get, base + "/", timeout=timeout)
+    query = random.choice(queries)
+    clicked = [query]
+    results = _results(_timed(recorder, "POST / (search)", session.post, base + "/",
+                              data={"query": query}, timeout=timeout))
+    for _ in range(clicks):
+        if not results:
+            break
+        time.sleep(think)
+        node = random.choice(results)
+        clicked.append(node)
+        results = _neighbors(_timed(recorder, "GET /api/neighbors", session.get, base + "/api/neighbors",
+                                    params={"query": node}, timeout=timeout))
+    time.sleep(think)
+    _story(recorder, base, session, clicked, timeout)
+
+
+def load_queries(base: str, timeout: float) -> list:
+    """Use the app's own vocabulary when available so searches hit real nodes."""
+    try:
+        match = _ALL_QUERIES.search(requests.get(base + "/", timeout=timeout).text)
+        if match:
+            vocab = json.loads(match.group(1))
+            if vocab:
+                return random.sample(vocab, min(200, len(vocab)))
+    except (requests.RequestException, ValueError):
+        pass
+    return SEED_QUERIES
+
+
+def report(recorder: Recorder, elapsed: float):
+    total = sum(len(v) for route, v in recorder.latencies.items() if not route.endswith(FIRST_TOKEN))
+    print(f"\n{total} requests in {elapsed:.1f}s = {total / elapsed:.1f} req/s")
+    print(f"{'route':<42} {'count':>6} {'rps':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'429':>5} {'errors':>7}")
+    for route in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[route])
+        statuses = recorder.statuses[route]
+        shed = statuses.get(429, 0)
+        errors = sum(n for code, n in statuses.items() if code == 0 or (code >= 400 and code != 429))
+        print(f"{route:<42} {len(values):>6} {len(values) / elapsed:>6.1f} "
+              f"{percentile(values, 50) * 1000:>8.0f} {percentile(values, 95) * 1000:>8.0f} "
+              f"{percentile(values, 99) * 1000:>8.0f} {shed:>5} {errors / len(values):>7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5001")
+    parser.add_argument("--users", type=int, default=4, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--clicks", type=int, default=5, help="node clicks per session")
+    parser.add_argument("--think-ms", type=float, default=200, help="pause between user actions")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    base = args.base_url.rstrip("/")
+    queries = load_queries(base, args.timeout)
+    recorder = Recorder()
+    stop_at = time.monotonic() + args.duration
+
+    def user():
+        session = requests.Session()
+        while time.monotonic() < stop_at:
+            run_session(base, session, recorder, queries, args.clicks, args.think_ms / 1000, args.timeout)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report(recorder, time.monotonic() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+metrics.py
+
+Lightweight in-process latency histograms and Prometheus text exposition.
+
+Stages are timed with `span` (a context manager) or `timed` (a decorator);
+each stage name gets a fixed-bucket histogram. Recording a span costs two
+perf_counter calls, a bisect and an uncontended lock (~1 microsecond), so it
+stays on in production. app.py serves everything at /metrics together with
+gauges for caches, queues and model versions.
+
+Metrics are per process: with several gunicorn workers each one reports
+its own numbers (the scrape lands on whichever worker accepts it), so rates
+and quantiles are per worker.
+
+Usage:
+    from metrics import span, timed
+
+    with span("most_similar"):
+        ...
+
+    @timed("filter_docs")
+    def filter_docs(...):
+        ...
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# seconds; covers sub-millisecond lookups up to slow generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+NAMESPACE = "beliefspiral"
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)     # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        """(cumulative bucket counts, sum, count)."""
+        with self._lock:
+            counts, total, n = list(self.counts), self.sum, self.count
+        cumulative, running = [], 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total, n
+
+
+# (metric, labels) -> Histogram, labels as a sorted tuple of pairs
+_HISTOGRAMS: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+_HISTOGRAMS_LOCK = threading.Lock()
+_COUNTERS: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+
+def histogram(metric: str, **labels) -> Histogram:
+    key = (metric, tuple(sorted(labels.items())))
+    hist = _HISTOGRAMS.get(key)
+    if hist is None:
+        with _HISTOGRAMS_LOCK:
+            hist = _HISTOGRAMS.setdefault(key, Histogram())
+    return hist
+
+
+def observe(stage: str, seconds: float):
+    histogram("stage_seconds", stage=stage).observe(seconds)
+
+
+def inc(metric: str, amount: float = 1, **labels):
+    key = (metric, tuple(sorted(labels.items())))
+    with _HISTOGRAMS_LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + amount
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block into the `stage` histogram (also when it raises)."""
+    hist = histogram("stage_seconds", stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        hist.observe(time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """Decorator form of span."""
+    def decorate(fn):
+        hist = histogram("stage_seconds", stage=stage)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+# EXPOSITION
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Iterable[Tuple[str, str]], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(pairs) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    return repr(float(value))
+
+
+def render(samples: Iterable[Tuple[str, str, str, dict, float]] = ()) -> str:
+    """
+    Prometheus text format (0.0.4) for all histograms and counters recorded
+    here, plus `samples` given as (name, type, help, labels, value) tuples,
+    type being "gauge" or "counter"; samples of one name must be adjacent.
+    """
+    out: List[str] = []
+    with _HISTOGRAMS_LOCK:
+        hists = sorted(_HISTOGRAMS.items(), key=lambda item: item[0])
+        counters = sorted(_COUNTERS.items())
+
+    seen = set()
+
+    def header(name: str, kind: str, help_text: str):
+        if name not in seen:
+            seen.add(name)
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+    for (metric, labels), hist in hists:
+        name = f"{NAMESPACE}_{metric}"
+        header(name, "histogram", "Latency in seconds.")
+        cumulative, total, n = hist.snapshot()
+        for bound, count in zip(hist.bounds + (float("inf"),), cumulative):
+            out.append(f"{name}_bucket{_labels(labels, ('le', _fmt(bound)))} {count}")
+        out.append(f"{name}_sum{_labels(labels)} {_fmt(total)}")
+        out.append(f"{name}_count{_labels(labels)} {n}")
+
+    for (metric, labels), value in counters:
+        name = f"{NAMESPACE}_{metric}_total"
+        header(name, "counter", metric.replace("_", " ").capitalize() + ".")
+        out.append(f"{name}{_labels(labels)} {_fmt(value)}")
+
+    for metric, kind, help_text, labels, value in samples:
+        name = f"{NAMESPACE}_{metric}"
+        header(name, kind, help_text)
+        out.append(f"{name}{_labels(sorted(labels.items()))} {_fmt(value)}")
+    return "\n".join(out) + "\n"
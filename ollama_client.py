@@ -0,0 +1,201 @@
+"""
+ollama_client.py
+
+Pooled, streaming client for the local Ollama /api/generate endpoint.
+
+- one requests.Session per client, so connections are kept alive and reused
+- separate connect / read timeouts (the read timeout applies between streamed
+  chunks, so a long generation is fine but a stuck server is not)
+- bounded retries with exponential backoff for connection errors, timeouts
+  and 429/5xx responses, only before any tokens have been received
+- the NDJSON stream is parsed incrementally with iter_lines
+- `keep_alive` is sent with every request so Ollama keeps the model loaded
+- a fixed prompt prefix can be evaluated once and its `context` tokens
+  reused by later requests (prefix_context)
+- prompt/eval token counts and durations reported by Ollama are summed
+  per client (stats)
+
+Usage:
+    from ollama_client import get_client
+
+    client = get_client()
+    text = client.generate("llama2", "Tell me a secret.")
+    for token in client.stream("llama2", "Tell me a secret."):
+        print(token, end="", flush=True)
+
+    # evaluate a fixed preamble once, then send only the variable part
+    ctx = client.prefix_context("llama2", "You are a storyteller.\n")
+    text = client.generate("llama2", "Topic: moon", context=ctx, raw=True)
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Ollama serve endpoint (default)
+OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "60"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))
+OLLAMA_BACKOFF = float(os.getenv("OLLAMA_BACKOFF", "0.5"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class OllamaError(RuntimeError):
+    """Raised when Ollama cannot be reached or returns an error."""
+
+
+class OllamaClient:
+    def __init__(self, url: str = OLLAMA_API_URL,
+                 connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout: float = OLLAMA_READ_TIMEOUT,
+                 retries: int = OLLAMA_RETRIES,
+                 backoff: float = OLLAMA_BACKOFF,
+                 keep_alive: Optional[str] = OLLAMA_KEEP_ALIVE,
+                 pool_size: int = OLLAMA_POOL_SIZE):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.keep_alive = keep_alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._prefixes: Dict[Tuple[str, str], List[int]] = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "prompt_eval_count": 0, "prompt_eval_seconds": 0.0,
+                       "eval_count": 0, "eval_seconds": 0.0}
+
+    def _payload(self, model: str, prompt: str, temperature: float, max_tokens: int, **extra) -> dict:
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": True,
+            "options": {"temperature": temperature, "num_predict": max_tokens},
+        }
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        payload.update(extra)
+        return payload
+
+    def _post(self, payload: dict) -> requests.Response:
+        """POST with bounded retries; returns an open streaming response."""
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            try:
+                resp = self.session.post(self.url, json=payload, stream=True, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+                continue
+            if resp.status_code in _RETRY_STATUS:
+                last_error = OllamaError(f"Ollama returned HTTP {resp.status_code}")
+                resp.close()
+                continue
+            if resp.status_code >= 400:
+                body = resp.text[:200]
+                resp.close()
+                raise OllamaError(f"Ollama returned HTTP {resp.status_code}: {body}")
+            return resp
+        raise OllamaError(f"Ollama request failed after {self.retries + 1} attempts: {last_error}")
+
+    def stream_events(self, model: str, prompt: str, temperature: float = 0.8,
+                      max_tokens: int = 250, **extra) -> Iterator[dict]:
+        """Yield each decoded NDJSON object from Ollama as it arrives."""
+        resp = self._post(self._payload(model, prompt, temperature, max_tokens, **extra))
+        try:
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if 'error' in data:
+                    raise OllamaError(data['error'])
+                done = data.get('done')
+                if done:
+                    self._record(data)
+                yield data
+                if done:
+                    break
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise OllamaError(f"Ollama stream interrupted: {e}") from e
+        finally:
+            resp.close()
+
+    def stream(self, model: str, prompt: str, temperature: float = 0.8,
+               max_tokens: int = 250, **extra) -> Iterator[str]:
+        """Yield generated text fragments as they arrive."""
+        for data in self.stream_events(model, prompt, temperature, max_tokens, **extra):
+            if data.get('response'):
+                yield data['response']
+
+    def generate(self, model: str, prompt: str, temperature: float = 0.8,
+                 max_tokens: int = 250, **extra) -> str:
+        """Return the full generated text."""
+        return ''.join(self.stream(model, prompt, temperature, max_tokens, **extra)).strip()
+
+    def prefix_context(self, model: str, prefix: str) -> Optional[List[int]]:
+        """
+        Context tokens for `prefix` evaluated in raw mode, cached per (model, prefix).
+        Pass them as `context=` with `raw=True` so only the new prompt is evaluated.
+        Returns None if the server does not return a context.
+        """
+        key = (model, prefix)
+        tokens = self._prefixes.get(key)
+        if tokens is None:
+            final = {}
+            for data in self.stream_events(model, prefix, temperature=0.0, max_tokens=1, raw=True):
+                final = data
+            context = final.get('context')
+            if not context:
+                return None
+            # drop the token(s) generated by this priming request
+            tokens = context[:len(context) - int(final.get('eval_count') or 0)]
+            self._prefixes[key] = tokens
+        return tokens
+
+    def _record(self, final: dict):
+        with self._stats_lock:
+            s = self._stats
+            s["requests"] += 1
+            s["prompt_eval_count"] += final.get("prompt_eval_count") or 0
+            s["prompt_eval_seconds"] += (final.get("prompt_eval_duration") or 0) / 1e9
+            s["eval_count"] += final.get("eval_count") or 0
+            s["eval_seconds"] += (final.get("eval_duration") or 0) / 1e9
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            s = dict(self._stats)
+        n = s["requests"]
+        s["prompt_eval_tokens_avg"] = s["prompt_eval_count"] / n if n else 0.0
+        s["prompt_eval_seconds_avg"] = s["prompt_eval_seconds"] / n if n else 0.0
+        return s
+
+    def close(self):
+        self.session.close()
+
+
+_CLIENT: Optional[OllamaClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> OllamaClient:
+    """Process-wide shared client (one connection pool per worker)."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = OllamaClient()
+    return _CLIENT
@@ -0,0 +1,324 @@
+"""
+profiler.py
+
+On-demand profiling of live requests, switched on through the admin-only
+/admin/profile endpoint without a restart.
+
+When enabled, a fraction of requests (`rate`) for a limited time
+(`duration`), optionally only for some path prefixes, is profiled in one of
+two modes:
+
+- sample   (default) a background thread samples the request thread's stack
+           every PROFILE_INTERVAL seconds and writes collapsed stacks
+           ("a;b;c 12" lines, ready for flamegraph.pl or speedscope).
+           Story worker threads are sampled too (stacks prefixed with the
+           thread name), since /process_clicks only waits on them; with
+           several profiled requests at once they show up in each file.
+- cprofile cProfile for the whole request, written as a pstats file; only
+           one request is traced at a time
+
+Files go to PROFILE_DIR named <route>-<request id>.collapsed|.prof, e.g.
+process_clicks-3f9c2a1b7d4e5f60.collapsed; the request id is taken from an
+incoming X-Request-ID header or generated, and is echoed back in the
+response. Profiling covers the whole response body, so streamed (SSE)
+responses are profiled until the stream ends.
+
+The switch is stored in PROFILE_DIR/control.json so every gunicorn worker
+picks it up within a second. Profiling stops by itself after `duration` or
+once PROFILE_MAX_FILES files exist.
+
+    curl -X POST -H "Authorization: Bearer $ADMIN_TOKEN" -H "Content-Type: application/json" \\
+         -d '{"rate": 0.2, "duration": 300, "paths": ["/process_clicks", "/api/neighbors"]}' \\
+         localhost:5001/admin/profile
+    python -c "import pstats; pstats.Stats('profiles/process_clicks-....prof').sort_stats('cumtime').print_stats(20)"
+
+Configuration (environment):
+- ADMIN_TOKEN        token required by /admin/*; unset disables the endpoint
+- PROFILE_DIR        output directory (default "profiles")
+- PROFILE_INTERVAL   stack sampling interval in seconds (default 0.005)
+- PROFILE_MAX_FILES  stop after this many profile files (default 500)
+"""
+
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "500"))
+
+MODES = ("sample", "cprofile")
+_CONTROL_FILE = "control.json"
+_CONTROL_CHECK_INTERVAL = 1.0
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# background threads doing work on behalf of requests
+_WORKER_THREAD_PREFIXES = ("story-worker",)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame) -> str:
+    """Root-first, ';'-separated stack of `frame`."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """Samples the stacks of registered threads; the sampling thread runs only while needed."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._targets: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self, ident: int):
+        with self._lock:
+            self._targets[ident] = Counter()
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._run, name="stack-sampler", daemon=True).start()
+
+    def stop(self, ident: int) -> Counter:
+        with self._lock:
+            return self._targets.pop(ident, Counter())
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._targets:
+                    self._running = False
+                    return
+                targets = list(self._targets.items())
+            frames = sys._current_frames()
+            workers = [(t.ident, t.name) for t in threading.enumerate()
+                       if t.name.startswith(_WORKER_THREAD_PREFIXES)]
+            worker_stacks = [f"{name};{collapse_stack(frames[ident])}"
+                             for ident, name in workers if ident in frames]
+            for ident, counts in targets:
+                frame = frames.get(ident)
+                if frame is not None and ident != own:
+                    counts[collapse_stack(frame)] += 1
+                counts.update(worker_stacks)
+            del frames
+            time.sleep(self.interval)
+
+
+class _Session:
+    """Profiling of one request; finish() writes the file."""
+
+    def __init__(self, profiler: "Profiler", route: str, request_id: str, mode: str):
+        self.profiler = profiler
+        self.path = os.path.join(profiler.directory, f"{route}-{request_id}")
+        self.request_id = request_id
+        self.mode = mode
+        self.ident = threading.get_ident()
+        self._done = False
+        if mode == "cprofile":
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except BaseException:
+                profiler._cprofile_lock.release()
+                raise
+        else:
+            profiler.sampler.start(self.ident)
+
+    def finish(self):
+        if self._done:
+            return
+        self._done = True
+        if self.mode == "cprofile":
+            try:
+                self._profile.disable()
+                self._profile.dump_stats(self.path + ".prof")
+            finally:
+                self.profiler._cprofile_lock.release()
+        else:
+            counts = self.profiler.sampler.stop(self.ident)
+            with open(self.path + ".collapsed", "w") as f:
+                for stack, n in counts.most_common():
+                    f.write(f"{stack} {n}\n")
+        self.profiler._written()
+
+
+class Profiler:
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self.sampler = StackSampler()
+        self.rate = 0.0
+        self.until = 0.0            # wall-clock time, shared across processes
+        self.mode = "sample"
+        self.paths: List[str] = []
+        self.files = 0
+        self.skipped_busy = 0
+        self._control_mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+
+    # control (shared by all worker processes through a small JSON file)
+    def _control_path(self) -> str:
+        return os.path.join(self.directory, _CONTROL_FILE)
+
+    def configure(self, rate: float, duration: float, mode: str = "sample", paths: Optional[List[str]] = None):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        os.makedirs(self.directory, exist_ok=True)
+        control = {"rate": max(0.0, min(1.0, rate)), "until": time.time() + max(0.0, duration),
+                   "mode": mode, "paths": list(paths or [])}
+        tmp = self._control_path() + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(control, f)
+        os.replace(tmp, self._control_path())
+        self._next_check, self._control_mtime = 0.0, None
+        self._refresh()
+
+    def disable(self):
+        self.configure(0.0, 0.0)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + _CONTROL_CHECK_INTERVAL
+        try:
+            mtime = os.stat(self._control_path()).st_mtime
+        except OSError:
+            self.rate = 0.0
+            return
+        if mtime == self._control_mtime:
+            return
+        try:
+            with open(self._control_path()) as f:
+                control = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._control_mtime = mtime
+        self.rate, self.until = control.get("rate", 0.0), control.get("until", 0.0)
+        self.mode, self.paths = control.get("mode", "sample"), control.get("paths", [])
+        self.files = self._count_files()
+
+    def _count_files(self) -> int:
+        try:
+            return sum(1 for name in os.listdir(self.directory) if name.endswith((".prof", ".collapsed")))
+        except OSError:
+            return 0
+
+    def active(self) -> bool:
+        self._refresh()
+        return self.rate > 0 and time.time() < self.until and self.files < self.max_files
+
+    def begin(self, path: str, request_id: Optional[str] = None) -> Optional[_Session]:
+        """Start profiling this request if it is selected; returns None otherwise."""
+        if not self.active():
+            return None
+        if self.paths and not any(path.startswith(p) for p in self.paths):
+            return None
+        if random.random() >= self.rate:
+            return None
+        mode = self.mode
+        if mode == "cprofile" and not self._cprofile_lock.acquire(blocking=False):
+            self.skipped_busy += 1
+            return None
+        route = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "index"
+        if not request_id or not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex[:16]
+        try:
+            return _Session(self, route[:80], request_id, mode)
+        except ValueError:
+            # another profiler (a debugger, coverage) already owns the profiling hook
+            self.skipped_busy += 1
+            return None
+
+    def _written(self):
+        with self._lock:
+            self.files += 1
+
+    def status(self) -> dict:
+        self._refresh()
+        try:
+            recent = sorted((n for n in os.listdir(self.directory) if n.endswith((".prof", ".collapsed"))),
+                            key=lambda n: os.path.getmtime(os.path.join(self.directory, n)), reverse=True)[:20]
+        except OSError:
+            recent = []
+        return {
+            "active": self.active(),
+            "rate": self.rate,
+            "mode": self.mode,
+            "paths": self.paths,
+            "seconds_left": max(0.0, self.until - time.time()),
+            "files": self.files,
+            "max_files": self.max_files,
+            "skipped_busy": self.skipped_busy,
+            "directory": os.path.abspath(self.directory),
+            "recent": recent,
+        }
+
+
+class _ClosingIterable:
+    """Response body wrapper that ends the profiling session when the server closes it."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._on_close()
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that profiles requests selected by `profiler`."""
+
+    def __init__(self, wsgi_app, profiler: "Profiler"):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        request_id = environ.get("HTTP_X_REQUEST_ID")
+        session = self.profiler.begin(environ.get("PATH_INFO", ""), request_id)
+        if session is None:
+            return self.wsgi_app(environ, start_response)
+        def start_with_id(status, headers, exc_info=None):
+            return start_response(status, headers + [("X-Request-ID", session.request_id)], exc_info)
+
+        try:
+            body = self.wsgi_app(environ, start_with_id)
+        except BaseException:
+            session.finish()
+            raise
+        return _ClosingIterable(body, session.finish)
+
+
+_PROFILER: Optional[Profiler] = None
+
+
+def get_profiler() -> Profiler:
+    global _PROFILER
+    if _PROFILER is None:
+        _PROFILER = Profiler()
+    return _PROFILER
@@ -33,6 +33,10 @@ with output_fp.open("w", encoding="utf8") as f:
 
 print(f"✅ Merged {len(all_records)} records into {output_fp}")
 
+# serving corpus segment (mmapped by the web workers), swapped in atomically
+from corpus import publish_segment
+print(f"✅ Published corpus segment {publish_segment(all_records, str(output_fp))}")
+
 # file_path = Path("raw_data/final_data/all_spacy_concepts_final.json")
 
 # # Read and parse the JSON
@@ -0,0 +1,200 @@
+"""
+speculation.py
+
+Speculative story pre-generation (opt-in from the client).
+
+While the user is still clicking, graph.js reports the growing click path to
+/speculate. Once a session's path has SPECULATE_MIN_CLICKS distinct clicks,
+a background-priority generation for that prefix is queued on the story
+scheduler, but only when a worker is idle, so it never delays real requests.
+A newer prefix supersedes the previous job: a job that is still queued is
+cancelled, and a job that is already running is counted as wasted work.
+
+When "Make Story" is pressed:
+- an identical click set hits the story cache (the speculative result is
+  stored there), or coalesces with the speculative job if it is still running;
+- a superset with at most SPECULATE_TOLERANCE extra clicks is served from the
+  speculative result via claim(), or streamed from the running job via
+  stream() as its tokens arrive.
+
+Configuration (environment):
+- SPECULATE_MIN_CLICKS   clicks before speculating (default 3)
+- SPECULATE_TOLERANCE    extra clicks still served from a prefix (default 1)
+- SPECULATE_SESSIONS     sessions tracked at once (default 1000)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Iterator, List, Optional
+
+from corpus import Corpus
+from conspiracy_generator import (
+    PRIORITY_BACKGROUND, QueueFull, _generate_uncached, follow_story, get_scheduler, get_story_cache,
+    normalize_concept, story_cache_key,
+)
+
+SPECULATE_MIN_CLICKS = int(os.getenv("SPECULATE_MIN_CLICKS", "3"))
+SPECULATE_TOLERANCE = int(os.getenv("SPECULATE_TOLERANCE", "1"))
+SPECULATE_SESSIONS = int(os.getenv("SPECULATE_SESSIONS", "1000"))
+
+
+class _Speculation:
+    __slots__ = ("key", "clicks", "future", "claimed", "superseded", "service")
+
+    def __init__(self, key: str, clicks: frozenset, future: Future):
+        self.key = key
+        self.clicks = clicks
+        self.future = future
+        self.claimed = False
+        self.superseded = False
+        self.service = None
+
+
+class Speculator:
+    def __init__(self, min_clicks: int = SPECULATE_MIN_CLICKS, tolerance: int = SPECULATE_TOLERANCE,
+                 max_sessions: int = SPECULATE_SESSIONS):
+        self.min_clicks = min_clicks
+        self.tolerance = tolerance
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, _Speculation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.started = self.skipped_busy = self.cancelled = 0
+        self.hits = self.misses = self.wasted = 0
+        self.wasted_seconds = 0.0
+
+    def observe(self, session_id: str, docs: Corpus, clicked: List[str]):
+        """Record a session's current click path and speculate on it if worthwhile."""
+        clicks = frozenset(normalize_concept(c) for c in clicked)
+        if not session_id or len(clicks) < self.min_clicks:
+            return
+        key = story_cache_key(clicked, data_version=docs.version)
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is not None and current.key == key:
+                return
+        if get_story_cache().get(key, record=False) is not None:
+            return
+        scheduler = get_scheduler()
+        if not scheduler.has_idle_worker():
+            self.skipped_busy += 1
+            return
+
+        spec = _Speculation(key, clicks, Future())
+
+        def run():
+            start = time.monotonic()
+            try:
+                return _generate_uncached(docs, list(clicked), key)
+            finally:
+                spec.service = time.monotonic() - start
+
+        try:
+            spec.future = scheduler.submit(key, run, priority=PRIORITY_BACKGROUND)
+        except QueueFull:
+            self.skipped_busy += 1
+            return
+        spec.future.add_done_callback(lambda _: self._finished(spec))
+        with self._lock:
+            self.started += 1
+            previous = self._sessions.pop(session_id, None)
+            self._sessions[session_id] = spec
+            evicted = None
+            if len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+        for stale in (previous, evicted):
+            if stale is not None:
+                self._supersede(stale)
+
+    def _supersede(self, spec: _Speculation):
+        with self._lock:
+            if spec.claimed or spec.superseded:
+                return
+            spec.superseded = True
+        if spec.future.cancel():
+            self.cancelled += 1
+        elif spec.future.done():
+            self._count_waste(spec)
+        # still running: counted as waste in _finished
+
+    def _finished(self, spec: _Speculation):
+        if spec.superseded and not spec.future.cancelled():
+            self._count_waste(spec)
+
+    def _count_waste(self, spec: _Speculation):
+        with self._lock:
+            self.wasted += 1
+            self.wasted_seconds += spec.service or 0.0
+
+    def _match(self, session_id: str, clicked: List[str]) -> Optional[_Speculation]:
+        with self._lock:
+            spec = self._sessions.get(session_id) if session_id else None
+        if spec is None or spec.future.cancelled():
+            return None
+        final = frozenset(normalize_concept(c) for c in clicked)
+        if not (spec.clicks <= final and len(final - spec.clicks) <= self.tolerance):
+            self.misses += 1
+            return None
+        return spec
+
+    def _claimed(self, session_id: str, spec: _Speculation):
+        with self._lock:
+            spec.claimed = True
+            self._sessions.pop(session_id, None)
+            self.hits += 1
+
+    def claim(self, session_id: str, clicked: List[str], timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Story from the session's speculative job if the final click set equals
+        it or extends it by at most `tolerance` clicks; waits (up to `timeout`
+        seconds) if it is still running.
+        """
+        spec = self._match(session_id, clicked)
+        if spec is None:
+            return None
+        try:
+            story, _ = spec.future.result(timeout=timeout)
+        except (Exception, FutureTimeout):
+            self.misses += 1
+            return None
+        self._claimed(session_id, spec)
+        return story
+
+    def stream(self, session_id: str, docs: Corpus, clicked: List[str],
+               deadline: Optional[float] = None) -> Optional[Iterator[str]]:
+        """
+        Streaming claim(): the tokens of a matching speculative job as they are
+        generated, without waiting for it. Past `deadline` with nothing streamed,
+        or if the job fails, the fallback story is yielded (see stream_story).
+        """
+        spec = self._match(session_id, clicked)
+        if spec is None:
+            return None
+        self._claimed(session_id, spec)
+        return follow_story(spec.future, docs, clicked, spec.key, deadline)
+
+    def stats(self) -> dict:
+        claimed_or_missed = self.hits + self.misses
+        return {
+            "started": self.started,
+            "skipped_busy": self.skipped_busy,
+            "cancelled": self.cancelled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / claimed_or_missed if claimed_or_missed else 0.0,
+            "wasted": self.wasted,
+            "wasted_seconds": self.wasted_seconds,
+            "sessions": len(self._sessions),
+        }
+
+
+_SPECULATOR: Optional[Speculator] = None
+
+
+def get_speculator() -> Speculator:
+    global _SPECULATOR
+    if _SPECULATOR is None:
+        _SPECULATOR = Speculator()
+    return _SPECULATOR
@@ -7,88 +7,167 @@
     const clickListEl = document.getElementById('click-list');
     let clickHistory = JSON.parse(localStorage.getItem('clickHistory') || '[]');
 
-    function drawGraph(query, results) {
-      const svg        = document.getElementById('graphSvg');
-      svg.innerHTML    = '<g id="edges"></g><g id="nodes"></g>';
+    // Opt-in speculative story generation: visit any page with ?speculate=1
+    // (or ?speculate=0 to turn it off again)
+    const speculateParam = new URLSearchParams(location.search).get('speculate');
+    if (speculateParam !== null) localStorage.setItem('speculate', speculateParam);
+    const speculate = localStorage.getItem('speculate') === '1';
+    let sessionId = localStorage.getItem('sessionId');
+    if (!sessionId) {
+      sessionId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+      localStorage.setItem('sessionId', sessionId);
+    }
+
+    // Report the growing click path; sendBeacon survives the page navigation
+    function reportClickPath() {
+      if (!speculate || !navigator.sendBeacon) return;
+      const body = JSON.stringify({ session: sessionId, clicked: clickHistory });
+      navigator.sendBeacon('/speculate', new Blob([body], { type: 'application/json' }));
+    }
+
+    // Helper to add clicks to history
+    function logClick(text) {
+      // record in memory
+      clickHistory.push(text);
+      // persist
+      localStorage.setItem('clickHistory', JSON.stringify(clickHistory));
+      reportClickPath();
+      // append to DOM
+      const li = document.createElement('li');
+      li.textContent = text;
+      clickListEl.appendChild(li);
+    }
+
+    const W = 600, H = 600;
+    const cx = W / 2, cy = H / 2;
+    const R = 220;
+    const startAngle = -Math.PI / 2;
+    const padding = 8;
+
+    // Helper to create SVG elements
+    function make(tag, attrs) {
+      const el = document.createElementNS('http://www.w3.org/2000/svg', tag);
+      for (let k in attrs) el.setAttribute(k, attrs[k]);
+      return el;
+    }
+
+    // Node = <g> holding a label and its box, positioned with a CSS transform
+    // so moves and fades can be animated
+    function makeNode(layer, text, x, y) {
+      const g = make('g', { class: 'node' });
+      g.style.transform = `translate(${x}px, ${y}px)`;
+      const label = make('text', { x: 0, y: 0, class: 'label' });
+      label.textContent = text;
+      g.appendChild(label);
+      layer.appendChild(g);
+      const box = label.getBBox();
+      g.insertBefore(make('rect', {
+        x: box.x - padding,
+        y: box.y - padding,
+        width:  box.width  + padding * 2,
+        height: box.height + padding * 2,
+        class: 'node-box'
+      }), label);
+      return g;
+    }
+
+    // Draw `query` in the center and `results` around it. With `origin` (the
+    // clicked node's <g>), that node glides to the center and the new
+    // neighbors grow out of it; otherwise the graph is drawn from scratch.
+    function drawGraph(query, results, origin) {
+      const svg = document.getElementById('graphSvg');
+      if (!svg) return;
+      if (!origin || !svg.querySelector('#nodes')) {
+        svg.innerHTML = '<g id="edges"></g><g id="nodes"></g>';
+        origin = null;
+      }
       const edgesLayer = svg.querySelector('#edges');
       const nodesLayer = svg.querySelector('#nodes');
-    
-      const W = 600, H = 600;
-      const cx = W / 2, cy = H / 2;
-      const R = 220;
-      const startAngle = -Math.PI / 2;
-      const padding = 8;
-    
-      // Helper to create SVG elements
-      function make(tag, attrs) {
-        const el = document.createElementNS('http://www.w3.org/2000/svg', tag);
-        for (let k in attrs) el.setAttribute(k, attrs[k]);
-        return el;
-      }
-      // Helper to add clicks to history
-      function logClick(text) {
-        // record in memory
-        clickHistory.push(text);
-        // persist
-        localStorage.setItem('clickHistory', JSON.stringify(clickHistory));
-        // append to DOM
-        const li = document.createElement('li');
-        li.textContent = text;
-        clickListEl.appendChild(li);
-      }
-    
-      // Draw center node
-      const centerText = make('text', { x: cx, y: cy, class: 'label' });
-      centerText.textContent = query;
-      nodesLayer.appendChild(centerText);
-    
-      const centerBox = centerText.getBBox();
-      const centerRect = make('rect', {
-        x: centerBox.x - padding,
-        y: centerBox.y - padding,
-        width:  centerBox.width  + padding * 2,
-        height: centerBox.height + padding * 2,
-        class: 'node-box'
+
+      // fade out everything except the node that becomes the new center
+      [...edgesLayer.children, ...nodesLayer.children].forEach(el => {
+        if (el === origin) return;
+        el.classList.add('leaving');
+        setTimeout(() => el.remove(), 400);
       });
-      nodesLayer.insertBefore(centerRect, centerText);
-    
-      // Draw connected outer nodes
+
+      let center = origin;
+      if (center) {
+        center.classList.add('center');
+        center.style.transform = `translate(${cx}px, ${cy}px)`;
+      } else {
+        center = makeNode(nodesLayer, query, cx, cy);
+        center.classList.add('center');
+      }
+
+      const created = [];
       results.forEach((txt, i) => {
-        const angle = startAngle + i * (2 * Math.PI / 5);
+        const angle = startAngle + i * (2 * Math.PI / results.length);
         const x = cx + R * Math.cos(angle);
         const y = cy + R * Math.sin(angle);
-    
+
         // Edge
-        edgesLayer.appendChild(make('line', {
-          x1: cx, y1: cy, x2: x, y2: y, class: 'edge'
-        }));
-    
-        // Text
-        const nodeText = make('text', { x, y, class: 'label' });
-        nodeText.textContent = txt;
-        nodesLayer.appendChild(nodeText);
-    
-        // Box
-        const nodeBox = nodeText.getBBox();
-        const nodeRect = make('rect', {
-          x: nodeBox.x - padding,
-          y: nodeBox.y - padding,
-          width:  nodeBox.width  + padding * 2,
-          height: nodeBox.height + padding * 2,
-          class: 'node-box'
-        });
-        nodesLayer.insertBefore(nodeRect, nodeText);
-    
+        const edge = make('line', { x1: cx, y1: cy, x2: x, y2: y, class: 'edge' });
+        edgesLayer.appendChild(edge);
+
+        // new nodes start at the center and move out on the next frame
+        const node = makeNode(nodesLayer, txt, origin ? cx : x, origin ? cy : y);
+        nodesLayer.insertBefore(node, center);
+        created.push([edge, node, x, y]);
+
         // Click behavior
-        [nodeRect, nodeText].forEach(el =>
-          el.addEventListener('click', () => {
-            logClick(txt);
-            input.value = txt;
-            form.submit();
-          })
-        );
+        node.addEventListener('click', () => {
+          if (node.classList.contains('center')) return;
+          logClick(txt);
+          navigate(txt, node);
+        });
       });
+
+      if (origin) {
+        created.forEach(([edge, node]) => { edge.classList.add('entering'); node.classList.add('entering'); });
+        requestAnimationFrame(() => requestAnimationFrame(() => {
+          created.forEach(([edge, node, x, y]) => {
+            edge.classList.remove('entering');
+            node.classList.remove('entering');
+            node.style.transform = `translate(${x}px, ${y}px)`;
+          });
+        }));
+      }
+    }
+
+    // Fetch the clicked node's neighbors and redraw in place; history gets an
+    // entry per click so back/forward walk the path without refetching
+    let navController = null;
+
+    function navigate(txt, node) {
+      if (navController) navController.abort();
+      navController = new AbortController();
+      input.value = txt;
+      fetch('/api/neighbors?query=' + encodeURIComponent(txt), { signal: navController.signal })
+        .then(res => {
+          if (!res.ok) throw new Error(res.statusText);
+          return res.json();
+        })
+        .then(data => {
+          history.pushState({ query: data.query, results: data.results }, '',
+                            '/?query=' + encodeURIComponent(data.query));
+          drawGraph(data.query, data.results, node);
+        })
+        .catch(err => {
+          if (err.name === 'AbortError') return;
+          // fall back to the full page request
+          console.error(err);
+          form.submit();
+        });
     }
+
+    window.addEventListener('popstate', e => {
+      if (!e.state) return;
+      input.value = e.state.query;
+      drawGraph(e.state.query, e.state.results);
+    });
+    history.replaceState({ query, results }, '');
+
     drawGraph(query, results)
 
     clickHistory.forEach(text => {
@@ -151,21 +230,73 @@
       return;
     }
 
+    // in-flight story request, aborted when a new one starts or the page goes away
+    let storyController = null;
+
     function sendClicksToServer() {
-      return fetch('/process_clicks', {
+      if (storyController) storyController.abort();
+      storyController = new AbortController();
+      const { signal } = storyController;
+      const storyEl = document.getElementById('story');
+      storyEl.innerText = '';
+
+      return fetch('/process_clicks/stream', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
         // PASS clickHistory
-        body: JSON.stringify({ clicked: clickHistory })
+        body: JSON.stringify({ clicked: clickHistory, session: sessionId }),
+        signal
       })
       .then(res => {
-        if (!res.ok) throw new Error(res.statusText);
-        return res.json();
+        if (res.status === 429) {
+          const wait = res.headers.get('Retry-After') || 'a few';
+          storyEl.innerText = `The story machine is busy, try again in ${wait} seconds.`;
+          return;
+        }
+        if (!res.ok || !res.body) throw new Error(res.statusText);
+        return readStoryStream(res.body.getReader(), storyEl);
       })
-      .then(data => {
-        document.getElementById('story').innerText = data.story;
+      .catch(err => {
+        if (err.name === 'AbortError') return;
+        throw err;
       });
     }
+
+    // Parse the server-sent event stream and append tokens as they arrive
+    function readStoryStream(reader, storyEl) {
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      function handleEvent(raw) {
+        let event = 'message', data = '';
+        raw.split('\n').forEach(line => {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) data += line.slice(5).trim();
+        });
+        const payload = data ? JSON.parse(data) : {};
+        if (event === 'error') throw new Error(payload.error);
+        if (payload.token) storyEl.innerText += payload.token;
+      }
+
+      function pump() {
+        return reader.read().then(({ done, value }) => {
+          if (done) return;
+          buffer += decoder.decode(value, { stream: true });
+          let sep;
+          while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            handleEvent(buffer.slice(0, sep));
+            buffer = buffer.slice(sep + 2);
+          }
+          return pump();
+        });
+      }
+      return pump();
+    }
+
+    // stop generating when the user navigates away
+    window.addEventListener('pagehide', () => {
+      if (storyController) storyController.abort();
+    });
   
     // 3) Wait for DOM load if you haven’t already placed this at the bottom
     document.addEventListener('DOMContentLoaded', () => {
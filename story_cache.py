@@ -0,0 +1,139 @@
+"""
+story_cache.py
+
+LRU cache for generated stories with a TTL, optional SQLite persistence and
+optionally several variants per key. Keys are opaque strings; see
+conspiracy_generator.story_cache_key for how they are built from a click set
+and the generation parameters.
+
+Configuration (environment):
+- STORY_CACHE_SIZE      max keys kept in memory (default 512)
+- STORY_CACHE_TTL       seconds a story stays valid, 0 = forever (default 86400)
+- STORY_CACHE_PATH      SQLite file for persistence; unset = memory only
+- STORY_CACHE_VARIANTS  stories kept per key (default 1). With N > 1 the
+                        first N requests for a key still generate, after
+                        that a random stored variant is served.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+STORY_CACHE_SIZE = int(os.getenv("STORY_CACHE_SIZE", "512"))
+STORY_CACHE_TTL = float(os.getenv("STORY_CACHE_TTL", "86400"))
+STORY_CACHE_PATH = os.getenv("STORY_CACHE_PATH")
+STORY_CACHE_VARIANTS = int(os.getenv("STORY_CACHE_VARIANTS", "1"))
+
+
+class StoryCache:
+    def __init__(self, max_size: int = STORY_CACHE_SIZE, ttl: float = STORY_CACHE_TTL,
+                 path: Optional[str] = STORY_CACHE_PATH, variants: int = STORY_CACHE_VARIANTS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.variants = max(1, variants)
+        # key -> list of (created_at, story), oldest first
+        self._entries: "OrderedDict[str, List[Tuple[float, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    # persistence
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        # connections must not be shared across fork()
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS stories "
+                       "(key TEXT NOT NULL, story TEXT NOT NULL, created REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS stories_key ON stories (key)")
+            db.commit()
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
+
+    def _load(self, key: str, now: float) -> List[Tuple[float, str]]:
+        db = self._conn()
+        if db is None:
+            return []
+        rows = db.execute("SELECT created, story FROM stories WHERE key = ? ORDER BY created",
+                          (key,)).fetchall()
+        return [(created, story) for created, story in rows if self._fresh(created, now)]
+
+    def _fresh(self, created: float, now: float) -> bool:
+        return self.ttl <= 0 or now - created < self.ttl
+
+    # public API
+    def get(self, key: str, record: bool = True) -> Optional[str]:
+        """Return a cached story for `key`, or None on a miss (counted unless record=False)."""
+        now = time.time()
+        with self._lock:
+            items = self._entries.get(key)
+            if items is None:
+                items = self._load(key, now)
+                if items:
+                    self._store(key, items)
+            fresh = [it for it in items if self._fresh(it[0], now)]
+            if len(fresh) != len(items):
+                self.expired += len(items) - len(fresh)
+                if fresh:
+                    self._entries[key] = fresh
+                else:
+                    self._entries.pop(key, None)
+            if len(fresh) < self.variants:
+                self.misses += record
+                return None
+            self._entries.move_to_end(key)
+            self.hits += record
+            return random.choice(fresh)[1]
+
+    def put(self, key: str, story: str):
+        """Store a generated story; keeps at most `variants` per key."""
+        if not story:
+            return
+        now = time.time()
+        with self._lock:
+            items = self._entries.get(key)
+            # variants persisted before the key left memory (or before a restart)
+            items = list(items) if items is not None else self._load(key, now)
+            items.append((now, story))
+            self._store(key, items[-self.variants:])
+            db = self._conn()
+            if db is not None:
+                db.execute("INSERT INTO stories (key, story, created) VALUES (?, ?, ?)", (key, story, now))
+                # keep the newest `variants` rows for this key
+                db.execute("DELETE FROM stories WHERE key = ? AND rowid NOT IN "
+                           "(SELECT rowid FROM stories WHERE key = ? ORDER BY created DESC LIMIT ?)",
+                           (key, key, self.variants))
+                db.commit()
+
+    def _store(self, key: str, items: List[Tuple[float, str]]):
+        self._entries[key] = items
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            db = self._conn()
+            if db is not None:
+                db.execute("DELETE FROM stories")
+                db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
@@ -0,0 +1,10 @@
+import pytest
+
+import conspiracy_generator
+
+
+@pytest.fixture(autouse=True)
+def fresh_story_state(monkeypatch):
+    """A new scheduler and story cache per test, so slow jobs left by one test do not delay the next."""
+    monkeypatch.setattr(conspiracy_generator, "_SCHEDULER", None)
+    monkeypatch.setattr(conspiracy_generator, "_STORY_CACHE", None)
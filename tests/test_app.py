@@ -0,0 +1,116 @@
+"""
+Story routes of app.py with a stubbed story backend.
+
+Usage:
+    python -m pytest -q tests/test_app.py
+"""
+
+import json
+import time
+import uuid
+
+import pytest
+
+import app as app_module
+import conspiracy_generator
+from artifacts import get_engine
+from speculation import get_speculator
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def slow_backend(monkeypatch):
+    """Story model whose first token takes `delay` seconds."""
+    def install(delay: float):
+        def stream(context):
+            time.sleep(delay)
+            yield "Too"
+            yield " late."
+        monkeypatch.setattr(conspiracy_generator, "stream_conspiracy", stream)
+    return install
+
+
+def _clicks(n: int = 3) -> list:
+    # unique concepts, so no earlier test's story is cached
+    tag = uuid.uuid4().hex[:8]
+    return [f"concept {tag} {i}" for i in range(n)]
+
+
+def _events(resp) -> list:
+    """(seconds since the request, event, data) for each SSE frame."""
+    start, out, buffer = time.monotonic(), [], ""
+    for chunk in resp.response:
+        buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+        while "\n\n" in buffer:
+            frame, buffer = buffer.split("\n\n", 1)
+            event, data = "message", {}
+            for line in frame.splitlines():
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: "):
+                    data = json.loads(line[6:])
+            out.append((time.monotonic() - start, event, data))
+    return out
+
+
+def test_stream_of_slow_speculative_job_respects_deadline(client, slow_backend, monkeypatch):
+    slow_backend(3.0)
+    monkeypatch.setattr(app_module, "STORY_DEADLINE", 0.5)
+    session, clicked = uuid.uuid4().hex, _clicks()
+    get_speculator().observe(session, get_engine().dataset, clicked)
+    start = time.monotonic()
+    resp = client.post("/process_clicks/stream", json={"clicked": clicked, "session": session}, buffered=False)
+    events = _events(resp)
+    assert events[0][1] == "start" and events[0][2]["speculative"]
+    token_at, _, token = events[1]
+    # a fallback story after the deadline, not the speculative story 3 s later
+    assert token_at < 2.0
+    assert token["token"].startswith("Revealed:")
+    assert events[-1][1] == "done"
+    assert time.monotonic() - start < 2.0
+
+
+def test_stream_forwards_speculative_tokens_as_they_arrive(client, slow_backend, monkeypatch):
+    slow_backend(0.3)
+    monkeypatch.setattr(app_module, "STORY_DEADLINE", 5.0)
+    session, clicked = uuid.uuid4().hex, _clicks()
+    get_speculator().observe(session, get_engine().dataset, clicked)
+    resp = client.post("/process_clicks/stream", json={"clicked": clicked, "session": session}, buffered=False)
+    tokens = [data["token"] for _, event, data in _events(resp) if "token" in data]
+    assert "".join(tokens) == "Too late."
+
+
+def test_stream_without_speculation_respects_deadline(client, slow_backend, monkeypatch):
+    slow_backend(3.0)
+    monkeypatch.setattr(app_module, "STORY_DEADLINE", 0.5)
+    resp = client.post("/process_clicks/stream", json={"clicked": _clicks()}, buffered=False)
+    events = _events(resp)
+    assert events[1][0] < 2.0
+    assert events[1][2]["token"].startswith("Revealed:")
+
+
+@pytest.mark.parametrize("route", ["/process_clicks", "/process_clicks/stream", "/speculate"])
+@pytest.mark.parametrize("payload", [{"clicked": [1, 2]}, {"clicked": "Mr. Trump"}, {"clicked": None},
+                                     {"clicked": ["a"], "session": ["s"]}, ["Mr. Trump"]])
+def test_story_routes_reject_malformed_clicks(client, route, payload):
+    resp = client.post(route, json=payload)
+    assert resp.status_code == 400
+    assert "clicked" in resp.get_json()["error"]
+
+
+def test_speculate_accepts_click_path(client):
+    resp = client.post("/speculate", json={"clicked": _clicks(1), "session": uuid.uuid4().hex})
+    assert resp.status_code == 204
+
+
+@pytest.mark.parametrize("route", ["/process_clicks", "/process_clicks/stream"])
+def test_full_story_queue_answers_429(client, route, monkeypatch):
+    monkeypatch.setattr(conspiracy_generator.get_scheduler(), "max_queue", 0)
+    resp = client.post(route, json={"clicked": _clicks()})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
+    assert resp.get_json()["retry_after"] == int(resp.headers["Retry-After"])
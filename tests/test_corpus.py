@@ -0,0 +1,117 @@
+"""
+Corpus segments: binary round trip, and identical filter_docs/assemble_context
+results from the JSON and from the segment.
+
+Usage:
+    python -m pytest -q tests/test_corpus.py
+"""
+
+import json
+import os
+import struct
+
+import pytest
+
+from conspiracy_generator import assemble_context, filter_docs, load_dataset
+from corpus import SEGMENT_MAGIC, SNIPPET_CHARS, Corpus, segment_path
+
+RECORDS = [
+    {"title": "Mayor cleared", "summary": "The charges were dropped on Friday.\nNobody explained why.",
+     "concepts_spacy": ["Mr. Trump", "the charges", "Eric Adams case"]},
+    {"title": "Café “leaks” — part 2", "summary": ["first comment", "second comment ✓"],
+     "concepts_spacy": ["mr.  TRUMP", "the café"]},
+    {"title": "Long read", "summary": "word " * 200, "concepts_spacy": ["the charges", "the charges"]},
+    {"title": "No concepts", "summary": "Nothing to see here.", "concepts_spacy": []},
+    {"title": "", "concept": "Only a concept field", "concepts_spacy": ["Zebra", "aardvark"]},
+]
+
+CLICK_SETS = [["Mr. Trump"], ["the charges", "Eric Adams case"], ["the café", "zebra"],
+              ["unknown concept"], []]
+
+
+@pytest.fixture
+def segment(tmp_path):
+    path = str(tmp_path / "corpus.seg")
+    Corpus.from_records(RECORDS).write_segment(path)
+    return Corpus.open_segment(path)
+
+
+def test_columns_round_trip(segment):
+    built = Corpus.from_records(RECORDS)
+    assert segment.source is not None and built.source is None
+    assert len(segment) == len(built) == len(RECORDS)
+    for a, b in zip(built, segment):
+        assert (a.title, a.snippet, a.concepts, list(a.concept_ids), a.signature) == \
+               (b.title, b.snippet, b.concepts, list(b.concept_ids), b.signature)
+    assert segment[1].title == "Café “leaks” — part 2"
+    assert segment[1].concepts == ["mr. trump", "the café"]
+    assert segment[2].concepts == ["the charges"]
+    assert len(segment[2].snippet) == SNIPPET_CHARS
+    assert "\n" not in segment[0].snippet
+
+
+def test_concept_lookup_by_binary_search(segment):
+    keys = list(segment.concept_keys)
+    assert keys == sorted(keys)
+    for i, key in enumerate(keys):
+        assert segment.concept_id(key) == i
+    assert segment.concept_id("aaa") == segment.concept_id("zzzz") == segment.concept_id("the") == -1
+    assert list(segment.postings(segment.concept_id("the charges"))) == [0, 2]
+
+
+def test_sections_are_aligned(segment):
+    with open(segment.source, "rb") as f:
+        data = f.read()
+    assert data.startswith(SEGMENT_MAGIC)
+    (toc_len,) = struct.unpack_from("<I", data, len(SEGMENT_MAGIC))
+    toc = json.loads(data[len(SEGMENT_MAGIC) + 4:len(SEGMENT_MAGIC) + 4 + toc_len])
+    assert toc["docs"] == len(RECORDS)
+    assert all(offset % 8 == 0 for _, offset, _ in toc["sections"].values())
+
+
+@pytest.mark.parametrize("clicked", CLICK_SETS)
+def test_segment_serves_the_same_context(segment, clicked):
+    built = Corpus.from_records(RECORDS)
+    from_json, from_segment = filter_docs(built, clicked), filter_docs(segment, clicked)
+    assert [d.id for d in from_json] == [d.id for d in from_segment]
+    assert assemble_context(clicked, from_json) == assemble_context(clicked, from_segment)
+
+
+def test_not_a_segment(tmp_path):
+    path = tmp_path / "bad.seg"
+    path.write_bytes(b"BSCORP01" + b"\0" * 64)
+    with pytest.raises(ValueError):
+        Corpus.open_segment(str(path))
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = str(tmp_path / "data.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(RECORDS, f, ensure_ascii=False)
+    return path
+
+
+def test_load_dataset_uses_current_segment(dataset):
+    Corpus.from_records(RECORDS).write_segment(segment_path(dataset))
+    docs = load_dataset(dataset, version="v1")
+    assert docs.source == segment_path(dataset)
+    assert docs.version == "v1"
+
+
+def test_load_dataset_ignores_segment_older_than_json(dataset):
+    seg = segment_path(dataset)
+    Corpus.from_records(RECORDS[:2]).write_segment(seg)
+    stat = os.stat(dataset)
+    os.utime(seg, (stat.st_atime, stat.st_mtime - 60))
+    docs = load_dataset(dataset)
+    assert docs.source is None
+    assert len(docs) == len(RECORDS)
+
+
+def test_load_dataset_ignores_segment_of_old_format(dataset):
+    with open(segment_path(dataset), "wb") as f:
+        f.write(b"BSCORP01" + b"\0" * 64)
+    docs = load_dataset(dataset)
+    assert docs.source is None
+    assert len(docs) == len(RECORDS)
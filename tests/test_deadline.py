@@ -0,0 +1,130 @@
+"""
+Story deadlines and degraded fallbacks (overlap, partial, template) with a
+stub Ollama client that is slow or fails.
+
+Usage:
+    python -m pytest -q tests/test_deadline.py
+"""
+
+import time
+import uuid
+
+import pytest
+
+import conspiracy_generator
+from conspiracy_generator import deadline_stats, generate_story, get_story_cache, story_cache_key
+from corpus import Corpus
+from ollama_client import OllamaError
+
+SENTENCES = ["Revealed: the files were moved at night. ", "Witnesses saw the trucks leave the depot. ",
+             "Nobody signed the ledger that week"]
+
+
+class StubClient:
+    """Streams `tokens`, sleeping `first_delay` before the first and `stall` after `stall_after` of them."""
+
+    def __init__(self, tokens=("A", " story."), first_delay=0.0, stall_after=None, stall=0.0, error=None):
+        self.tokens, self.first_delay, self.stall_after, self.stall = list(tokens), first_delay, stall_after, stall
+        self.error = error
+
+    def stream(self, model, prompt, **kwargs):
+        if self.error:
+            raise self.error
+        time.sleep(self.first_delay)
+        for i, token in enumerate(self.tokens):
+            if i == self.stall_after:
+                time.sleep(self.stall)
+            yield token
+
+
+@pytest.fixture
+def use_client(monkeypatch):
+    def install(client):
+        monkeypatch.setattr(conspiracy_generator, "get_client", lambda: client)
+    return install
+
+
+@pytest.fixture
+def concepts():
+    tag = uuid.uuid4().hex[:8]
+    return [f"{name} {tag}" for name in ("the depot", "the trucks", "the ledger", "the night shift")]
+
+
+@pytest.fixture
+def docs(concepts):
+    records = [{"title": f"Story about {c}", "summary": f"Something happened with {c}.",
+                "concepts_spacy": [c]} for c in concepts]
+    return Corpus.from_records(records)
+
+
+def _soon(seconds=0.3):
+    return time.monotonic() + seconds
+
+
+def test_template_fallback_when_model_is_slow(use_client, docs, concepts):
+    use_client(StubClient(first_delay=1.5))
+    before = deadline_stats()
+    story, info = generate_story(docs, concepts[:2], deadline=_soon())
+    assert info == {"cached": False, "degraded": True, "fallback": "template"}
+    assert story.startswith(f"Revealed: The Hidden Link Between {concepts[0]} and {concepts[1]}")
+    assert f'"Story about {concepts[0]}"' in story
+    after = deadline_stats()
+    assert after["deadline_hits"] == before["deadline_hits"] + 1
+    assert after["template"] == before["template"] + 1
+
+
+def test_late_story_is_cached_for_next_time(use_client, docs, concepts):
+    use_client(StubClient(first_delay=0.6))
+    _, info = generate_story(docs, concepts[:2], deadline=_soon(0.1))
+    assert info["degraded"]
+    time.sleep(1.0)
+    story, info = generate_story(docs, concepts[:2], deadline=_soon())
+    assert (story, info) == ("A story.", {"cached": True})
+
+
+def test_partial_fallback_cuts_at_last_sentence(use_client, docs, concepts):
+    use_client(StubClient(SENTENCES, stall_after=2, stall=1.5))
+    story, info = generate_story(docs, concepts[:2], deadline=_soon(0.5))
+    assert info["fallback"] == "partial"
+    assert story == (SENTENCES[0] + SENTENCES[1]).strip()
+
+
+def test_short_partial_text_is_not_used(use_client, docs, concepts):
+    use_client(StubClient(["Too short. ", "More"], stall_after=1, stall=1.5))
+    _, info = generate_story(docs, concepts[:2], deadline=_soon(0.5))
+    assert info["fallback"] == "template"
+
+
+def test_overlap_fallback_reuses_similar_click_set(use_client, docs, concepts):
+    use_client(StubClient(["The overlapping story."]))
+    first, info = generate_story(docs, concepts[:3], deadline=_soon(5))
+    assert not info["cached"] and "degraded" not in info
+    use_client(StubClient(first_delay=1.5))
+    # Jaccard({a, b, c}, {a, b, d}) = 2/4, the default STORY_OVERLAP_MIN
+    story, info = generate_story(docs, concepts[:2] + concepts[3:], deadline=_soon())
+    assert info["fallback"] == "overlap"
+    assert story == first
+
+
+def test_generation_failure_falls_back(use_client, docs, concepts):
+    use_client(StubClient(error=OllamaError("connection refused")))
+    before = deadline_stats()
+    story, info = generate_story(docs, concepts[:2], deadline=_soon(5))
+    assert info == {"cached": False, "degraded": True, "fallback": "template"}
+    assert story.startswith("Revealed:")
+    assert deadline_stats()["error_hits"] == before["error_hits"] + 1
+    # failures are not cached
+    assert get_story_cache().get(story_cache_key(concepts[:2]), record=False) is None
+
+
+def test_failure_mid_stream_is_not_a_partial_story(use_client, docs, concepts):
+    class Broken(StubClient):
+        def stream(self, model, prompt, **kwargs):
+            yield SENTENCES[0]
+            yield SENTENCES[1]
+            raise OllamaError("stream interrupted")
+
+    use_client(Broken())
+    story, info = generate_story(docs, concepts[:2], deadline=_soon(5))
+    # the text streamed before the failure is long enough, but no longer in flight
+    assert info["fallback"] == "template"
@@ -0,0 +1,93 @@
+"""
+SimHash near-duplicate detection and the dedup in assemble_context.
+
+Usage:
+    python -m pytest -q tests/test_dedup.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conspiracy_generator import assemble_context
+from corpus import Corpus, clean_snippet
+from dedup import DEFAULT_THRESHOLD, MAX_THRESHOLD, NearDuplicateFilter, hamming, simhash
+
+DATASET = "raw_data/final_data/all_spacy_concepts_final.json"
+
+TEXT = ("Insiders say the mayor met the prosecutors twice before the charges were dropped. "
+        "Nobody at city hall will say who asked for the meetings or why they were kept off the "
+        "public calendar, and the notes taken by the two aides who were present have never been "
+        "filed with the court or shared with the defense team. A former clerk claims the same "
+        "room was booked under a different name on both days, and that the visitor logs for that "
+        "floor were replaced the following week")
+
+
+def _record(title, summary, concepts=("the mayor",)):
+    return {"title": title, "summary": summary, "concepts_spacy": list(concepts)}
+
+
+def test_simhash_near_and_far():
+    assert simhash(TEXT) == simhash(TEXT.upper())
+    assert hamming(simhash(TEXT), simhash(TEXT + " today")) <= DEFAULT_THRESHOLD
+    assert hamming(simhash(TEXT), simhash("a completely different story about the moon landing")) > DEFAULT_THRESHOLD
+    assert simhash("") == 0
+
+
+def test_filter_finds_added_signature():
+    seen = NearDuplicateFilter()
+    assert not seen.check_and_add(simhash(TEXT), 7)
+    assert seen.find(simhash(TEXT + " today")) == 7
+    assert seen.check_and_add(simhash(TEXT))
+
+
+def test_signature_covers_title_and_snippet():
+    corpus = Corpus.from_records([_record("A title", TEXT + " " + "filler " * 200)])
+    assert corpus[0].signature == simhash(f"A title {corpus[0].snippet}")
+
+
+def test_context_drops_same_snippet_under_other_title():
+    corpus = Corpus.from_records([_record("Mayor cleared", TEXT),
+                                  _record("You will not believe what the mayor did", TEXT),
+                                  _record("Unrelated", "The moon landing footage was filmed twice")])
+    context, stats = assemble_context(["the mayor"], list(corpus), max_tokens=10_000)
+    assert stats["docs_used"] == 2
+    assert stats["duplicates_dropped"] == 1
+    assert context.count(TEXT[:40]) == 1
+
+
+def test_context_drops_same_opening_with_other_ending():
+    corpus = Corpus.from_records([_record("Helpful insight !", TEXT),
+                                  _record("Helpful insight !", TEXT.split(" A former")[0] + " Edit: source is my cousin.")])
+    _, stats = assemble_context(["the mayor"], list(corpus), max_tokens=10_000)
+    assert stats["docs_used"] == 1
+    assert stats["duplicates_dropped"] == 1
+
+
+@pytest.mark.parametrize("a, b", [(95, 96), (267, 375)])
+def test_known_duplicates_in_dataset(a, b):
+    with open(DATASET, encoding="utf-8") as f:
+        records = json.load(f)
+    pair = [records[a], records[b]]
+    assert clean_snippet(pair[0]).split()[:20] == clean_snippet(pair[1]).split()[:20]
+    concepts = sorted(set(pair[0]["concepts_spacy"]) & set(pair[1]["concepts_spacy"]))
+    corpus = Corpus.from_records(pair)
+    _, stats = assemble_context(concepts[:1], list(corpus), max_tokens=10_000)
+    assert stats["duplicates_dropped"] == 1
+
+
+@pytest.mark.parametrize("threshold", [-1, MAX_THRESHOLD + 1])
+def test_filter_rejects_threshold_outside_band_range(threshold):
+    with pytest.raises(ValueError):
+        NearDuplicateFilter(threshold)
+
+
+def test_bad_context_dedup_bits_fails_at_import():
+    env = dict(os.environ, CONTEXT_DEDUP_BITS=str(MAX_THRESHOLD + 1))
+    proc = subprocess.run([sys.executable, "-c", "import conspiracy_generator"],
+                          env=env, capture_output=True, text=True)
+    assert proc.returncode != 0
+    assert "CONTEXT_DEDUP_BITS" in proc.stderr
@@ -0,0 +1,134 @@
+"""
+Evidence-image jobs: web processes share one image worker through the job files.
+
+Usage:
+    python -m pytest -q tests/test_image_service.py
+"""
+
+import threading
+import time
+
+import pytest
+
+import image_service
+from image_service import DONE, ERROR, QUEUED, RUNNING, ImageQueueFull, ImageService, ImageWorker
+
+
+class StubRender:
+    """Stands in for the Stable Diffusion pipeline; records each batch."""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay, self.fail = delay, fail
+        self.batches = []
+
+    def __call__(self, items, steps, scale):
+        self.batches.append([path for _, path, _ in items])
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("out of memory")
+        for _, path, _ in items:
+            with open(path, "wb") as f:
+                f.write(b"png")
+        return [path for _, path, _ in items]
+
+
+@pytest.fixture
+def start_worker(tmp_path, monkeypatch):
+    """Run an ImageWorker for tmp_path in a thread instead of a worker process."""
+    monkeypatch.setattr(image_service, "start_worker", lambda output_dir: None)
+    stop, threads = threading.Event(), []
+
+    def start(render, window=0.2):
+        worker = ImageWorker(str(tmp_path), window=window, max_batch=4, poll=0.02, render=render)
+        thread = threading.Thread(target=worker.run, args=(stop,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        deadline = time.monotonic() + 5
+        while not image_service.worker_running(str(tmp_path)):
+            assert time.monotonic() < deadline, "worker did not start"
+            time.sleep(0.01)
+        return worker
+
+    yield start
+    stop.set()
+    for thread in threads:
+        thread.join(5)
+
+
+def _wait(service, job_id, statuses=(DONE, ERROR), timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = service.status(job_id)
+        if job["status"] in statuses or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def test_web_processes_share_one_worker_and_batch(tmp_path, start_worker):
+    render = StubRender()
+    start_worker(render, window=0.3)
+    web_a, web_b = ImageService(str(tmp_path)), ImageService(str(tmp_path))
+    a = web_a.submit("The mayor met the prosecutors", ["mayor"])
+    b = web_b.submit("The moon landing was filmed twice", ["moon"])
+    assert a["status"] == b["status"] == QUEUED
+    # each web process answers for the other's job
+    assert _wait(web_b, a["job_id"])["status"] == DONE
+    assert _wait(web_a, b["job_id"])["status"] == DONE
+    assert len(render.batches) == 1
+    assert sorted(render.batches[0]) == sorted([a["path"], b["path"]])
+    stats = web_a.stats()
+    assert stats["worker_ready"] and stats["completed"] == 2 and stats["pending"] == 0
+
+
+def test_second_worker_exits_while_one_serves(tmp_path, start_worker):
+    start_worker(StubRender())
+    assert ImageWorker(str(tmp_path), render=StubRender()).run() is False
+
+
+def test_done_image_is_answered_from_disk(tmp_path, start_worker):
+    render = StubRender()
+    start_worker(render, window=0)
+    web = ImageService(str(tmp_path))
+    job = web.submit("The mayor met the prosecutors")
+    _wait(web, job["job_id"])
+    again = ImageService(str(tmp_path)).submit("The mayor met the prosecutors")
+    assert again["status"] == DONE and again["job_id"] == job["job_id"]
+    assert len(render.batches) == 1
+
+
+def test_queue_depth_is_shared_by_web_processes(tmp_path, start_worker):
+    start_worker(StubRender(delay=1.0), window=0)
+    web_a, web_b = ImageService(str(tmp_path), max_queue=2), ImageService(str(tmp_path), max_queue=2)
+    web_a.submit("first story")
+    web_b.submit("second story")
+    with pytest.raises(ImageQueueFull):
+        web_a.submit("third story")
+    # a job that is already queued is not counted twice
+    assert web_b.submit("first story")["status"] in (QUEUED, RUNNING)
+
+
+def test_failed_render_is_reported_and_can_be_retried(tmp_path, start_worker):
+    render = StubRender(fail=True)
+    start_worker(render, window=0)
+    web = ImageService(str(tmp_path))
+    job = _wait(web, web.submit("The mayor met the prosecutors")["job_id"])
+    assert job["status"] == ERROR and "out of memory" in job["error"]
+    render.fail = False
+    retry = web.submit("The mayor met the prosecutors")
+    assert retry["status"] == QUEUED
+    assert _wait(web, retry["job_id"])["status"] == DONE
+
+
+def test_new_worker_keeps_queued_jobs_and_fails_interrupted_ones(tmp_path, start_worker):
+    web = ImageService(str(tmp_path))
+    queued = web.submit("queued while no worker ran")
+    interrupted = web.submit("being rendered when the worker died")
+    image_service._write_job(str(tmp_path), dict(_read(tmp_path, interrupted["job_id"]), status=RUNNING))
+    start_worker(StubRender(), window=0)
+    assert _wait(web, queued["job_id"])["status"] == DONE
+    job = web.status(interrupted["job_id"])
+    assert job["status"] == ERROR and "exited" in job["error"]
+
+
+def _read(tmp_path, job_id):
+    return image_service._read_job(str(tmp_path), job_id)
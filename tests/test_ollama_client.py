@@ -0,0 +1,104 @@
+"""
+OllamaClient against fake_ollama.py on a free port.
+
+Usage:
+    python -m pytest -q tests/test_ollama_client.py
+"""
+
+import socket
+import threading
+
+import pytest
+
+import fake_ollama
+from ollama_client import OllamaClient, OllamaError
+
+
+def _serve(*args):
+    config = fake_ollama.parse_args(["--ttft-ms", "1", "--tokens-per-s", "2000", "--prompt-rate", "1e6",
+                                     "--max-tokens", "12", "--parallel", "2", "--quiet", *args])
+    server = fake_ollama.make_server(config, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _client(server, **kwargs) -> OllamaClient:
+    kwargs.setdefault("backoff", 0.0)
+    return OllamaClient(f"http://127.0.0.1:{server.server_port}/api/generate", **kwargs)
+
+
+@pytest.fixture
+def server():
+    server = _serve()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_streamed_tokens_join_to_full_text(server):
+    client = _client(server)
+    tokens = list(client.stream("llama2", "Tell me a secret.", max_tokens=8))
+    assert len(tokens) == 8
+    # the fake sends "word", " word", " word", ...
+    assert "".join(tokens) == " ".join(token.strip() for token in tokens)
+    assert client.stats()["requests"] == 1
+
+
+def test_generate_is_the_stripped_stream(server):
+    client = _client(server)
+    text = client.generate("llama2", "Tell me a secret.", max_tokens=5)
+    assert text == text.strip()
+    assert len(text.split()) == 5
+    assert set(text.split()) <= set(fake_ollama.WORDS)
+
+
+def test_keep_alive_and_options_are_sent(server):
+    client = _client(server, keep_alive="7m")
+    client.generate("llama2", "Tell me a secret.", temperature=0.25, max_tokens=3, raw=True)
+    body = server.RequestHandlerClass.received[-1]
+    assert body["model"] == "llama2"
+    assert body["prompt"] == "Tell me a secret."
+    assert body["stream"] is True
+    assert body["keep_alive"] == "7m"
+    assert body["options"] == {"temperature": 0.25, "num_predict": 3}
+    assert body["raw"] is True
+
+
+def test_keep_alive_none_is_not_sent(server):
+    _client(server, keep_alive=None).generate("llama2", "x", max_tokens=1)
+    assert "keep_alive" not in server.RequestHandlerClass.received[-1]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retryable_status_is_retried_until_exhausted(status):
+    server = _serve("--error-rate", "1", "--error-status", str(status))
+    try:
+        with pytest.raises(OllamaError, match=str(status)):
+            _client(server, retries=2).generate("llama2", "x")
+        assert len(server.RequestHandlerClass.received) == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_intermittent_errors_are_retried():
+    server = _serve("--error-rate", "0.5", "--error-status", "503")
+    try:
+        client = _client(server, retries=30)
+        for _ in range(5):
+            assert len(client.generate("llama2", "x", max_tokens=2).split()) == 2
+        assert client.stats()["requests"] == 5
+        assert len(server.RequestHandlerClass.received) >= 5
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_connection_refused_raises_after_retries():
+    # a port that was free a moment ago; nothing listens on it
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    client = OllamaClient(f"http://127.0.0.1:{port}/api/generate", retries=2, backoff=0.0, connect_timeout=1)
+    with pytest.raises(OllamaError, match="after 3 attempts"):
+        client.generate("llama2", "x")
@@ -0,0 +1,106 @@
+"""
+Profiler control file, ProfilingMiddleware and the cProfile session lock.
+
+Usage:
+    python -m pytest -q tests/test_profiler.py
+"""
+
+import cProfile
+import os
+import types
+
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import profiler as profiler_module
+from profiler import Profiler, ProfilingMiddleware
+
+
+def _hello(environ, start_response):
+    return Response("hello")(environ, start_response)
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    return Profiler(directory=str(tmp_path))
+
+
+def test_control_file_is_shared(profiler, tmp_path):
+    assert not profiler.active()
+    profiler.configure(0.5, 60, mode="cprofile", paths=["/api"])
+    assert (tmp_path / "control.json").exists()
+    other = Profiler(directory=str(tmp_path))       # another worker process
+    assert other.active()
+    assert (other.rate, other.mode, other.paths) == (0.5, "cprofile", ["/api"])
+    profiler.disable()
+    other._next_check = 0.0
+    assert not other.active()
+
+
+def test_configure_rejects_unknown_mode(profiler):
+    with pytest.raises(ValueError):
+        profiler.configure(1.0, 60, mode="perf")
+
+
+@pytest.mark.parametrize("mode", ["sample", "cprofile"])
+@pytest.mark.parametrize("request_id", ["abc-def", "req-42", "plain"])
+def test_middleware_echoes_request_id(profiler, tmp_path, mode, request_id):
+    profiler.configure(1.0, 60, mode=mode)
+    client = Client(ProfilingMiddleware(_hello, profiler))
+    resp = client.get("/api/neighbors", headers={"X-Request-ID": request_id})
+    assert resp.get_data() == b"hello"
+    resp.close()
+    assert resp.headers["X-Request-ID"] == request_id
+    suffix = ".prof" if mode == "cprofile" else ".collapsed"
+    assert (tmp_path / f"api_neighbors-{request_id}{suffix}").exists()
+    assert not profiler._cprofile_lock.locked()
+
+
+def test_middleware_generates_id_for_bad_header(profiler):
+    profiler.configure(1.0, 60)
+    resp = Client(ProfilingMiddleware(_hello, profiler)).get("/", headers={"X-Request-ID": "../../etc"})
+    resp.close()
+    assert resp.headers["X-Request-ID"] != "../../etc"
+    assert len(resp.headers["X-Request-ID"]) == 16
+
+
+def test_middleware_skips_other_paths_and_inactive(profiler, tmp_path):
+    client = Client(ProfilingMiddleware(_hello, profiler))
+    assert "X-Request-ID" not in client.get("/").headers
+    profiler.configure(1.0, 60, paths=["/process_clicks"])
+    assert "X-Request-ID" not in client.get("/api/neighbors").headers
+    assert not [n for n in os.listdir(tmp_path) if n != "control.json"]
+
+
+def test_cprofile_sessions_are_exclusive(profiler):
+    profiler.configure(1.0, 60, mode="cprofile")
+    first = profiler.begin("/a")
+    assert first is not None
+    assert profiler.begin("/b") is None
+    assert profiler.skipped_busy == 1
+    first.finish()
+    second = profiler.begin("/b")
+    assert second is not None
+    second.finish()
+
+
+def test_cprofile_lock_released_when_enable_fails(profiler, monkeypatch):
+    class Busy(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError("Another profiling tool is already active")
+
+    profiler.configure(1.0, 60, mode="cprofile")
+    monkeypatch.setattr(profiler_module, "cProfile", types.SimpleNamespace(Profile=Busy))
+    assert profiler.begin("/a") is None
+    assert profiler.skipped_busy == 1
+    assert not profiler._cprofile_lock.locked()
+
+
+def test_cprofile_lock_released_when_dump_fails(profiler):
+    profiler.configure(1.0, 60, mode="cprofile")
+    session = profiler.begin("/a")
+    session.path = os.path.join(profiler.directory, "missing", "a")
+    with pytest.raises(OSError):
+        session.finish()
+    assert not profiler._cprofile_lock.locked()
@@ -0,0 +1,115 @@
+"""
+GenerationScheduler: coalescing, load shedding, cancellation, priorities.
+
+Usage:
+    python -m pytest -q tests/test_scheduler.py
+"""
+
+import threading
+
+import pytest
+
+from conspiracy_generator import PRIORITY_BACKGROUND, GenerationScheduler, QueueFull
+
+
+class Gate:
+    """Job body that blocks until released and records the order jobs ran in."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.ran = []
+
+    def job(self, name):
+        self.ran.append(name)
+        self.started.set()
+        self.release.wait(5)
+        return name
+
+
+@pytest.fixture
+def gate():
+    gate = Gate()
+    yield gate
+    gate.release.set()
+
+
+def _busy(scheduler: GenerationScheduler, gate: Gate):
+    """Occupy the scheduler's only worker until the gate is released."""
+    fut = scheduler.submit("blocker", gate.job, "blocker")
+    assert gate.started.wait(5)
+    return fut
+
+
+def test_same_key_is_coalesced(gate):
+    scheduler = GenerationScheduler(workers=1, max_queue=4)
+    first = scheduler.submit("k", gate.job, "a")
+    second = scheduler.submit("k", gate.job, "b")
+    assert second is first
+    gate.release.set()
+    assert first.result(5) == "a"
+    assert gate.ran == ["a"]
+    assert scheduler.stats()["coalesced"] == 1
+
+
+def test_finished_key_runs_again(gate):
+    gate.release.set()
+    scheduler = GenerationScheduler(workers=1, max_queue=4)
+    assert scheduler.submit("k", gate.job, "a").result(5) == "a"
+    assert scheduler._inflight == {}
+    assert scheduler.submit("k", gate.job, "b").result(5) == "b"
+
+
+def test_full_queue_is_shed_with_retry_after(gate):
+    scheduler = GenerationScheduler(workers=1, max_queue=1)
+    _busy(scheduler, gate)
+    scheduler.submit("queued", gate.job, "queued")
+    with pytest.raises(QueueFull) as err:
+        scheduler.submit("other", gate.job, "other")
+    assert err.value.retry_after >= 1
+    assert scheduler.stats()["rejected"] == 1
+    # a submission sharing a queued job does not need a slot
+    assert scheduler.submit("queued", gate.job, "again") is not None
+
+
+def test_cancelled_job_leaves_queue_and_inflight(gate):
+    scheduler = GenerationScheduler(workers=1, max_queue=1)
+    blocker = _busy(scheduler, gate)
+    fut = scheduler.submit("k", gate.job, "cancelled")
+    assert fut.cancel()
+    assert scheduler.queued == 0
+    assert "k" not in scheduler._inflight
+    # the slot is free again and the key gets a new job
+    again = scheduler.submit("k", gate.job, "again")
+    assert again is not fut
+    gate.release.set()
+    assert again.result(5) == "again"
+    blocker.result(5)
+    assert "cancelled" not in gate.ran
+    assert scheduler._inflight == {}
+    assert scheduler.stats()["cancelled"] == 1
+
+
+def test_user_jobs_run_before_background(gate):
+    scheduler = GenerationScheduler(workers=1, max_queue=8)
+    _busy(scheduler, gate)
+    bg = scheduler.submit("bg", gate.job, "bg", priority=PRIORITY_BACKGROUND)
+    user = scheduler.submit("user", gate.job, "user")
+    gate.release.set()
+    bg.result(5), user.result(5)
+    assert gate.ran == ["blocker", "user", "bg"]
+
+
+def test_user_submit_promotes_queued_background_job(gate):
+    scheduler = GenerationScheduler(workers=1, max_queue=8)
+    _busy(scheduler, gate)
+    older = scheduler.submit("older", gate.job, "older", priority=PRIORITY_BACKGROUND)
+    speculative = scheduler.submit("spec", gate.job, "spec", priority=PRIORITY_BACKGROUND)
+    assert scheduler.submit("spec", gate.job, "spec") is speculative
+    assert scheduler.queued == 2
+    gate.release.set()
+    older.result(5), speculative.result(5)
+    # ran once, ahead of the background job queued before it
+    assert gate.ran == ["blocker", "spec", "older"]
+    assert scheduler.stats()["promoted"] == 1
+    assert scheduler.queued == 0
@@ -0,0 +1,100 @@
+"""
+StoryCache: LRU eviction, TTL, variants and SQLite persistence.
+
+Usage:
+    python -m pytest -q tests/test_story_cache.py
+"""
+
+import pytest
+
+import story_cache
+from story_cache import StoryCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time() for story_cache."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(story_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_hit_miss_and_lru_eviction():
+    cache = StoryCache(max_size=2, path=None)
+    assert cache.get("a") is None
+    cache.put("a", "story a")
+    cache.put("b", "story b")
+    assert cache.get("a") == "story a"      # a is now most recently used
+    cache.put("c", "story c")
+    assert cache.get("b", record=False) is None
+    assert cache.get("a") == "story a"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (2, 1, 1, 2)
+
+
+def test_empty_story_is_not_cached():
+    cache = StoryCache(path=None)
+    cache.put("a", "")
+    assert cache.get("a") is None
+
+
+def test_ttl(clock):
+    cache = StoryCache(ttl=60, path=None)
+    cache.put("a", "story")
+    clock[0] += 59
+    assert cache.get("a") == "story"
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_ttl_zero_keeps_forever(clock):
+    cache = StoryCache(ttl=0, path=None)
+    cache.put("a", "story")
+    clock[0] += 10 ** 9
+    assert cache.get("a") == "story"
+
+
+def test_variants_miss_until_enough_are_stored():
+    cache = StoryCache(variants=3, path=None)
+    for i in range(3):
+        assert cache.get("a") is None
+        cache.put("a", f"v{i}")
+    assert {cache.get("a") for _ in range(200)} == {"v0", "v1", "v2"}
+    cache.put("a", "v3")
+    assert {cache.get("a") for _ in range(200)} == {"v1", "v2", "v3"}
+
+
+def test_persistence_survives_restart(tmp_path, clock):
+    path = str(tmp_path / "stories.sqlite")
+    StoryCache(path=path).put("a", "persisted")
+    restarted = StoryCache(path=path)
+    assert restarted.get("a") == "persisted"
+    clock[0] += story_cache.STORY_CACHE_TTL + 1
+    assert StoryCache(path=path).get("a") is None
+
+
+def test_persisted_variants_are_kept_after_eviction(tmp_path, clock):
+    path = str(tmp_path / "stories.sqlite")
+    cache = StoryCache(max_size=1, variants=2, path=path)
+    cache.put("a", "v0")
+    clock[0] += 1
+    cache.put("b", "other")                 # evicts a from memory
+    clock[0] += 1
+    cache.put("a", "v1")
+    # memory and disk agree: both variants, before and after a restart
+    assert {cache.get("a") for _ in range(100)} == {"v0", "v1"}
+    assert {StoryCache(variants=2, path=path).get("a") for _ in range(100)} == {"v0", "v1"}
+    clock[0] += 1
+    cache.put("a", "v2")
+    assert {StoryCache(variants=2, path=path).get("a") for _ in range(100)} == {"v1", "v2"}
+
+
+def test_clear_removes_persisted_stories(tmp_path):
+    path = str(tmp_path / "stories.sqlite")
+    cache = StoryCache(path=path)
+    cache.put("a", "story")
+    cache.clear()
+    assert cache.get("a") is None
+    assert StoryCache(path=path).get("a") is None
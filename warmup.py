@@ -0,0 +1,243 @@
+"""
+warmup.py
+
+Warm-up and readiness. The first requests after a deploy are slow: the
+neighbor cache is empty, Ollama has to load the story model, and the story
+scheduler, connection pools and SQLite story cache are created lazily. A
+warm-up run does that work up front:
+
+- artifacts  load the current artifact version (see artifacts.py)
+- neighbors  look up the WARMUP_QUERIES most frequent historical queries
+             (the most frequent graph nodes while there is no history) and
+             fill the graph's neighbor cache; this is the lookup behind
+             similar_to, without marking the queries as seen
+- ollama     one-token story generation, so the model is loaded and kept
+             for OLLAMA_KEEP_ALIVE with the instruction prefix cached
+- stories    load the stories of the WARMUP_CLICKSETS most frequent
+             historical click sets from the persistent story cache, and
+             optionally queue background generations (WARMUP_STORIES) for
+             those that are missing
+
+History comes from QUERY_LOG, a JSON-lines file every worker appends the
+queries and click sets it serves to; only its last WARMUP_HISTORY_BYTES are
+read. The log is off unless QUERY_LOG is set: it records what users search
+for and grows without bound, so enable it only where that is acceptable and
+rotate it by copy-and-truncate (workers keep their file open in append mode).
+
+A failing step is reported but does not keep the worker unready: an Ollama
+outage should not take the graph pages out of rotation.
+
+Each gunicorn worker warms itself in a background thread right after it
+starts and answers /readyz with 503 until that is done, so the load
+balancer only routes to warm workers; /healthz is plain liveness. A hot
+reload warms the new version's neighbor cache before swapping it in, and
+POST /admin/warmup runs the whole warm-up again.
+
+Configuration (environment):
+- QUERY_LOG             query/click history file, e.g. "logs/queries.jsonl" (default "": off)
+- WARMUP_HISTORY_BYTES  tail of the history read at warm-up (default 4 MB)
+- WARMUP_QUERIES        queries replayed into the neighbor cache (default 200)
+- WARMUP_CLICKSETS      click sets whose cached stories are loaded (default 50)
+- WARMUP_STORIES        missing stories generated in the background (default 0)
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from artifacts import Engine, get_engine, get_reloader
+from conspiracy_generator import (PRIORITY_BACKGROUND, QueueFull, _generate_uncached, assemble_context,
+                                  filter_docs, get_scheduler, get_story_cache, normalize_concept,
+                                  story_cache_key, warm_story_model)
+from metrics import observe
+
+QUERY_LOG = os.getenv("QUERY_LOG", "")
+WARMUP_HISTORY_BYTES = int(os.getenv("WARMUP_HISTORY_BYTES", str(4 * 1024 * 1024)))
+WARMUP_QUERIES = int(os.getenv("WARMUP_QUERIES", "200"))
+WARMUP_CLICKSETS = int(os.getenv("WARMUP_CLICKSETS", "50"))
+WARMUP_STORIES = int(os.getenv("WARMUP_STORIES", "0"))
+
+
+class QueryLog:
+    """Append-only JSON-lines log of served queries and click sets, shared by all workers."""
+
+    def __init__(self, path: str = QUERY_LOG):
+        self.path = path
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _append(self, entry: dict):
+        if not self.path:
+            return
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                # files must not be shared across fork()
+                if self._file is None or self._pid != os.getpid():
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8")
+                    self._pid = os.getpid()
+                # one write per line; O_APPEND keeps lines from different workers whole
+                self._file.write(line)
+                self._file.flush()
+            except OSError:
+                pass
+
+    def record_query(self, query: str):
+        if query:
+            self._append({"t": int(time.time()), "q": query})
+
+    def record_clicks(self, clicked: List[str]):
+        if clicked:
+            self._append({"t": int(time.time()), "clicks": clicked})
+
+    def top(self, max_bytes: int = WARMUP_HISTORY_BYTES) -> Tuple[Counter, Counter]:
+        """(query counts, click set counts) over the tail of the log."""
+        queries, click_sets = Counter(), Counter()
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                start = max(0, f.tell() - max_bytes)
+                f.seek(start)
+                data = f.read()
+        except OSError:
+            return queries, click_sets
+        lines = data.splitlines()
+        if start > 0:
+            lines = lines[1:]       # partial first line
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry.get("q"), str):
+                queries[entry["q"]] += 1
+            elif isinstance(entry.get("clicks"), list):
+                clicks = tuple(sorted({normalize_concept(str(c)) for c in entry["clicks"]}))
+                if clicks:
+                    click_sets[clicks] += 1
+        return queries, click_sets
+
+
+_QUERY_LOG: Optional[QueryLog] = None
+
+
+def get_query_log() -> QueryLog:
+    global _QUERY_LOG
+    if _QUERY_LOG is None:
+        _QUERY_LOG = QueryLog()
+    return _QUERY_LOG
+
+
+class Warmup:
+    def __init__(self, queries: int = WARMUP_QUERIES, click_sets: int = WARMUP_CLICKSETS,
+                 stories: int = WARMUP_STORIES):
+        self.queries = queries
+        self.click_sets = click_sets
+        self.stories = stories
+        self.ready = False
+        self.runs = 0
+        self.started_at: Optional[float] = None
+        self.seconds: Optional[float] = None
+        self.steps: Dict[str, dict] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # a hot-reloaded version gets a warm neighbor cache before it serves
+        get_reloader().prepare.append(self.warm_neighbors)
+
+    def start(self) -> bool:
+        """Run the warm-up in a background thread; False if one is already running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+            return True
+
+    def run(self):
+        self.started_at = time.time()
+        start = time.perf_counter()
+        queries, click_sets = get_query_log().top()
+        engine = self._step("artifacts", lambda: get_engine())
+        if engine is not None:
+            self._step("neighbors", lambda: self.warm_neighbors(engine, queries))
+            self._step("ollama", warm_story_model)
+            self._step("stories", lambda: self.warm_stories(engine, click_sets))
+        self.seconds = time.perf_counter() - start
+        self.runs += 1
+        self.ready = engine is not None
+        observe("warmup", self.seconds)
+        print(f"Warm-up done in {self.seconds:.2f}s: " +
+              ", ".join(f"{name} {'failed' if 'error' in step else format(step['seconds'], '.2f') + 's'}"
+                        for name, step in self.steps.items()))
+
+    def _step(self, name: str, fn):
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            self.steps[name] = {"error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - start}
+            return None
+        details = result if isinstance(result, dict) else {}
+        self.steps[name] = {"seconds": time.perf_counter() - start, **details}
+        return result
+
+    def warm_neighbors(self, engine: Engine, queries: Optional[Counter] = None) -> dict:
+        if queries is None:
+            queries = get_query_log().top()[0]
+        top = [q for q, _ in queries.most_common(self.queries)]
+        # node names are what clicks navigate to; gensim keeps them most frequent first
+        for node in engine.graph.all_queries:
+            if len(top) >= self.queries:
+                break
+            if node not in queries:
+                top.append(node)
+        for query in top:
+            engine.graph.neighbors(query)
+        return {"queries": len(top), "from_history": min(len(queries), self.queries)}
+
+    def warm_stories(self, engine: Engine, click_sets: Counter) -> dict:
+        cache, docs = get_story_cache(), engine.dataset
+        loaded = queued = 0
+        missing = []
+        for clicks, _ in click_sets.most_common(self.click_sets):
+            key = story_cache_key(list(clicks), data_version=docs.version)
+            if cache.get(key, record=False) is not None:
+                loaded += 1
+            else:
+                missing.append((key, list(clicks)))
+        if missing:
+            # first use of the filter/context path outside a user request
+            assemble_context(missing[0][1], filter_docs(docs, missing[0][1]))
+        for key, clicks in missing[:self.stories]:
+            try:
+                get_scheduler().submit(key, _generate_uncached, docs, clicks, key, priority=PRIORITY_BACKGROUND)
+                queued += 1
+            except QueueFull:
+                break
+        return {"click_sets": min(len(click_sets), self.click_sets), "loaded": loaded, "queued": queued}
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "runs": self.runs,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "steps": self.steps,
+            "version": get_engine().version if self.ready else None,
+        }
+
+
+_WARMUP: Optional[Warmup] = None
+
+
+def get_warmup() -> Warmup:
+    global _WARMUP
+    if _WARMUP is None:
+        _WARMUP = Warmup()
+    return _WARMUP
@@ -0,0 +1,55 @@
+"""
+wsgi.py
+
+Production entry point. Importing this module loads everything expensive
+(node2vec model, corpus, concept index and SimHash signatures) so that a
+pre-fork server with preloading does it once in the master and the workers
+share those pages copy-on-write. The corpus and its concept index are
+mmapped from the published segment when there is one (see corpus.py), which
+the workers share through the page cache instead:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+A hot reload (artifacts.py) replaces these objects in the worker that
+reloads; the master keeps the version it preloaded and a worker forked
+later catches up on its first request.
+
+Worker-local resources (story scheduler threads, Ollama connection pool,
+SQLite connection) are already created lazily per process and are not
+touched here; the shared image worker is started by gunicorn.conf.py.
+"""
+
+import gc
+import os
+
+import belief_graph
+import conspiracy_generator
+from app import app
+from artifacts import get_engine
+
+
+def _heavy_objects() -> dict:
+    dataset = get_engine().dataset
+    return {
+        "belief_graph.model": id(belief_graph.model),
+        "engine.dataset": id(dataset),
+        "concept_index": id(conspiracy_generator.get_concept_index(dataset)),
+    }
+
+
+# process that loaded the heavy objects; gunicorn.conf.py compares it with
+# each worker's pid to make sure they were not loaded again after fork
+LOADED_IN_PID = os.getpid()
+HEAVY_OBJECTS = _heavy_objects()
+
+# move everything loaded so far out of the collector's view: collections in
+# the workers would otherwise write to (and un-share) these objects' pages
+gc.collect()
+gc.freeze()
+
+
+def check_preloaded() -> list:
+    """Names of heavy objects that were (re)created in this process rather than inherited."""
+    if LOADED_IN_PID == os.getpid():
+        return sorted(HEAVY_OBJECTS)
+    return sorted(name for name, obj_id in _heavy_objects().items() if HEAVY_OBJECTS[name] != obj_id)